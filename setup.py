@@ -6,7 +6,7 @@ with open("README.md", "r") as fh:
 setup(
     name = 'tiered_antibiotic_resistance_model',
     packages=find_packages(),
-    version = '4.0.0',
+    version = '5.0.0',
     license='MIT',
     description = 'A validated computational model of the spread of an antibiotic resistant pathogens in a hospital, with and without our diagnostic tool for quickly identifying it',
     long_description=long_description,
@@ -18,6 +18,7 @@ setup(
     keywords = ['iGEM', 'synthetic biology', 'model'],
     install_requires = [
         'matplotlib',
+        'numpy',
         'pandas',
         'seaborn'
     ],
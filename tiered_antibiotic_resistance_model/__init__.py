@@ -1,5 +1,16 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-from .model import Params, Settings, Infection, Treatment, Person, Model, DataHandler, DataRenderer, decision, run, run_and_output
-from .model_minimal import Params, Settings, Infection, Treatment, Person, Model, DataHandler, decision, run
+from .model import Params, Settings, Config, default_death_function, CompiledParams, get_compiled_params, Infection, Treatment, Person, Model, DataHandler, DataRenderer, decision, RandomStream, run, run_and_output
+from .model_minimal import Params, Settings, Config, default_death_function, CompiledParams, get_compiled_params, Infection, Treatment, Person, Model, DataHandler, decision, RandomStream, run
+from .model_vectorised import VectorisedModel, ArrayRandomStream, SynchronisedRandomStream, run_vectorised, run_vectorised_batch
+from .model_compartmental import CompartmentalModel, run_compartmental
+from .model_event_driven import EventDrivenModel, run_event_driven
+from .ensemble import run_ensemble, run_batched_ensemble, run_adaptive_ensemble, spawn_seeds, get_series, get_series_labels, confidence_interval, antithetic_confidence_interval
+from .cache import ResultCache
+from .comparison import run_paired_comparison
+from .design import grid_design, latin_hypercube_design, sobol_design
+from .branches import run_branches
+from .rare_events import resistant_infections, run_splitting
+from .sensitivity import saltelli_design, morris_design, sobol_indices, morris_screening
+from .surrogate import Emulator, train_emulator
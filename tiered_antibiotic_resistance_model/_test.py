@@ -1,8 +1,23 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import unittest, math
-from .model_minimal import Params, Settings, Infection, Treatment, Person, Model, DataHandler, decision, run
+import unittest, unittest.mock, math, pickle, threading, os, tempfile, inspect
+import pandas as pd
+import numpy as np
+from .model_minimal import Params, Settings, Config, default_death_function, CompiledParams, get_compiled_params, Infection, Treatment, Person, Model, DataHandler, decision, RandomStream, run
+from .model_vectorised import VectorisedModel, ArrayRandomStream, SynchronisedRandomStream, run_vectorised, run_vectorised_batch
+from .model_compartmental import CompartmentalModel, run_compartmental
+from .model_event_driven import rate, repeating_rate, run_event_driven
+from .ensemble import run_ensemble, run_batched_ensemble, run_adaptive_ensemble, get_final_deaths, get_peak_isolated, get_time_to_resistance, spawn_seeds, get_series, get_series_labels, t_critical_value, confidence_interval, antithetic_confidence_interval
+from . import cache as cache_module, ensemble as ensemble_module, model_vectorised
+from .cache import ResultCache, get_engine_version
+from .comparison import run_paired_comparison, get_outcomes as get_comparison_outcomes
+from .branches import run_branches
+from .rare_events import resistant_infections, run_splitting
+from .sensitivity import saltelli_design, morris_design, sobol_indices, morris_screening
+from .surrogate import Emulator, get_outcomes, train_emulator
+from .design import grid_design, latin_hypercube_design, sobol_design, sobol_samples, get_config
+from .sweep import get_summary_labels, run_sweep, main as sweep_main
 
 # Convert unit tests to property based tests by iterating them, so the random
 # input state will test across the input domain
@@ -67,13 +82,50 @@ def set_no_deaths_recoveries():
     Params.NUM_TIMESTEPS = 3 * Params.TIMESTEPS_MOVE_UP_LAG_TIME
 
 
-class TestModel(unittest.TestCase):
+def get_test_config(**overrides):
+    """Return a small config with enough going on that runs vary, pinned
+    rather than following Params, with some parameters overridden"""
+    parameters = dict(
+        NUM_TIMESTEPS=15, POPULATION_SIZE=100, INITIALLY_INFECTED=10,
+        PROBABILITY_GENERAL_RECOVERY=0, PROBABILITY_TREATMENT_RECOVERY=0.3,
+        PROBABILITY_MUTATION=0.25, PROBABILITY_DEATH=0.015,
+        DEATH_FUNCTION=default_death_function, PROBABILITY_SPREAD=0.25, NUM_SPREAD_TO=1,
+    )
+    parameters.update(overrides)
+    return Config.from_params().replace(**parameters)
+
+
+class EngineTests:
+    """Tests which every engine passes, run for each engine by the test case
+    of that engine, which sets `engine` to its run function"""
+    engine = None
+
+    def test_move_up_all_treatment_slow(self):
+        """100% infected, 100% mutation chance, 100% move up treatment, 10 days
+        lag for move up -> 100% with lvl 3 resistance but only over time."""
+        Params.INITIALLY_INFECTED = Params.POPULATION_SIZE
+        Params.PROBABILITY_MUTATION = 1
+        Params.PROBABILITY_MOVE_UP_TREATMENT = 1
+        Params.TIMESTEPS_MOVE_UP_LAG_TIME = 10
+        Params.NUM_TIMESTEPS = 3 * Params.TIMESTEPS_MOVE_UP_LAG_TIME
+        set_no_deaths_recoveries()
+        Params.reset_granular_parameters()
+        for _ in range(PROPERTY_BASED_TESTING_REPEATS):
+            m = self.engine()
+            self.assertEqual(m.data_handler.get_infected_data()[0][0], Params.POPULATION_SIZE)
+            self.assertEqual(m.data_handler.get_infected_data()[0][-1], 0)
+            self.assertEqual(m.data_handler.get_infected_data()[1][1], Params.POPULATION_SIZE)
+            self.assertEqual(m.data_handler.get_infected_data()[1][Params.TIMESTEPS_MOVE_UP_LAG_TIME+2], 0)
+            self.assertEqual(m.data_handler.get_infected_data()[2][Params.TIMESTEPS_MOVE_UP_LAG_TIME+2], Params.POPULATION_SIZE)
+            self.assertEqual(m.data_handler.get_infected_data()[-1][-1], Params.POPULATION_SIZE)
+        reset_params()
+
     def test_empty_model(self):
         """Test that a model with no infected people always stays fully uninfected"""
         # Change parameters for the test setup and run the test
         Params.INITIALLY_INFECTED = 0
         for _ in range(PROPERTY_BASED_TESTING_REPEATS):
-            m = run()
+            m = self.engine()
             self.assertEqual(m.data_handler.get_uninfected_data(),
                             [Params.POPULATION_SIZE]*Params.NUM_TIMESTEPS)
             self.assertEqual(m.data_handler.get_infected_data()[0],
@@ -88,11 +140,10 @@ class TestModel(unittest.TestCase):
         Params.PROBABILITY_TREATMENT_RECOVERY = 0
         Params.reset_granular_parameters()
         for _ in range(PROPERTY_BASED_TESTING_REPEATS):
-            m = run()
+            m = self.engine()
             self.assertEqual(m.data_handler.get_death_data()[-1], Params.POPULATION_SIZE)
         reset_params()
 
-
     def test_all_infected_certain_recovery(self):
         """100% infected, 0% death chance, 100% recovery -> 100% immune"""
         Params.INITIALLY_INFECTED = Params.POPULATION_SIZE
@@ -102,10 +153,40 @@ class TestModel(unittest.TestCase):
         Params.PROBABILITY_TREATMENT_RECOVERY = 1
         Params.reset_granular_parameters()
         for _ in range(PROPERTY_BASED_TESTING_REPEATS):
-            m = run()
+            m = self.engine()
             self.assertEqual(m.data_handler.get_immune_data()[-1], Params.POPULATION_SIZE)
         reset_params()
 
+    def test_no_spread_num(self):
+        """1 infected, 100% infection chance, 0 infected per infection -> 1
+        infected"""
+        Params.INITIALLY_INFECTED = 1
+        Params.PROBABILITY_SPREAD = 1
+        Params.NUM_SPREAD_TO = 0
+        Params.PROBABILITY_MUTATION = 0
+        set_no_deaths_recoveries()
+        Params.reset_granular_parameters()
+        for _ in range(PROPERTY_BASED_TESTING_REPEATS):
+            m = self.engine()
+            self.assertEqual(m.data_handler.get_infected_data()[0], [1]*Params.NUM_TIMESTEPS)
+        reset_params()
+
+    def test_disjoint_states(self):
+        """Check over all timesteps that the states are disjoint"""
+        for _ in range(PROPERTY_BASED_TESTING_REPEATS):
+            m = self.engine()
+            for i in range(Params.NUM_TIMESTEPS):
+                infected = sum([x[i] for x in m.data_handler.get_infected_data()])
+                dead = m.data_handler.get_death_data()[i]
+                immune = m.data_handler.get_immune_data()[i]
+                uninfected = m.data_handler.get_uninfected_data()[i]
+                self.assertEqual(sum([infected, dead, immune, uninfected]),Params.POPULATION_SIZE)
+        reset_params()
+
+
+class TestModel(EngineTests, unittest.TestCase):
+    engine = staticmethod(run)
+
     def test_total_spread(self):
         """1 infected, 100% infection chance, 50 infected per infection-> 100%
         infected"""
@@ -132,20 +213,6 @@ class TestModel(unittest.TestCase):
                 self.assertEqual(m.data_handler.get_infected_data()[0][-1], Params.POPULATION_SIZE)
         reset_params()
 
-    def test_no_spread_num(self):
-        """1 infected, 100% infection chance, 0 infected per infection -> 1
-        infected"""
-        Params.INITIALLY_INFECTED = 1
-        Params.PROBABILITY_SPREAD = 1
-        Params.NUM_SPREAD_TO = 0
-        Params.PROBABILITY_MUTATION = 0
-        set_no_deaths_recoveries()
-        Params.reset_granular_parameters()
-        for _ in range(PROPERTY_BASED_TESTING_REPEATS):
-            m = run()
-            self.assertEqual(m.data_handler.get_infected_data()[0], [1]*Params.NUM_TIMESTEPS)
-        reset_params()
-
     def test_no_spread_percent(self):
         """1 infected, 0% infection chance, 100 infected per infection -> 1
         infected"""
@@ -191,26 +258,6 @@ class TestModel(unittest.TestCase):
             self.assertEqual(m.data_handler.get_infected_data()[-1][-1], Params.POPULATION_SIZE)
         reset_params()
 
-    def test_move_up_all_treatment_slow(self):
-        """100% infected, 100% mutation chance, 100% move up treatment, 10 days
-        lag for move up -> 100% with lvl 3 resistance but only over time."""
-        Params.INITIALLY_INFECTED = Params.POPULATION_SIZE
-        Params.PROBABILITY_MUTATION = 1
-        Params.PROBABILITY_MOVE_UP_TREATMENT = 1
-        Params.TIMESTEPS_MOVE_UP_LAG_TIME = 10
-        Params.NUM_TIMESTEPS = 3 * Params.TIMESTEPS_MOVE_UP_LAG_TIME
-        set_no_deaths_recoveries()
-        Params.reset_granular_parameters()
-        for _ in range(PROPERTY_BASED_TESTING_REPEATS):
-            m = run()
-            self.assertEqual(m.data_handler.get_infected_data()[0][0], Params.POPULATION_SIZE)
-            self.assertEqual(m.data_handler.get_infected_data()[0][-1], 0)
-            self.assertEqual(m.data_handler.get_infected_data()[1][1], Params.POPULATION_SIZE)
-            self.assertEqual(m.data_handler.get_infected_data()[1][Params.TIMESTEPS_MOVE_UP_LAG_TIME+2], 0)
-            self.assertEqual(m.data_handler.get_infected_data()[2][Params.TIMESTEPS_MOVE_UP_LAG_TIME+2], Params.POPULATION_SIZE)
-            self.assertEqual(m.data_handler.get_infected_data()[-1][-1], Params.POPULATION_SIZE)
-        reset_params()
-
     def test_ioslation_no_move_up(self):
         """100% infected, 100% mutation chance, 0% move up treatment, isolation
         threshold = 1, no product -> 0% isolated"""
@@ -242,16 +289,1226 @@ class TestModel(unittest.TestCase):
             self.assertEqual(m.data_handler.get_isolated_data()[-1], Params.POPULATION_SIZE)
         reset_params()
 
-    def test_disjoint_states(self):
-        """Check over all timesteps that the states are disjoint"""
+
+class TestVectorisedModel(EngineTests, unittest.TestCase):
+    engine = staticmethod(run_vectorised)
+
+
+class TestCompartmentalModel(EngineTests, unittest.TestCase):
+    engine = staticmethod(run_compartmental)
+
+    def test_population_size_independent(self):
+        """A large population runs as a small one does, as only counts are held"""
+        m = CompartmentalModel(population_size=10**9, initially_infected=10, random_seed=0)
+        m.run()
+        self.assertEqual(m.infected.shape[1:3], (Params.NUM_RESISTANCES+1, Params.NUM_TIMESTEPS+1))
+
+
+class TestEventDrivenModel(EngineTests, unittest.TestCase):
+    engine = staticmethod(run_event_driven)
+
+    def test_empty_model_no_events(self):
+        """A model with no infected people never has any events"""
+        Params.INITIALLY_INFECTED = 0
+        for _ in range(PROPERTY_BASED_TESTING_REPEATS):
+            self.assertEqual(run_event_driven().events, [])
+        reset_params()
+
+    def test_certain_death_within_timestep(self):
+        """100% infected, 100% death chance, 0% recovery -> everyone dies
+        within the first timestep, as the rate of death is infinite"""
+        Params.INITIALLY_INFECTED = Params.POPULATION_SIZE
+        Params.PROBABILITY_DEATH = 1
+        Params.PROBABILITY_GENERAL_RECOVERY = 0
+        Params.PROBABILITY_TREATMENT_RECOVERY = 0
+        Params.reset_granular_parameters()
+        for _ in range(PROPERTY_BASED_TESTING_REPEATS):
+            m = run_event_driven()
+            self.assertEqual(m.data_handler.get_death_data()[1], Params.POPULATION_SIZE)
+        reset_params()
+
+    def test_rate(self):
+        """A rate has an event within one unit of time with its probability"""
+        self.assertEqual(rate(0), 0)
+        self.assertEqual(rate(1), math.inf)
+        self.assertAlmostEqual(1 - math.exp(-rate(0.3)), 0.3)
+
+    def test_repeating_rate(self):
+        """A repeating rate has the probability as its expected number of
+        events within one unit of time"""
+        self.assertEqual(repeating_rate(0), 0)
+        self.assertEqual(repeating_rate(1), math.inf)
+        self.assertEqual(repeating_rate(0.3), 0.3)
+
+    def test_spread_matches_timesteps(self):
+        """With only spreading, which happens at the end of each timestep as in
+        Model, the number of uninfected people over a set of runs matches the
+        timestep model within the spread of the runs at each timestep"""
+        config = Config.from_params().replace(
+            NUM_TIMESTEPS=20, POPULATION_SIZE=500, INITIALLY_INFECTED=10,
+            PROBABILITY_GENERAL_RECOVERY=0, PROBABILITY_TREATMENT_RECOVERY=0,
+            PROBABILITY_MUTATION=0, PROBABILITY_DEATH=0,
+            DEATH_FUNCTION=lambda p, t: p, PROBABILITY_SPREAD=0.25, NUM_SPREAD_TO=1,
+        )
+        timesteps, events = (
+            np.array([run_engine(config, random_seed).data_handler.get_uninfected_data()
+                      for random_seed in range(20)])
+            for run_engine in (run, run_event_driven)
+        )
+        standard_error = np.sqrt((timesteps.var(axis=0) + events.var(axis=0)) / 20)
+        self.assertTrue(np.all(abs(timesteps.mean(axis=0) - events.mean(axis=0))
+                               <= 3 * standard_error))
+
+    def test_full_run_matches_timesteps(self):
+        """With small chances of each event in a timestep, where the events of
+        a person rarely compete within one, the final deaths and peak isolated
+        people over a set of full runs match the timestep model within the
+        spread of the runs"""
+        config = Config.from_params().replace(
+            NUM_TIMESTEPS=240, POPULATION_SIZE=500, INITIALLY_INFECTED=10,
+            PROBABILITY_GENERAL_RECOVERY=0, PROBABILITY_TREATMENT_RECOVERY=0.075,
+            PROBABILITY_MUTATION=0.0625, PROBABILITY_DEATH=0.00375,
+            DEATH_FUNCTION=lambda p, t: p, PROBABILITY_SPREAD=0.0625,
+            NUM_SPREAD_TO=1, PROBABILITY_MOVE_UP_TREATMENT=0.05,
+        )
+        outcomes = []
+        for run_engine in (run, run_event_driven):
+            models = [run_engine(config, random_seed) for random_seed in range(20)]
+            outcomes.append(np.array([
+                [m.data_handler.get_death_data()[-1] for m in models],
+                [max(m.data_handler.get_isolated_data()) for m in models],
+            ]))
+        timesteps, events = outcomes
+        standard_error = np.sqrt((timesteps.var(axis=1) + events.var(axis=1)) / 20)
+        self.assertTrue(np.all(abs(timesteps.mean(axis=1) - events.mean(axis=1))
+                               < 3 * standard_error))
+
+    def test_constant_death_matches_timesteps(self):
+        """With only a constant chance of death, the number alive at each
+        timestep matches the expected number from the timestep model"""
+        Params.INITIALLY_INFECTED = Params.POPULATION_SIZE
+        set_no_deaths_recoveries()
+        Params.PROBABILITY_DEATH = 0.1
+        Params.DEATH_FUNCTION = lambda p, t: p
+        Params.PROBABILITY_MUTATION = 0
+        Params.reset_granular_parameters()
+        m = run_event_driven()
+        for i in (1, 5, 10):
+            expected = Params.POPULATION_SIZE * (1 - 0.9**i)
+            self.assertLess(abs(m.data_handler.get_death_data()[i] - expected),
+                            5 * math.sqrt(expected))
+        reset_params()
+
+
+class TestEarlyTermination(unittest.TestCase):
+    def test_burnt_out_series_length(self):
+        """Once everyone has died, every engine still records data for every
+        timestep, repeating the final counts"""
+        Params.INITIALLY_INFECTED = Params.POPULATION_SIZE
+        Params.PROBABILITY_DEATH = 1
+        Params.PROBABILITY_GENERAL_RECOVERY = 0
+        Params.PROBABILITY_TREATMENT_RECOVERY = 0
+        Params.reset_granular_parameters()
+        for run_engine in (run, run_vectorised, run_compartmental, run_event_driven):
+            m = run_engine()
+            self.assertEqual(m.data_handler.time, list(range(Params.NUM_TIMESTEPS)))
+            self.assertEqual(m.data_handler.get_death_data(),
+                            [0] + [Params.POPULATION_SIZE]*(Params.NUM_TIMESTEPS-1))
+            self.assertEqual(m.data_handler.get_isolated_data(), [0]*Params.NUM_TIMESTEPS)
+        reset_params()
+
+    def test_fill_timesteps(self):
+        """Test that the data handler stores the current timestep's data for
+        the remaining timesteps"""
+        d = DataHandler()
+        d.record_counts([1, 0, 0, 0], 0, 0, 2, 1)
+        d.process_timestep_data()
+        d.record_counts([], 1, 0, 2, 0)
+        d.fill_timesteps(4)
+        self.assertEqual(d.time, [0, 1, 2, 3])
+        self.assertEqual(d.get_death_data(), [0, 1, 1, 1])
+        self.assertEqual(d.get_infected_data()[0], [1, 0, 0, 0])
+        self.assertEqual(d.get_isolated_data(), [1, 0, 0, 0])
+        self.assertEqual(d.timestep, 4)
+
+
+class TestSharedInfections(unittest.TestCase):
+    def test_make_resistant_shared(self):
+        """Making an infection resistant gives the shared infection for that
+        resistance, leaving the original unchanged"""
+        compiled = CompiledParams()
+        infection = compiled.infections[0]
+        for i, name in enumerate(Params.DRUG_NAMES):
+            self.assertIs(infection.make_resistant(name), compiled.infections[i+1])
+            self.assertIs(infection.make_resistant(i), compiled.infections[i+1])
+        self.assertEqual(infection.tier, -1)
+
+    def test_next_treatment_shared(self):
+        """Moving up treatment gives the shared treatment for the next drug,
+        and stays on the strongest drug"""
+        compiled = CompiledParams()
+        for i in range(Params.NUM_RESISTANCES - 1):
+            self.assertIs(compiled.treatments[i].next_treatment(), compiled.treatments[i+1])
+        self.assertIs(compiled.treatments[-1].next_treatment(), compiled.treatments[-1])
+
+    def test_person_time_treated(self):
+        """A person keeps their time treated when moving up treatment, and
+        has no per-instance dictionary"""
+        compiled = CompiledParams()
+        person = Person(compiled.infections[0], compiled.treatments[0], time_treated=3)
+        person.increase_treatment()
+        self.assertIs(person.treatment, compiled.treatments[1])
+        self.assertEqual(person.time_treated, 3)
+        person.mutate_infection()
+        self.assertIs(person.infection, compiled.infections[2])
+        self.assertFalse(hasattr(person, "__dict__"))
+
+    def test_spread_shares_infection(self):
+        """People spread to share the spreader's infection"""
+        compiled = CompiledParams()
+        spreader = Person(compiled.infections[1])
+        receivers = [Person() for _ in range(3)]
+        pending = {}
+        spreader.try_spread_infection(receivers, pending)
+        for receiver in receivers:
+            self.assertIs(pending[receiver], spreader.infection)
+
+
+class TestEnsemble(unittest.TestCase):
+    def test_ensemble_shape(self):
+        """The ensemble stacks every series of every replicate"""
+        m = run()
+        for workers in (1, 2):
+            results = run_ensemble(3, workers=workers)
+            self.assertEqual(results.shape, (3, len(get_series_labels()), Params.NUM_TIMESTEPS))
+            for replicate in results:
+                self.assertTrue((replicate[:-1].sum(axis=0) == Params.POPULATION_SIZE).all())
+        dead = get_series_labels().index("Dead")
+        self.assertTrue((get_series(m.data_handler)[dead] == m.data_handler.get_death_data()).all())
+
+    def test_config_drugs(self):
+        """The outcomes of an ensemble come from the rows of the config's
+        series, when it has a different number of drugs to Params"""
+        config = Config.from_params().replace(
+            NUM_TIMESTEPS=20, POPULATION_SIZE=50, INITIALLY_INFECTED=10,
+            DRUG_NAMES=("Amoxicillin+", "Meropenem"), ISOLATION_THRESHOLD=1,
+            PRODUCT_DETECTION_LEVEL=0, PROBABILITY_DEATH=0.1,
+        )
+        results = run_ensemble(2, workers=1, config=config, random_seed=1)
+        labels = get_series_labels(config)
+        self.assertEqual(len(labels), results.shape[1])
+        self.assertNotEqual(len(labels), len(get_series_labels()))
+        dead = results[:, labels.index("Dead"), -1]
+        self.assertTrue((dead > 0).all())
+        self.assertEqual(get_final_deaths(results).tolist(), dead.tolist())
+        self.assertEqual(get_comparison_outcomes(results)["Deaths"].tolist(), dead.tolist())
+        isolated = results[:, labels.index("Isolated")].max(axis=1)
+        self.assertEqual(get_peak_isolated(results).tolist(), isolated.tolist())
+        self.assertEqual(get_time_to_resistance(results).tolist(),
+                         get_time_to_resistance(results, "Meropenem", config).tolist())
+
+        outcomes = get_outcomes(config)
+        self.assertIn("Peak resistance to Meropenem", outcomes)
+        self.assertNotIn("Peak resistance to Colistin", outcomes)
+        self.assertEqual(outcomes["Peak resistance to Meropenem"](results).tolist(),
+                         results[:, labels.index("Resistance to Meropenem")].max(axis=1).tolist())
+        table = run_sweep([{"PROBABILITY_SPREAD": 0.3}], workers=1, config=config, random_seed=1)
+        self.assertNotIn("Resistance to Colistin", table.columns)
+        self.assertGreater(table["Dead"][0], 0)
+
+    def test_ensemble_workers_reproducible(self):
+        """With a random seed, the results don't depend on the number of
+        workers"""
+        for engine in (run, run_vectorised):
+            serial = run_ensemble(4, workers=1, engine=engine, random_seed=1)
+            parallel = run_ensemble(4, workers=2, engine=engine, random_seed=1)
+            self.assertTrue((serial == parallel).all())
+
+    def test_spawn_seeds(self):
+        """Seeds spawned from a root seed are reproducible and distinct, and
+        extending the number of seeds doesn't change the first ones"""
+        seeds = spawn_seeds(10, random_seed=1)
+        self.assertEqual(seeds, spawn_seeds(10, random_seed=1))
+        self.assertEqual(len(set(seeds)), 10)
+        self.assertEqual(seeds[:5], spawn_seeds(5, random_seed=1))
+        self.assertNotEqual(seeds, spawn_seeds(10, random_seed=2))
+
+
+class TestConfig(unittest.TestCase):
+    def test_from_params_is_a_copy(self):
+        """Changing Params after making a config doesn't change the config"""
+        config = Config.from_params()
+        probability_death = Params.PROBABILITY_DEATH
+        Params.PROBABILITY_DEATH = probability_death / 2
+        Params.reset_granular_parameters()
+        self.assertEqual(config.PROBABILITY_DEATH, probability_death)
+        self.assertEqual(config.RESISTANCE_PROPERTIES["None"][4], probability_death)
+        Params.PROBABILITY_DEATH = probability_death
+        reset_params()
+
+    def test_reset_granular_parameters(self):
+        """Changing a parameter for all drugs propagates to the granular ones"""
+        config = Config.from_params()._replace(PROBABILITY_MUTATION=0.5)
+        config = config.reset_granular_parameters()
+        for properties in config.RESISTANCE_PROPERTIES.values():
+            self.assertEqual(properties[1], 0.5)
+        self.assertEqual(CompiledParams(config).mutation_probabilities,
+                         (0.5,) * (config.NUM_RESISTANCES + 1))
+        with self.assertRaises(AttributeError):
+            config.PROBABILITY_MUTATION = 0
+
+    def test_properties_frozen(self):
+        """The lookup tables of properties can't be changed in place, so
+        changes can't leak between copies of a config"""
+        config = Config.from_params()
+        with self.assertRaises(TypeError):
+            config.RESISTANCE_PROPERTIES["None"] = ()
+        copy = config._replace(DRUG_PROPERTIES={"Amoxicillin+": (1,)})
+        self.assertEqual(dict(copy.DRUG_PROPERTIES), {"Amoxicillin+": (1,)})
+        self.assertNotEqual(dict(config.DRUG_PROPERTIES), dict(copy.DRUG_PROPERTIES))
+        with self.assertRaises(TypeError):
+            copy.DRUG_PROPERTIES["Amoxicillin+"] = (0,)
+
+    def test_replace(self):
+        """Replacing parameters for all drugs resets the granular ones, and
+        replacing others leaves them as they are"""
+        config = Config.from_params().replace(PROBABILITY_MUTATION=0.5)
+        for properties in config.RESISTANCE_PROPERTIES.values():
+            self.assertEqual(properties[1], 0.5)
+        granular = {name: (0.1,) for name in config.DRUG_NAMES}
+        custom = config.replace(DRUG_PROPERTIES=granular)
+        self.assertEqual(custom.replace(PRODUCT_IN_USE=False).DRUG_PROPERTIES, granular)
+        self.assertEqual(config.replace(PROBABILITY_TREATMENT_RECOVERY=0.1,
+                                        DRUG_PROPERTIES=granular).DRUG_PROPERTIES, granular)
+
+    def test_given_population_follows_config(self):
+        """People of a given population, with infections made from Params,
+        follow the model's config rather than Params"""
+        config = Config.from_params().replace(
+            NUM_TIMESTEPS=5, POPULATION_SIZE=10, INITIALLY_INFECTED=10,
+            PROBABILITY_GENERAL_RECOVERY=1, PROBABILITY_TREATMENT_RECOVERY=0,
+            PROBABILITY_DEATH=0, DEATH_FUNCTION=default_death_function,
+        )
+        population = [Person(infection=Infection()) for _ in range(10)]
+        m = Model(population=population, config=config, random_seed=1)
+        self.assertTrue(all(p.infection.compiled is m.compiled for p in population))
+        m.run()
+        self.assertEqual(m.data_handler.get_immune_data()[-1], 10)
+
+        fewer_drugs = config.replace(DRUG_NAMES=("Amoxicillin+",))
+        with self.assertRaises(ValueError):
+            Model(population=[Person(infection=Infection(2))], config=fewer_drugs)
+
+    def test_config_picklable(self):
+        """A config with the default death function can be sent to other
+        processes"""
+        config = Config.from_params()._replace(DEATH_FUNCTION=default_death_function)
+        config = config.reset_granular_parameters()
+        self.assertEqual(pickle.loads(pickle.dumps(config)), config)
+
+    def test_concurrent_models(self):
+        """Models with different configs run at the same time in threads"""
+        base = Config.from_params()._replace(
+            INITIALLY_INFECTED=Params.POPULATION_SIZE, PROBABILITY_TREATMENT_RECOVERY=0,
+            PROBABILITY_GENERAL_RECOVERY=0,
+        )
+        death = base._replace(PROBABILITY_DEATH=1).reset_granular_parameters()
+        recovery = base._replace(
+            PROBABILITY_DEATH=0, DEATH_FUNCTION=lambda p, t: p,
+            PROBABILITY_GENERAL_RECOVERY=1,
+        ).reset_granular_parameters()
+        models = [Model(config=death), Model(config=recovery)]
+        threads = [threading.Thread(target=m.run) for m in models]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(models[0].data_handler.get_death_data()[-1], Params.POPULATION_SIZE)
+        self.assertEqual(models[1].data_handler.get_immune_data()[-1], Params.POPULATION_SIZE)
+
+
+class TestBatchedReplicates(unittest.TestCase):
+    def test_single_replicate_matches_data_handler(self):
+        """With one replicate, the series match the data handler's"""
+        m = VectorisedModel(random_seed=0)
+        m.run()
+        self.assertTrue((m.series[0] == get_series(m.data_handler)).all())
+
+    def test_batch_disjoint_states(self):
+        """Check over all timesteps that the states of each replicate are
+        disjoint"""
+        Params.INITIALLY_INFECTED = 5
+        Params.reset_granular_parameters()
+        series = run_vectorised_batch(20)
+        self.assertEqual(series.shape, (20, len(get_series_labels()), Params.NUM_TIMESTEPS))
+        self.assertTrue((series[:, :-1].sum(axis=1) == Params.POPULATION_SIZE).all())
+        reset_params()
+
+    def test_batch_certain_death(self):
+        """100% infected, 100% death chance, 0% recovery -> 100% death rate in
+        every replicate"""
+        Params.INITIALLY_INFECTED = Params.POPULATION_SIZE
+        Params.PROBABILITY_DEATH = 1
+        Params.PROBABILITY_GENERAL_RECOVERY = 0
+        Params.PROBABILITY_TREATMENT_RECOVERY = 0
+        Params.reset_granular_parameters()
+        series = run_vectorised_batch(3)
+        dead = get_series_labels().index("Dead")
+        self.assertTrue((series[:, dead, -1] == Params.POPULATION_SIZE).all())
+        reset_params()
+
+    def test_batched_ensemble(self):
+        """Batches of uneven size are stacked in order, and the results don't
+        depend on the number of workers"""
+        serial = run_batched_ensemble(5, workers=1, batch_size=2, random_seed=1)
+        parallel = run_batched_ensemble(5, workers=2, batch_size=2, random_seed=1)
+        self.assertEqual(serial.shape[0], 5)
+        self.assertTrue((serial == parallel).all())
+
+
+class TestSweep(unittest.TestCase):
+    def test_grid_design(self):
+        """A grid has every combination of the values of each parameter"""
+        design = grid_design({"PRODUCT_IN_USE": [True, False], "NUM_SPREAD_TO": [1, 2, 3]})
+        self.assertEqual(len(design), 6)
+        self.assertIn({"PRODUCT_IN_USE": False, "NUM_SPREAD_TO": 2}, design)
+
+    def test_latin_hypercube_design(self):
+        """Each stratum of each range is sampled once, and integer ranges give
+        integers"""
+        design = latin_hypercube_design(
+            {"PROBABILITY_MUTATION": (0.0, 0.5), "NUM_SPREAD_TO": (1, 5)}, 10, random_seed=1
+        )
+        strata = sorted(int(point["PROBABILITY_MUTATION"] / 0.05) for point in design)
+        self.assertEqual(strata, list(range(10)))
+        spread = [point["NUM_SPREAD_TO"] for point in design]
+        self.assertTrue(all(isinstance(x, int) and 1 <= x <= 5 for x in spread))
+        self.assertEqual(sorted(spread), [1, 1, 2, 2, 3, 3, 4, 4, 5, 5])
+        self.assertEqual(design, latin_hypercube_design(
+            {"PROBABILITY_MUTATION": (0.0, 0.5), "NUM_SPREAD_TO": (1, 5)}, 10, random_seed=1
+        ))
+
+    def test_sobol_design(self):
+        """A Sobol design lies within the ranges"""
+        design = sobol_design({"PROBABILITY_DEATH": (0.0, 0.1)}, 8, random_seed=1)
+        self.assertEqual(len(design), 8)
+        self.assertTrue(all(0 <= point["PROBABILITY_DEATH"] <= 0.1 for point in design))
+        self.assertEqual(design, sobol_design({"PROBABILITY_DEATH": (0.0, 0.1)}, 8, random_seed=1))
+
+    def test_sobol_samples(self):
+        """The unscrambled sequence starts with the known points, and
+        scrambled sequences of a power of 2 points stay balanced"""
+        samples = sobol_samples(4, 3, scramble=False)
+        self.assertEqual(samples.tolist(), [[0, 0, 0], [0.5, 0.5, 0.5],
+                                            [0.75, 0.25, 0.25], [0.25, 0.75, 0.75]])
+        samples = sobol_samples(256, 32, random_seed=1)
+        for column in samples.T:
+            self.assertEqual(len(np.unique(np.floor(column * 256))), 256)
+        cells = np.floor(samples[:, 1] * 16) * 16 + np.floor(samples[:, 2] * 16)
+        self.assertTrue((np.bincount(cells.astype(int), minlength=256) == 1).all())
+        with self.assertRaises(ValueError):
+            sobol_samples(8, 33)
+
+    def test_get_config(self):
+        """Parameters for all drugs propagate to the granular ones"""
+        config = get_config(Config.from_params(), {"PROBABILITY_MUTATION": 0.5})
+        self.assertEqual(CompiledParams(config).mutation_probabilities,
+                         (0.5,) * (config.NUM_RESISTANCES + 1))
+
+    def test_sweep_table(self):
+        """The table has a row per point and replicate, the replicates of each
+        point share their seeds, and the results don't depend on the number
+        of workers"""
+        design = [
+            {"INITIALLY_INFECTED": Params.POPULATION_SIZE, "PROBABILITY_DEATH": 1,
+             "PROBABILITY_GENERAL_RECOVERY": 0, "PROBABILITY_TREATMENT_RECOVERY": 0},
+            {"INITIALLY_INFECTED": 1, "PROBABILITY_DEATH": 0.01,
+             "PROBABILITY_GENERAL_RECOVERY": 0, "PROBABILITY_TREATMENT_RECOVERY": 0},
+        ]
+        serial = run_sweep(design, 3, workers=1, random_seed=1)
+        parallel = run_sweep(design, 3, workers=2, random_seed=1)
+        self.assertTrue(serial.equals(parallel))
+        self.assertEqual(len(serial), 6)
+        self.assertEqual(list(serial.columns[-len(get_summary_labels()):]), get_summary_labels())
+        self.assertEqual(list(serial["random_seed"][:3]), list(serial["random_seed"][3:]))
+        self.assertTrue((serial["Dead"][:3] == Params.POPULATION_SIZE).all())
+        self.assertTrue((serial["Peak infected"][:3] == Params.POPULATION_SIZE).all())
+
+    def test_command_line(self):
+        """The command line writes a table of the sweep to a CSV file"""
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "sweep.csv")
+            sweep_main([
+                "--design", "lhs", "--points", "3", "--replicates", "2", "--workers", "1",
+                "--range", "PROBABILITY_MUTATION", "0.1", "0.4", "--engine", "vectorised",
+                "--output", filename,
+            ])
+            results = pd.read_csv(filename)
+        self.assertEqual(len(results), 6)
+        self.assertTrue(results["PROBABILITY_MUTATION"].between(0.1, 0.4).all())
+        Settings.REPORT_PROGRESS = False
+        Settings.PRINT_DATA = False
+
+
+class TestResultCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = ResultCache(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_repeat_runs_are_cached(self):
+        """A repeated run is loaded from the cache without simulating it,
+        and a different seed or config is a different run"""
+        config = Config.from_params()._replace(DEATH_FUNCTION=default_death_function)
+        config = config.reset_granular_parameters()
+        m = run(config, 1, cache=self.cache)
+        self.assertEqual(len(os.listdir(self.directory.name)), 1)
+        cached = run(config, 1, cache=self.cache)
+        self.assertIsNot(cached, m)
+        self.assertEqual(get_series(cached.data_handler).tolist(), get_series(m.data_handler).tolist())
+        run(config, 2, cache=self.cache)
+        run(config._replace(PRODUCT_IN_USE=not config.PRODUCT_IN_USE), 1, cache=self.cache)
+        self.assertEqual(len(os.listdir(self.directory.name)), 3)
+
+    def test_key(self):
+        """Keys depend on the parameters, seed and engine, but not on how the
+        death function is given if it gives the same chances of death"""
+        config = Config.from_params()._replace(DEATH_FUNCTION=default_death_function)
+        config = config.reset_granular_parameters()
+        same = config._replace(DEATH_FUNCTION=lambda p, t: round(min(0.001*t + p, 1), 4))
+        same = same.reset_granular_parameters()
+        key = self.cache.get_key(run, config, random_seed=1)
+        self.assertEqual(key, self.cache.get_key(run, config, random_seed=1))
+        self.assertEqual(key, self.cache.get_key(run, same, random_seed=1))
+        self.assertNotEqual(key, self.cache.get_key(run, config, random_seed=2))
+        self.assertNotEqual(key, self.cache.get_key(run_vectorised, config, random_seed=1))
+        different = config._replace(PROBABILITY_DEATH=0.5).reset_granular_parameters()
+        self.assertNotEqual(key, self.cache.get_key(run, different, random_seed=1))
+        self.assertNotEqual(get_engine_version(run), get_engine_version(run_vectorised))
+
+    def test_ensembles_are_cached(self):
+        """Ensembles are cached whatever the number of workers, and runs
+        without a random seed aren't cached"""
+        results = run_ensemble(2, workers=1, random_seed=1, cache=self.cache)
+        cached = run_ensemble(2, workers=2, random_seed=1, cache=self.cache)
+        self.assertTrue((results == cached).all())
+        self.assertEqual(len(os.listdir(self.directory.name)), 1)
+        run_batched_ensemble(3, workers=1, batch_size=2, random_seed=1, cache=self.cache)
+        self.assertEqual(len(os.listdir(self.directory.name)), 2)
+        self.cache.call(run, random_seed=None)
+        self.assertEqual(len(os.listdir(self.directory.name)), 2)
+
+    def test_engine_changes_invalidate(self):
+        """Changing the source of the engine a batched ensemble runs, which
+        isn't in the call, misses the cache"""
+        config = Config.from_params()._replace(NUM_TIMESTEPS=5, POPULATION_SIZE=50)
+        config = config.reset_granular_parameters()
+        results = run_batched_ensemble(2, workers=1, batch_size=2, config=config, random_seed=1,
+                                       cache=self.cache)
+        getsource = inspect.getsource
+
+        def edited(module):
+            source = getsource(module)
+            return source + "\n# Edited\n" if module is model_vectorised else source
+
+        with unittest.mock.patch.object(cache_module.inspect, "getsource", side_effect=edited):
+            key = self.cache.get_key(run_batched_ensemble, 2, batch_size=2, config=config,
+                                     random_seed=1, common_random_numbers=False,
+                                     antithetic=False)
+            with self.assertRaises(KeyError):
+                self.cache.get(key)
+            rerun = run_batched_ensemble(2, workers=1, batch_size=2, config=config,
+                                         random_seed=1, cache=self.cache)
+        self.assertTrue((rerun == results).all())
+        self.assertEqual(len(os.listdir(self.directory.name)), 2)
+
+    def test_least_recently_used_evicted(self):
+        """Going over the size limit evicts the least recently used results"""
+        for i, key in enumerate("abc"):
+            self.cache.put(key, bytes(100))
+            os.utime(os.path.join(self.directory.name, key + ".pickle"), (i, i))
+        self.cache.get("a")
+        self.cache.max_bytes = 2 * os.path.getsize(os.path.join(self.directory.name, "a.pickle"))
+        self.cache.put("d", bytes(100))
+        self.assertEqual(sorted(os.listdir(self.directory.name)), ["a.pickle", "d.pickle"])
+        with self.assertRaises(KeyError):
+            self.cache.get("b")
+
+    def test_unpicklable_results(self):
+        """Results which can't be pickled are returned, but not cached"""
+        self.assertFalse(self.cache.put("a", lambda: None))
+        self.assertEqual(os.listdir(self.directory.name), [])
+
+
+class TestCheckpoint(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, "model.checkpoint")
+        # Keep people infected for the whole run
+        self.config = get_test_config(
+            NUM_TIMESTEPS=40, POPULATION_SIZE=200, INITIALLY_INFECTED=5,
+            PROBABILITY_TREATMENT_RECOVERY=0.05, PROBABILITY_DEATH=0.01,
+            PROBABILITY_SPREAD=0.5, NUM_SPREAD_TO=2,
+        )
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_resume(self):
+        """A run resumed from a checkpoint matches the run without one"""
+        for engine in (Model, VectorisedModel):
+            whole = engine(config=self.config, random_seed=1)
+            whole.run()
+            m = engine(config=self.config, random_seed=1)
+            m.run(until=20, checkpoint_filename=self.filename, checkpoint_every=10)
+            self.assertEqual(m.timestep, 20)
+            resumed = engine.load_checkpoint(self.filename)
+            self.assertEqual(resumed.timestep, 20)
+            resumed.run()
+            self.assertEqual(resumed.data_handler.get_state(), whole.data_handler.get_state())
+
+    def test_rerun_tail(self):
+        """The tail of a run can be rerun from a checkpoint, with the same or
+        different parameters, without changing the checkpoint"""
+        m = VectorisedModel(config=self.config, random_seed=1, num_replicates=3)
+        m.run(until=10)
+        m.save_checkpoint(self.filename)
+        m.run()
+        for _ in range(2):
+            tail = VectorisedModel.load_checkpoint(self.filename)
+            tail.run()
+            self.assertTrue((tail.series == m.series).all())
+        certain_death = self.config._replace(
+            PROBABILITY_DEATH=1, PROBABILITY_GENERAL_RECOVERY=0, PROBABILITY_TREATMENT_RECOVERY=0,
+        ).reset_granular_parameters()
+        tail = VectorisedModel.load_checkpoint(self.filename, certain_death)
+        tail.run()
+        self.assertTrue((tail.series[:, :, :10] == m.series[:, :, :10]).all())
+        self.assertEqual(tail.series[:, :tail.dead, -1].sum(), 0)
+
+    def test_unpicklable_config(self):
+        """A config which can't be saved must be given when loading"""
+        config = self.config._replace(DEATH_FUNCTION=lambda p, t: p).reset_granular_parameters()
+        m = Model(config=config, random_seed=1)
+        m.run(until=5)
+        m.save_checkpoint(self.filename)
+        with self.assertRaises(ValueError):
+            Model.load_checkpoint(self.filename)
+        self.assertEqual(Model.load_checkpoint(self.filename, config).timestep, 5)
+
+    def test_not_a_checkpoint(self):
+        """Loading a file which isn't a checkpoint fails cleanly"""
+        with open(self.filename, "wb") as f:
+            f.write(b"not a checkpoint")
+        with self.assertRaises(ValueError):
+            Model.load_checkpoint(self.filename)
+
+
+class TestBranches(unittest.TestCase):
+    def setUp(self):
+        # Keep people infected for the whole run
+        self.config = get_test_config(
+            NUM_TIMESTEPS=40, POPULATION_SIZE=200, INITIALLY_INFECTED=5,
+            PROBABILITY_TREATMENT_RECOVERY=0.05, PROBABILITY_DEATH=0.01,
+            PROBABILITY_SPREAD=0.5, NUM_SPREAD_TO=2,
+        )
+
+    def test_fork(self):
+        """A fork continues as the model would, without changing it"""
+        for engine in (Model, VectorisedModel):
+            m = engine(config=self.config, random_seed=1)
+            m.run(until=20)
+            fork = m.fork()
+            fork.run()
+            self.assertEqual(m.timestep, 20)
+            m.run()
+            self.assertEqual(fork.data_handler.get_state(), m.data_handler.get_state())
+            self.assertIsInstance(m.fork(random_seed=2).random_stream, type(m.random_stream))
+
+    def test_fork_checks_config(self):
+        """The shape of the state can't change partway through a run"""
+        m = Model(config=self.config, random_seed=1)
+        with self.assertRaises(ValueError):
+            m.fork(self.config._replace(NUM_TIMESTEPS=50))
+
+    def test_run_branches(self):
+        """Branches share the run up to where they branch, then each continues
+        with its own variant"""
+        whole = run(self.config, 1)
+        unchanged, certain_death = run_branches(20, [
+            {}, {"PROBABILITY_DEATH": 1, "PROBABILITY_TREATMENT_RECOVERY": 0},
+        ], config=self.config, random_seed=1)
+        self.assertEqual(unchanged.data_handler.get_state(), whole.data_handler.get_state())
+        before = get_series(certain_death.data_handler)[:, :20]
+        self.assertTrue((before == get_series(whole.data_handler)[:, :20]).all())
+        self.assertEqual(sum(x[-1] for x in certain_death.data_handler.get_infected_data()), 0)
+        models = run_branches(10, [self.config, {"PRODUCT_IN_USE": False}],
+                              model=VectorisedModel(config=self.config, random_seed=1, num_replicates=3))
+        self.assertEqual([m.series.shape[0] for m in models], [3, 3])
+
+
+class TestSplitting(unittest.TestCase):
+    def setUp(self):
+        # Make resistance to the top drug uncommon
+        self.config = get_test_config(
+            NUM_TIMESTEPS=30, POPULATION_SIZE=200, INITIALLY_INFECTED=5,
+            PROBABILITY_MUTATION=0.05, PRODUCT_IN_USE=False,
+        )
+
+    def test_resistant_infections(self):
+        """Scores count the infections resistant to at least a tier"""
+        m = Model(config=self.config, random_seed=1)
+        m.num_infected_stages = [1, 2, 3, 4]
+        self.assertEqual(resistant_infections()(m), 4)
+        self.assertEqual(resistant_infections(1)(m), 7)
+        self.assertEqual(resistant_infections(-1)(m), 10)
+
+    def test_single_level(self):
+        """With one level, splitting is the fraction of plain runs which reach
+        it"""
+        results = run_splitting([3], n_trajectories=20, model=VectorisedModel,
+                                config=self.config, random_seed=1)
+        top = self.config.NUM_RESISTANCES
+        reached = [
+            run_vectorised(self.config, seed).series[0, top].max() >= 3
+            for seed in spawn_seeds(21, 1)[:20]
+        ]
+        self.assertEqual(results.level_probabilities, [sum(reached) / 20])
+        self.assertEqual(len(results.trajectories), sum(reached))
+
+    def test_levels(self):
+        """The estimate is the product of the chances of each level, and the
+        trajectories returned reached the final level and were run to the end"""
+        for engine in (Model, VectorisedModel):
+            results = run_splitting([1, 2, 3], n_trajectories=10, model=engine,
+                                    config=self.config, random_seed=1)
+            self.assertAlmostEqual(results.probability, np.prod(results.level_probabilities))
+            self.assertTrue(0 <= results.probability <= 1)
+            top = self.config.NUM_RESISTANCES
+            for m in results.trajectories:
+                self.assertEqual(m.timestep, self.config.NUM_TIMESTEPS)
+                self.assertGreaterEqual(max(m.data_handler.get_infected_data()[top]), 3)
+
+
+class TestAdaptiveEnsemble(unittest.TestCase):
+    def test_stops_at_target(self):
+        """The ensemble stops at the first batch where the interval is within
+        the target, with the results of the first batches of the batched
+        ensemble, whatever the number of workers"""
+        target = 1
+        for workers in (1, 2):
+            adaptive = run_adaptive_ensemble(target, relative=False, min_replicates=4,
+                                             max_replicates=40, workers=workers,
+                                             batch_size=4, random_seed=1)
+            batched = run_batched_ensemble(adaptive.n_replicates, workers=1, batch_size=4,
+                                           random_seed=1)
+            self.assertTrue((adaptive.results == batched).all())
+            mean, half_width = confidence_interval(get_final_deaths(batched))
+            self.assertEqual((adaptive.mean, adaptive.half_width), (mean, half_width))
+            self.assertEqual(adaptive.converged, half_width <= target)
+            if adaptive.n_replicates > 4:
+                earlier = confidence_interval(get_final_deaths(batched[:-4]))[1]
+                self.assertGreater(earlier, target)
+
+    def test_budget(self):
+        """An unreachable target uses the whole budget"""
+        adaptive = run_adaptive_ensemble(-1, max_replicates=10, workers=1, batch_size=4,
+                                         random_seed=1)
+        self.assertEqual(adaptive.n_replicates, 10)
+        self.assertEqual(len(adaptive.results), 10)
+        self.assertFalse(adaptive.converged)
+
+    def test_one_pool(self):
+        """Every batch of an adaptive run is run by the same pool of workers"""
+        executor = ensemble_module.ProcessPoolExecutor
+        with unittest.mock.patch.object(ensemble_module, "ProcessPoolExecutor",
+                                        side_effect=executor) as pools:
+            adaptive = run_adaptive_ensemble(-1, max_replicates=12, workers=2, batch_size=2,
+                                             random_seed=1)
+        self.assertEqual(pools.call_count, 1)
+        self.assertEqual(adaptive.n_replicates, 12)
+
+    def test_engine(self):
+        """With an engine, the results are the first replicates of the
+        ensemble of that engine"""
+        config = Config.from_params()._replace(NUM_TIMESTEPS=10, POPULATION_SIZE=100)
+        config = config.reset_granular_parameters()
+        for workers in (1, 2):
+            adaptive = run_adaptive_ensemble(math.inf, min_replicates=3, max_replicates=10,
+                                             workers=workers, config=config, random_seed=1,
+                                             engine=run)
+            self.assertEqual(adaptive.n_replicates, 3)
+            ensemble = run_ensemble(10, workers=1, config=config, random_seed=1)
+            self.assertTrue((adaptive.results == ensemble[:3]).all())
+
+    def test_no_budget(self):
+        """A budget of no replicates is an error"""
+        with self.assertRaises(ValueError):
+            run_adaptive_ensemble(1, max_replicates=0, workers=1)
+
+    def test_min_replicates(self):
+        """The interval isn't checked before the minimum number of replicates"""
+        adaptive = run_adaptive_ensemble(math.inf, min_replicates=8, max_replicates=20,
+                                         workers=1, batch_size=4, random_seed=1)
+        self.assertEqual(adaptive.n_replicates, 8)
+        self.assertTrue(adaptive.converged)
+
+
+class TestAntithetic(unittest.TestCase):
+    def get_config(self):
+        """Return a config with enough going on that replicates vary"""
+        return get_test_config(NUM_TIMESTEPS=20, POPULATION_SIZE=200)
+
+    def test_streams(self):
+        """Antithetic streams give 1 - u for each uniform u, but the same
+        samples"""
+        for stream_class in (RandomStream, ArrayRandomStream, SynchronisedRandomStream):
+            stream, antithetic = stream_class(1), stream_class(1, antithetic=True)
+            self.assertTrue(np.allclose(antithetic.uniforms(10), 1 - np.array(stream.uniforms(10))))
+            self.assertEqual(antithetic.sample(list(range(20)), 5), stream.sample(list(range(20)), 5))
+        stream, antithetic = SynchronisedRandomStream(1), SynchronisedRandomStream(1, True)
+        self.assertTrue(np.allclose(antithetic.person_uniforms(np.arange(10), 3, 2),
+                                    1 - stream.person_uniforms(np.arange(10), 3, 2)))
+        self.assertTrue((antithetic.person_samples(np.arange(10), 3, 2, 20)
+                         == stream.person_samples(np.arange(10), 3, 2, 20)).all())
+
+    def test_fork(self):
+        """Forks of antithetic models with a new seed stay antithetic"""
+        for model_class in (Model, VectorisedModel):
+            m = model_class(config=self.get_config(), random_seed=1, antithetic=True)
+            self.assertTrue(m.fork(random_seed=2).random_stream.antithetic)
+
+    def test_ensembles(self):
+        """Each replicate of an antithetic ensemble is followed by its
+        antithetic replicate, whatever the number of workers"""
+        config = self.get_config()
+        results = run_ensemble(6, workers=1, config=config, random_seed=1, antithetic=True)
+        self.assertEqual(results.shape[0], 6)
+        self.assertTrue((results[::2] == run_ensemble(3, 1, config=config, random_seed=1)).all())
+        antithetic = get_series(run(config, spawn_seeds(3, 1)[1], antithetic=True).data_handler)
+        self.assertTrue((results[3] == antithetic).all())
+        self.assertTrue((results == run_ensemble(6, workers=2, config=config, random_seed=1,
+                                                 antithetic=True)).all())
+
+        batched = run_batched_ensemble(10, workers=1, batch_size=2, config=config, random_seed=1,
+                                       antithetic=True)
+        self.assertEqual(batched.shape[0], 10)
+        self.assertTrue((batched[::2] == run_batched_ensemble(5, 1, 2, config, 1)).all())
+        self.assertTrue((batched == run_batched_ensemble(10, 2, 2, config, 1, antithetic=True)).all())
+
+        with self.assertRaises(ValueError):
+            run_ensemble(5, workers=1, config=config, antithetic=True)
+
+    def test_confidence_interval(self):
+        """The interval is that of the means of the pairs"""
+        mean, half_width, variance_reduction = antithetic_confidence_interval([1, 3, 2, 2, 0, 4])
+        self.assertEqual((mean, half_width, variance_reduction), (2, 0, math.inf))
+        mean, half_width, variance_reduction = antithetic_confidence_interval([1, 1, 3, 3])
+        self.assertEqual((mean, half_width), confidence_interval([1, 3]))
+        self.assertAlmostEqual(variance_reduction, 1 / 3)
+        with self.assertRaises(ValueError):
+            antithetic_confidence_interval([1, 2, 3])
+
+    def test_peak_isolated(self):
+        """The peak isolated is the most people isolated at once"""
+        results = run_ensemble(2, workers=1, config=self.get_config(), random_seed=1)
+        isolated = results[:, get_series_labels().index("Isolated")]
+        self.assertTrue((get_peak_isolated(results) == isolated.max(axis=1)).all())
+
+
+class TestSensitivity(unittest.TestCase):
+    # The product detection chance does nothing when the product isn't used
+    ranges = {"PROBABILITY_SPREAD": (0.1, 0.4), "TIMESTEPS_MOVE_UP_LAG_TIME": (1, 10),
+              "PROBABILIY_PRODUCT_DETECT": (0.0, 1.0)}
+
+    def get_config(self):
+        """Return a small config with enough going on that the outcomes vary"""
+        return get_test_config(PRODUCT_IN_USE=False)
+
+    def test_saltelli_design(self):
+        """Each parameter's block is A with that parameter's values from B"""
+        design = pd.DataFrame(saltelli_design(self.ranges, 8, random_seed=1))
+        self.assertEqual(len(design), 8 * 5)
+        a, b = design[:8].reset_index(drop=True), design[8:16].reset_index(drop=True)
+        for i, name in enumerate(self.ranges):
+            ab = design[8 * (i + 2):8 * (i + 3)].reset_index(drop=True)
+            self.assertTrue((ab[name] == b[name]).all())
+            self.assertTrue((ab.drop(columns=name) == a.drop(columns=name)).all(axis=None))
+        self.assertTrue(design["TIMESTEPS_MOVE_UP_LAG_TIME"].between(1, 10).all())
+
+    def test_morris_design(self):
+        """Each step of a trajectory changes just the parameter it says"""
+        design, changed, steps = morris_design(self.ranges, 5, random_seed=1)
+        design = pd.DataFrame(design).to_numpy().reshape(5, 4, 3)
+        for trajectory in range(5):
+            self.assertEqual(sorted(changed[trajectory]), [0, 1, 2])
+            for step, i in enumerate(changed[trajectory]):
+                difference = design[trajectory, step + 1] - design[trajectory, step]
+                self.assertTrue((np.delete(difference, i) == 0).all())
+        self.assertTrue(np.allclose(np.abs(steps), 2 / 3))
+
+    def test_time_to_resistance(self):
+        """The time to resistance is the first timestep of resistance, or the
+        number of timesteps if there never is any"""
+        results = np.zeros((2, len(get_series_labels()), 5))
+        results[0, get_series_labels().index("Resistance to Colistin"), 3:] = 1
+        self.assertEqual(get_time_to_resistance(results).tolist(), [3, 5])
+        self.assertEqual(get_time_to_resistance(results, "Meropenem").tolist(), [5, 5])
+
+    def test_indices(self):
+        """A parameter which does nothing has no effect on any outcome, and the
+        results don't depend on the number of workers"""
+        config = self.get_config()
+        indices = sobol_indices(self.ranges, 8, n_replicates=2, workers=1, config=config,
+                                random_seed=1)
+        self.assertEqual(list(indices.columns), ["First order", "Total"])
+        self.assertEqual(len(indices), 9)
+        dummy = indices.xs("PROBABILIY_PRODUCT_DETECT", level="Parameter")
+        self.assertTrue((dummy["Total"].fillna(0) == 0).all())
+        self.assertTrue(indices.equals(sobol_indices(self.ranges, 8, n_replicates=2, workers=2,
+                                                     config=config, random_seed=1)))
+
+        screening = morris_screening(self.ranges, 4, n_replicates=2, workers=1, config=config,
+                                     random_seed=1)
+        dummy = screening.xs("PROBABILIY_PRODUCT_DETECT", level="Parameter")
+        self.assertTrue((dummy["Mu star"] == 0).all())
+        self.assertTrue((screening.xs("Deaths")["Mu star"] >= 0).all())
+
+
+class TestSurrogate(unittest.TestCase):
+    def get_emulator(self):
+        """Return an emulator of two smooth functions of two parameters"""
+        inputs = pd.DataFrame(latin_hypercube_design({"a": (0.0, 1.0), "b": (2.0, 4.0)}, 40, 1))
+        values = np.stack((np.sin(3 * inputs["a"]) + inputs["b"], 10 * inputs["a"]), axis=1)
+        return Emulator.fit(inputs.to_numpy(), values, ["a", "b"], ["sine", "linear"],
+                            {"a": (0.0, 1.0), "b": (2.0, 4.0)})
+
+    def test_predict(self):
+        """The emulator is close to smooth functions inside its training
+        ranges, and knows how uncertain it is"""
+        emulator = self.get_emulator()
+        for a, b in ((0.5, 3.0), (0.1, 2.5), (0.9, 3.9)):
+            prediction = emulator.predict({"a": a, "b": b})
+            self.assertTrue(prediction.emulated)
+            self.assertAlmostEqual(prediction.mean["sine"], math.sin(3 * a) + b, places=1)
+            self.assertAlmostEqual(prediction.mean["linear"], 10 * a, places=1)
+            self.assertLess(prediction.std["sine"], 0.1)
+        far = emulator.predict({"a": 5, "b": 10})
+        self.assertGreater(far.std["sine"], 0.5)
+
+    def test_domain(self):
+        """Points outside the training ranges, or changing other parameters,
+        are outside the domain"""
+        emulator = self.get_emulator()
+        self.assertTrue(emulator.in_domain({"a": 0.5, "b": 3.0}))
+        self.assertTrue(emulator.in_domain({"a": 0.0, "b": 4.0}))
+        self.assertFalse(emulator.in_domain({"a": 1.5, "b": 3.0}))
+        self.assertFalse(emulator.in_domain({"a": 0.5}))
+        self.assertFalse(emulator.in_domain({"a": 0.5, "b": 3.0, "c": 1}))
+
+    def test_save(self):
+        """A saved emulator loads as the same emulator"""
+        emulator = self.get_emulator()
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "emulator.npz")
+            emulator.save(filename)
+            loaded = Emulator.load(filename)
+        point = {"a": 0.3, "b": 2.2}
+        self.assertEqual(loaded.predict(point), emulator.predict(point))
+        self.assertEqual(loaded.parameters, ["a", "b"])
+        self.assertEqual(loaded.ranges, emulator.ranges)
+        self.assertIsNone(loaded.n_replicates)
+        with self.assertRaises(ValueError):
+            loaded.query({"a": 2, "b": 3.0})
+
+    def test_from_sweep(self):
+        """Emulators fitted to sweeps average the replicates of each point"""
+        table = pd.DataFrame({"a": [0, 0, 1, 1, 2, 2], "y": [1, 3, 2, 4, 3, 5]})
+        emulator = Emulator.from_sweep(table, ["a"], ["y"])
+        self.assertEqual(emulator.values[:, 0].tolist(), [2, 3, 4])
+
+    def get_config(self):
+        """Return a small config for emulators to be trained on"""
+        return get_test_config()
+
+    def test_query(self):
+        """Queries inside the domain, including its bounds, are emulated,
+        and outside it are simulated with the training replicates and
+        config"""
+        config = self.get_config()
+        emulator = train_emulator({"PROBABILITY_SPREAD": (0.1, 0.4)}, 6, n_replicates=2,
+                                  workers=1, config=config, random_seed=1)
+        self.assertEqual(emulator.outcomes, list(get_outcomes()))
+        self.assertTrue(emulator.query({"PROBABILITY_SPREAD": 0.2}).emulated)
+        self.assertTrue(emulator.query({"PROBABILITY_SPREAD": 0.4}).emulated)
+
+        point = {"PROBABILITY_SPREAD": 0.8}
+        simulated = emulator.query(point, random_seed=1)
+        self.assertFalse(simulated.emulated)
+        results = run_vectorised_batch(2, get_config(config, point), 1, common_random_numbers=True)
+        self.assertEqual(simulated.mean["Deaths"], get_final_deaths(results).mean())
+        with self.assertRaises(ValueError):
+            emulator.query(point, config._replace(NUM_TIMESTEPS=20))
+
+    def test_query_loaded(self):
+        """Loaded emulators fall back on the simulator only with the training
+        config and the functions of any custom outcomes"""
+        config = self.get_config()
+        outcomes = {"Deaths": get_final_deaths, "Twice deaths": lambda x: 2 * get_final_deaths(x)}
+        emulator = train_emulator({"PROBABILITY_SPREAD": (0.1, 0.4)}, 6, n_replicates=2,
+                                  outcomes=outcomes, workers=1, config=config, random_seed=1)
+        self.assertEqual(emulator.custom_outcomes, ["Twice deaths"])
+        point = {"PROBABILITY_SPREAD": 0.8}
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "emulator.npz")
+            emulator.save(filename)
+            with self.assertRaises(ValueError):
+                Emulator.load(filename, config._replace(NUM_TIMESTEPS=20))
+            with self.assertRaisesRegex(ValueError, "Twice deaths"):
+                Emulator.load(filename, config).query(point)
+            loaded = Emulator.load(filename, config, {"Twice deaths": outcomes["Twice deaths"]})
+        self.assertEqual(loaded.query(point, random_seed=1), emulator.query(point, random_seed=1))
+
+
+class TestPairedComparison(unittest.TestCase):
+    def get_config(self):
+        """Return a config with enough going on that replicates vary"""
+        return get_test_config(NUM_TIMESTEPS=30, POPULATION_SIZE=300)
+
+    def test_synchronised_streams(self):
+        """A person's random numbers don't depend on who else draws them"""
+        stream = SynchronisedRandomStream(1)
+        everyone = stream.person_uniforms(np.arange(100), 3, 2)
+        self.assertTrue((stream.person_uniforms(np.array([7, 42]), 3, 2) == everyone[[7, 42]]).all())
+        self.assertTrue(((everyone >= 0) & (everyone < 1)).all())
+        self.assertFalse((stream.person_uniforms(np.arange(100), 4, 2) == everyone).any())
+        self.assertFalse((SynchronisedRandomStream(2).person_uniforms(np.arange(100), 3, 2) == everyone).any())
+        rows = stream.person_samples(np.arange(1000), 3, 5, 10)
+        self.assertTrue((np.sort(rows, axis=1)[:, 1:] != np.sort(rows, axis=1)[:, :-1]).all())
+        self.assertTrue((stream.person_samples(np.arange(10, 20), 3, 5, 10) == rows[10:20]).all())
+
+    def test_common_random_numbers_batches(self):
+        """Batches with common random numbers keep every state disjoint"""
+        config = self.get_config()
+        series = run_vectorised_batch(5, config, 1, common_random_numbers=True)
+        self.assertTrue((series[:, :-1].sum(axis=1) == config.POPULATION_SIZE).all())
+        self.assertTrue((series == run_vectorised_batch(5, config, 1, common_random_numbers=True)).all())
+
+    def test_t_critical_value(self):
+        """Critical values match the tables of Student's t distribution"""
+        for confidence, df, value in ((0.95, 1, 12.706), (0.95, 2, 4.303), (0.95, 10, 2.228),
+                                      (0.99, 5, 4.032), (0.95, 10000, 1.960)):
+            self.assertAlmostEqual(t_critical_value(confidence, df), value, places=3)
+        mean, half_width = confidence_interval([1, 2, 3])
+        self.assertEqual(mean, 2)
+        self.assertAlmostEqual(half_width, 4.303 / math.sqrt(3), places=3)
+
+    def test_paired_comparison(self):
+        """Comparing a scenario with itself gives no difference, and common
+        random numbers reduce the variance of a real difference"""
+        config = self.get_config()
+        same = run_paired_comparison(10, {}, workers=1, config=config, random_seed=1)
+        self.assertTrue((same["Difference"] == 0).all())
+        self.assertTrue((same["Baseline"] == same["Changed"]).all())
+        results = run_paired_comparison(20, {"PROBABILITY_DEATH": 0.03}, workers=1, batch_size=10,
+                                        config=config, random_seed=1)
+        self.assertEqual(list(results.index), ["Deaths", "Isolation days", "Resistant infection days"])
+        self.assertGreater(results["Variance reduction"]["Deaths"], 1)
+        self.assertTrue((results["Lower bound"] <= results["Difference"]).all())
+        self.assertTrue((results["Difference"] <= results["Upper bound"]).all())
+
+
+class TestRandomStream(unittest.TestCase):
+    def test_uniform_blocks(self):
+        """Blocks of uniforms have the requested size and lie in [0, 1)"""
+        for stream in (RandomStream(), ArrayRandomStream()):
+            block = stream.uniforms(100)
+            self.assertEqual(len(block), 100)
+            self.assertTrue(all(0 <= u < 1 for u in block))
+
+    def test_phase_blocks(self):
+        """The object model only draws numbers for the people who could
+        change state in each phase, so none to move up treatment or use the
+        product in the first timestep when no one has been treated and the
+        product isn't in use"""
+        config = Config.from_params()._replace(
+            POPULATION_SIZE=100, INITIALLY_INFECTED=10, PRODUCT_IN_USE=False,
+        ).reset_granular_parameters()
+        m = Model(config=config, random_seed=1)
+        sizes = []
+        uniforms = m.random_stream.uniforms
+        with unittest.mock.patch.object(m.random_stream, "uniforms",
+                                        side_effect=lambda n: sizes.append(n) or uniforms(n)):
+            m.run(until=1)
+        self.assertEqual(sizes[0], 0)
+        self.assertEqual(sizes[1], 10)
+        self.assertLess(sum(sizes), 6 * 10)
+
+    def test_sample_rows_distinct(self):
+        """Every row of a sample contains distinct people"""
+        rows = ArrayRandomStream().sample_rows(1000, 5, 10)
+        for row in rows:
+            self.assertEqual(len(set(row)), 5)
+        with self.assertRaises(ValueError):
+            ArrayRandomStream().sample_rows(1, 11, 10)
+
+    def test_models_own_streams(self):
+        """Models with the same seed give the same results, even when another
+        model draws random numbers in between"""
+        first = Model(random_seed=1)
+        second = Model(random_seed=1)
+        first.run()
+        Model(random_seed=2).run()
+        second.run()
+        self.assertEqual(first.data_handler.ys_data, second.data_handler.ys_data)
+
+    def test_shared_stream(self):
+        """The object model can draw from an array stream"""
+        m = Model()
+        m.random_stream = ArrayRandomStream()
+        m.run()
+        self.assertEqual(len(m.data_handler.get_death_data()), Params.NUM_TIMESTEPS)
+
+
+class TestCompiledParams(unittest.TestCase):
+    def test_tiers(self):
+        """Resistances and drugs map to integer tiers in the order given"""
+        compiled = CompiledParams()
+        self.assertEqual(compiled.get_tier(None), -1)
+        self.assertEqual(compiled.get_tier("None"), -1)
+        for i, name in enumerate(Params.DRUG_NAMES):
+            self.assertEqual(compiled.get_tier(name), i)
+            self.assertEqual(compiled.get_tier(i), i)
+
+    def test_by_name_or_tier(self):
+        """Infections and treatments are the same given by name or by tier"""
+        compiled = CompiledParams()
+        for i, name in enumerate(Params.DRUG_NAMES):
+            self.assertEqual(Infection(name, compiled=compiled).tier, i)
+            self.assertEqual(Infection(i, compiled=compiled).resistance, name)
+            self.assertEqual(Treatment(name, compiled=compiled).tier, i)
+            self.assertEqual(Treatment(i, compiled=compiled).drug, name)
+
+    def test_treats_infection(self):
+        """A treatment only works on infections less resistant than it"""
+        compiled = CompiledParams()
+        for i in range(Params.NUM_RESISTANCES):
+            treatment = Treatment(i, compiled=compiled)
+            for j in range(-1, Params.NUM_RESISTANCES):
+                infection = Infection(j, compiled=compiled)
+                self.assertEqual(treatment.treats_infection(infection),
+                                 not infection.is_resistant(treatment.drug))
+
+    def test_shared_not_changed(self):
+        """Making an infection resistant or moving up a treatment returns the
+        shared one of the new tier, leaving the original as it was"""
+        compiled = CompiledParams()
+        infection, treatment = compiled.infections[0], compiled.treatments[0]
+        self.assertIs(infection.make_resistant(1), compiled.infections[2])
+        self.assertIs(treatment.next_treatment(), compiled.treatments[1])
+        self.assertEqual((infection.tier, treatment.tier), (-1, 0))
+
+    def test_default_compiled_shared(self):
+        """Infections and treatments made without compiled parameters share
+        those of Params, until Params changes"""
+        compiled = Infection().compiled
+        self.assertIs(Treatment().compiled, compiled)
+        self.assertIs(get_compiled_params(Config.from_params()), compiled)
+        probability_death = Params.PROBABILITY_DEATH
+        Params.PROBABILITY_DEATH = probability_death / 2
+        Params.reset_granular_parameters()
+        try:
+            self.assertIsNot(Infection().compiled, compiled)
+            self.assertEqual(Infection().compiled.death_probabilities[0], probability_death / 2)
+        finally:
+            Params.PROBABILITY_DEATH = probability_death
+            Params.reset_granular_parameters()
+
+    def test_time_treated_ignored(self):
+        """Infections and treatments still take the time treated, with a
+        warning that it is ignored"""
+        compiled = CompiledParams()
+        with self.assertWarns(DeprecationWarning):
+            self.assertEqual(Infection(1, 3, compiled).tier, 1)
+        with self.assertWarns(DeprecationWarning):
+            self.assertEqual(Treatment(1, 3, compiled).tier, 1)
+
+
+class TestDeathTable(unittest.TestCase):
+    def test_death_table(self):
+        """The death table matches the death function at every time"""
+        compiled = CompiledParams()
+        for i, row in enumerate(compiled.death_table):
+            self.assertEqual(len(row), Params.NUM_TIMESTEPS + 1)
+            for t, probability in enumerate(row):
+                self.assertEqual(probability, compiled.death_functions[i](
+                    compiled.death_probabilities[i], t))
+
+    def test_vectorised_death_function(self):
+        """The vectorised model's chances of death, from the death table or
+        the death function called on arrays, are the death function of each
+        tier at every time infected, including times beyond the table, so
+        runs are the same either way"""
+        def death_function(p, t):
+            return np.minimum(0.02 * t + p, 1)
+
+        config = Config.from_params()._replace(
+            NUM_TIMESTEPS=20, POPULATION_SIZE=200, INITIALLY_INFECTED=20,
+            PROBABILITY_GENERAL_RECOVERY=0.05, PROBABILITY_TREATMENT_RECOVERY=0.1,
+            DEATH_FUNCTION=death_function, PROBABILITY_SPREAD=0.5, NUM_SPREAD_TO=1,
+        ).reset_granular_parameters()
+        # Give each tier its own intermediate base chance of death
+        config = config._replace(RESISTANCE_PROPERTIES={
+            name: properties[:4] + (0.1 * (i + 1),) + properties[5:]
+            for i, (name, properties) in enumerate(config.RESISTANCE_PROPERTIES.items())
+        })
+
+        levels, times = np.meshgrid(np.arange(config.NUM_RESISTANCES + 1),
+                                    np.arange(config.NUM_TIMESTEPS + 10), indexing="ij")
+        levels, times = levels.ravel(), times.ravel()
+        expected = [death_function(0.1 * (level + 1), t) for level, t in zip(levels, times)]
+        for vectorised_death_function in (False, True):
+            m = VectorisedModel(vectorised_death_function=vectorised_death_function,
+                                config=config)
+            self.assertEqual(m._death_probabilities(levels, times).tolist(), expected)
+
+        deaths = []
+        for vectorised_death_function in (False, True):
+            m = VectorisedModel(random_seed=1, vectorised_death_function=vectorised_death_function,
+                                config=config)
+            m.run()
+            deaths.append(list(m.data_handler.get_death_data()))
+        self.assertGreater(deaths[0][-1], 0)
+        self.assertEqual(deaths[0], deaths[1])
+
+
+class TestActiveSet(unittest.TestCase):
+    def test_active_set_matches_population(self):
+        """The tracked infected people and counts match the population"""
         for _ in range(PROPERTY_BASED_TESTING_REPEATS):
             m = run()
-            for i in range(Params.NUM_TIMESTEPS):
-                infected = sum([x[i] for x in m.data_handler.get_infected_data()])
-                dead = m.data_handler.get_death_data()[i]
-                immune = m.data_handler.get_immune_data()[i]
-                uninfected = m.data_handler.get_uninfected_data()[i]
-                self.assertEqual(sum([infected, dead, immune, uninfected]),Params.POPULATION_SIZE)
+            infected = [p for p in m.population if p.alive and p.infection is not None]
+            self.assertEqual(set(map(id, m.infected)), set(map(id, infected)))
+            self.assertEqual(len(m.infected), len(infected))
+            self.assertEqual(m.num_dead, sum(not p.alive for p in m.population))
+            self.assertEqual(m.num_immune, sum(p.immune for p in m.population))
+            self.assertEqual(m.num_uninfected, sum(
+                p.alive and not p.immune and p.infection is None for p in m.population))
+        reset_params()
+
+    def test_counts_match_record_person(self):
+        """The counts kept as people change state match recording every
+        person in the population"""
+        for _ in range(PROPERTY_BASED_TESTING_REPEATS):
+            m = run()
+            d = DataHandler()
+            for person in m.population:
+                d.record_person(person)
+            self.assertEqual(m.num_infected_stages, d.num_infected_stages)
+            self.assertEqual(m.num_isolated, d.num_isolated)
+            self.assertEqual(m.num_dead, d.num_dead)
         reset_params()
 
 
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Run variants of a scenario which only differ after some timestep, such as
+introducing the product partway through an outbreak, by simulating the
+shared warm-up once and forking a copy of the model for each variant from
+there, rather than simulating every variant from the start"""
+
+from .model_minimal import Settings, Config, Model
+from .design import get_config
+
+
+def run_branches(branch_at, variants, model=None, config=None, random_seed=None):
+    """Run a model until a timestep, then run a fork of it with each variant
+    from there to the end, returning the forked models in the order of the
+    variants. Variants are configs, or dictionaries of parameter values to
+    change, as the points of a sweep design are. The model defaults to a
+    Model with a given config and random seed, defaulting to those currently
+    in Params and Settings.RANDOM_SEED, but any model which can be forked,
+    such as a VectorisedModel with many replicates, can be given instead.
+    Each fork continues with the random stream of the model where it was
+    forked"""
+    if model is None:
+        if random_seed is None:
+            random_seed = Settings.RANDOM_SEED
+        model = Model(config=config, random_seed=random_seed)
+    model.run(until=branch_at)
+
+    branches = []
+    for variant in variants:
+        if not isinstance(variant, Config):
+            variant = get_config(model.config, variant)
+        branch = model.fork(variant)
+        branch.run()
+        branches.append(branch)
+    return branches
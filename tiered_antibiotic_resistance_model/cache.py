@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Cache the results of runs on disk, so repeating a run with the same
+parameters and random seed loads its result instead of simulating it again.
+Each result is stored in a file named by a hash of the function which made
+it, its canonicalised arguments, and the version of the engine's source
+code, so changing the code of an engine invalidates all its cached results.
+The least recently used results are evicted to keep the cache within a size
+limit"""
+
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import sys
+import tempfile
+from types import MappingProxyType
+
+from . import model_minimal
+from .model_minimal import Config, CompiledParams
+
+
+def _canonicalise(value):
+    """Return a value with the same meaning as a given argument of a run,
+    which can be serialised as JSON the same way in any process"""
+    if isinstance(value, Config):
+        # Functions can't be compared by value, but the model only uses the
+        # death functions through the table of death chances, so compare that
+        values = value._asdict()
+        values["DEATH_FUNCTION"] = None
+        values["RESISTANCE_PROPERTIES"] = {
+            name: properties[:-1] for name, properties in value.RESISTANCE_PROPERTIES.items()
+        }
+        values["DEATH_TABLE"] = CompiledParams(value).death_table
+        return _canonicalise(values)
+    if callable(value):
+        return "{}.{}".format(value.__module__, value.__qualname__)
+    if isinstance(value, (dict, MappingProxyType)):
+        return {str(k): _canonicalise(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_canonicalise(v) for v in value]
+    if hasattr(value, "item"):
+        # Convert numpy scalars to the Python ones they are equal to
+        return value.item()
+    return value
+
+
+def get_config_key(config):
+    """Return a hash of a config, which is the same for any configs which
+    run the model the same way"""
+    key = json.dumps(_canonicalise(config), sort_keys=True, default=repr)
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def get_dependencies(module):
+    """Return the modules of this package which a module uses, directly or
+    through other modules of the package, including itself, in order of
+    name. A module uses the modules it imports, and those of the functions
+    and classes it imports"""
+    package = __name__.rpartition(".")[0]
+    found = {}
+    pending = [module]
+    while pending:
+        module = pending.pop()
+        if module.__name__ in found:
+            continue
+        found[module.__name__] = module
+        for value in vars(module).values():
+            name = value.__name__ if inspect.ismodule(value) else getattr(value, "__module__", None)
+            if isinstance(name, str) and name.startswith(package + ".") and name in sys.modules:
+                pending.append(sys.modules[name])
+    return [found[name] for name in sorted(found)]
+
+
+def get_engine_version(function):
+    """Return a hash of the source code of the module a function is defined
+    in, and of every module of the package it uses (see get_dependencies),
+    which always includes model_minimal, so a change to any engine a
+    function runs, such as the vectorised engine behind the batched
+    ensembles, changes the version"""
+    version = hashlib.sha256()
+    modules = get_dependencies(sys.modules[function.__module__])
+    if model_minimal not in modules:
+        modules.append(model_minimal)
+    for module in modules:
+        version.update(module.__name__.encode())
+        version.update(inspect.getsource(module).encode())
+    return version.hexdigest()
+
+
+class ResultCache:
+    """A directory of the pickled results of runs, keyed by the run's
+    function, arguments and engine version, holding at most a number of
+    bytes of results"""
+
+    def __init__(self, directory=".model_cache", max_bytes=2**30):
+        """Initialise the cache as storing results in a directory, which is
+        made if it doesn't already exist"""
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def get_key(self, function, *args, **kwargs):
+        """Return the key of the result of calling a function with some
+        arguments. Any functions in the arguments, such as engines, also add
+        the version of their source code to the key"""
+        versions = [get_engine_version(function)] + [
+            get_engine_version(v) for v in list(args) + list(kwargs.values())
+            if callable(v) and not isinstance(v, Config)
+        ]
+        key = json.dumps(
+            _canonicalise([function, versions, args, kwargs]), sort_keys=True, default=repr
+        )
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def _get_filename(self, key):
+        """Return the name of the file the result with a key is stored in"""
+        return os.path.join(self.directory, key + ".pickle")
+
+    def get(self, key):
+        """Return the result stored with a key, marking it as recently used,
+        or raise a KeyError if there isn't one"""
+        filename = self._get_filename(key)
+        try:
+            with open(filename, "rb") as f:
+                result = pickle.load(f)
+        except FileNotFoundError:
+            raise KeyError(key)
+        except (pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            # Drop results which can no longer be loaded
+            os.remove(filename)
+            raise KeyError(key)
+        os.utime(filename)
+        return result
+
+    def put(self, key, result):
+        """Store a result with a key, returning whether it could be pickled,
+        then evict the least recently used results if over the size limit"""
+        try:
+            data = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, AttributeError, TypeError):
+            # Results with unpicklable parts, such as lambda death
+            # functions, aren't cached
+            return False
+        # Write to a temporary file first, so no other process ever reads a
+        # partly written result
+        handle, temporary = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(handle, "wb") as f:
+            f.write(data)
+        os.replace(temporary, self._get_filename(key))
+        self._evict()
+        return True
+
+    def _evict(self):
+        """Remove the least recently used results until the total size of the
+        cache is within its limit"""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".pickle"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        """Remove every result from the cache"""
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".pickle"):
+                os.remove(entry.path)
+
+    def call(self, function, *args, ignore=(), **kwargs):
+        """Return the result of calling a function with some arguments from
+        the cache, or call it and store the result if it isn't cached. The
+        keyword arguments named in ignore don't change the result (such as
+        the number of workers), so aren't part of the key. Runs without a
+        random seed aren't reproducible, so are never cached"""
+        if kwargs.get("random_seed", 0) is None:
+            return function(*args, **kwargs)
+        key = self.get_key(function, *args, **{
+            k: v for k, v in kwargs.items() if k not in ignore
+        })
+        try:
+            return self.get(key)
+        except KeyError:
+            pass
+        result = function(*args, **kwargs)
+        self.put(key, result)
+        return result
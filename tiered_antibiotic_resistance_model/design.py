@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Make designs of parameter values to run the model at, as lists of
+dictionaries of parameter values by their names in Params, from the values
+to try (a full grid), or from ranges to sample (a Latin hypercube or a Sobol
+sequence), and make the config for each point of a design. These are kept
+apart from sweep, which is run as a script, so the other analyses which use
+designs don't need to import it"""
+
+import itertools
+
+import numpy as np
+
+# The primitive polynomial over GF(2) of each dimension of the Sobol
+# sequence, as an integer whose bits are its coefficients, with the initial
+# direction numbers of the dimension, from Joe and Kuo (2008). The first
+# dimension is the van der Corput sequence
+SOBOL_DIRECTION_NUMBERS = [
+    (1, (1,)),
+    (3, (1,)),
+    (7, (1, 3)),
+    (11, (1, 3, 1)),
+    (13, (1, 1, 1)),
+    (19, (1, 1, 3, 3)),
+    (25, (1, 3, 5, 13)),
+    (37, (1, 1, 5, 5, 17)),
+    (41, (1, 1, 5, 5, 5)),
+    (47, (1, 1, 7, 11, 19)),
+    (55, (1, 1, 5, 1, 1)),
+    (59, (1, 1, 1, 3, 11)),
+    (61, (1, 3, 5, 5, 31)),
+    (67, (1, 3, 3, 9, 7, 49)),
+    (91, (1, 1, 1, 15, 21, 21)),
+    (97, (1, 3, 1, 13, 27, 49)),
+    (103, (1, 1, 1, 15, 7, 5)),
+    (109, (1, 3, 1, 15, 13, 25)),
+    (115, (1, 1, 5, 5, 19, 61)),
+    (131, (1, 3, 7, 11, 23, 15, 103)),
+    (137, (1, 3, 7, 13, 13, 15, 69)),
+    (143, (1, 1, 3, 13, 7, 35, 63)),
+    (145, (1, 3, 5, 9, 1, 25, 53)),
+    (157, (1, 3, 1, 13, 9, 35, 107)),
+    (167, (1, 3, 1, 5, 27, 61, 31)),
+    (171, (1, 1, 5, 11, 19, 41, 61)),
+    (185, (1, 3, 5, 3, 3, 13, 69)),
+    (191, (1, 1, 7, 13, 1, 19, 1)),
+    (193, (1, 3, 7, 5, 13, 19, 59)),
+    (203, (1, 1, 3, 9, 25, 29, 41)),
+    (211, (1, 3, 5, 13, 23, 1, 55)),
+    (213, (1, 3, 7, 3, 13, 59, 17)),
+]
+
+# The number of bits of each coordinate of a Sobol point
+SOBOL_BITS = 30
+
+
+def grid_design(values):
+    """Return the full grid design of every combination of the values to try
+    for each parameter, given as a dictionary of lists by parameter name"""
+    names = list(values)
+    return [dict(zip(names, point)) for point in itertools.product(*values.values())]
+
+
+def scale_samples(samples, ranges):
+    """Return the design given by scaling samples in the unit hypercube, with
+    one column per parameter, to the range (low, high) of each parameter.
+    Ranges with integer bounds are split into equal strata for each integer
+    they include, so integer parameters such as tiers stay integers"""
+    design = [{} for _ in range(len(samples))]
+    for column, (name, (low, high)) in enumerate(ranges.items()):
+        u = samples[:, column]
+        if isinstance(low, int) and isinstance(high, int):
+            values = np.minimum(low + np.floor(u * (high - low + 1)), high).astype(int)
+            values = [int(v) for v in values]
+        else:
+            values = [float(v) for v in low + u * (high - low)]
+        for point, value in zip(design, values):
+            point[name] = value
+    return design
+
+
+def latin_hypercube_samples(n, num_columns, random_seed=None):
+    """Return n Latin hypercube samples in the unit hypercube, as an (n,
+    num_columns) array"""
+    rng = np.random.default_rng(random_seed)
+    samples = np.empty((n, num_columns))
+    for column in range(num_columns):
+        samples[:, column] = (rng.permutation(n) + rng.random(n)) / n
+    return samples
+
+
+def latin_hypercube_design(ranges, n, random_seed=None):
+    """Return a Latin hypercube design of n points within the range of each
+    parameter, given as a dictionary of (low, high) tuples by parameter name.
+    Each parameter's range is split into n equal strata, and each stratum is
+    sampled exactly once, in a random order independent of the others"""
+    return scale_samples(latin_hypercube_samples(n, len(ranges), random_seed), ranges)
+
+
+def _get_direction_numbers(num_columns):
+    """Return the (column, bit) array of the direction numbers of the first
+    dimensions of the Sobol sequence, each a SOBOL_BITS bit integer"""
+    if num_columns > len(SOBOL_DIRECTION_NUMBERS):
+        raise ValueError("Sobol designs have at most {} parameters".format(
+            len(SOBOL_DIRECTION_NUMBERS)
+        ))
+    directions = np.zeros((num_columns, SOBOL_BITS), dtype=np.uint64)
+    for column, (polynomial, initial) in enumerate(SOBOL_DIRECTION_NUMBERS[:num_columns]):
+        if polynomial == 1:
+            v = [1 << (SOBOL_BITS - 1 - k) for k in range(SOBOL_BITS)]
+        else:
+            degree = polynomial.bit_length() - 1
+            v = [m << (SOBOL_BITS - 1 - k) for k, m in enumerate(initial)]
+            for k in range(degree, SOBOL_BITS):
+                value = v[k - degree] ^ (v[k - degree] >> degree)
+                for i in range(1, degree):
+                    if (polynomial >> (degree - i)) & 1:
+                        value ^= v[k - i]
+                v.append(value)
+        directions[column] = v
+    return directions
+
+
+def sobol_samples(n, num_columns, random_seed=None, scramble=True):
+    """Return the first n points of the Sobol sequence in the unit hypercube,
+    as an (n, num_columns) array, in Gray code order. If scrambled, the
+    direction numbers of each column are multiplied by a random lower
+    triangular matrix and the points are shifted by a random digit vector,
+    which keeps the sequence balanced but removes its point at the origin
+    and the patterns of its early points"""
+    if n > 2**SOBOL_BITS:
+        raise ValueError("Sobol designs have at most 2**{} points".format(SOBOL_BITS))
+    directions = _get_direction_numbers(num_columns)
+    shift = np.zeros(num_columns, dtype=np.uint64)
+    if scramble:
+        rng = np.random.default_rng(random_seed)
+        # Row r of each matrix has its diagonal bit and random bits left of
+        # it, so bit r of a scrambled direction number only depends on the
+        # higher bits of the original
+        top = 1 << (SOBOL_BITS - 1)
+        for column in range(num_columns):
+            scrambled = np.zeros(SOBOL_BITS, dtype=np.uint64)
+            for r in range(SOBOL_BITS):
+                row = int(rng.integers(1 << r)) << (SOBOL_BITS - r) | (top >> r)
+                bits = directions[column] & np.uint64(row)
+                parity = np.array([bin(int(b)).count("1") & 1 for b in bits], dtype=np.uint64)
+                scrambled |= parity << np.uint64(SOBOL_BITS - 1 - r)
+            directions[column] = scrambled
+        shift = rng.integers(1 << SOBOL_BITS, size=num_columns, dtype=np.uint64)
+
+    indices = np.arange(n, dtype=np.uint64)
+    gray = indices ^ (indices >> np.uint64(1))
+    points = np.tile(shift, (n, 1))
+    for k in range(max(1, int(n - 1).bit_length())):
+        has_bit = ((gray >> np.uint64(k)) & np.uint64(1)).astype(bool)
+        points[has_bit] ^= directions[:, k]
+    return points / 2.0**SOBOL_BITS
+
+
+def sobol_design(ranges, n, random_seed=None):
+    """Return a scrambled Sobol sequence design of n points within the range of
+    each parameter, as in latin_hypercube_design. n should be a power of 2
+    for the sequence to be balanced"""
+    return scale_samples(sobol_samples(n, len(ranges), random_seed), ranges)
+
+
+def get_config(config, point):
+    """Return a copy of a config with the parameter values of a point in a
+    design, resetting the granular parameters if any of the values are for
+    all drugs (see Config.replace)"""
+    return config.replace(**point)
@@ -0,0 +1,412 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Run many replicates of the model at once, spread across a pool of worker
+processes, and collect every series the DataHandler records into one array"""
+
+import multiprocessing
+import os
+from collections import namedtuple
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import partial
+from itertools import islice
+from math import atan, ceil, cos, inf, nan, pi, sin, sqrt
+from statistics import NormalDist
+
+import numpy as np
+
+from .model_minimal import Settings, Config, DataHandler, run
+from .model_vectorised import run_vectorised_batch
+
+
+def get_series(data_handler):
+    """Return every series recorded by a data handler as a (series, timestep)
+    array, with the disjoint series first, then the non-disjoint ones"""
+    return np.array(data_handler.ys_data + data_handler.non_disjoint)
+
+
+def get_series_labels(config=None):
+    """Return the label of each series in the arrays from get_series of runs
+    of a config, defaulting to the parameters currently in Params. The
+    number of series depends on the number of drugs, so only the rows after
+    those of the infections are the same for every config (see DEAD)"""
+    data_handler = DataHandler(config)
+    return data_handler.labels + data_handler.non_disjoint_labels
+
+
+# The rows of the series after those of the infections, counted from the
+# end, which are the same whatever the number of drugs of the config
+DEAD, IMMUNE, UNINFECTED, ISOLATED = -4, -3, -2, -1
+
+
+# The payload shared by every call run in a worker process, such as the
+# config of the replicates
+_worker_payload = None
+
+# The results of an ensemble run until its confidence interval was narrow
+# enough, with the mean and half width of the interval of its outcome
+AdaptiveResults = namedtuple("AdaptiveResults", [
+    "results", "n_replicates", "mean", "half_width", "converged",
+])
+
+
+def _get_settings():
+    """Return the settings set as upper case attributes of Settings"""
+    return {k: v for k, v in vars(Settings).items() if k.isupper()}
+
+
+def _initialise_worker(payload, settings):
+    """Set the payload and settings in a worker process to those of the
+    process which started it. The payload is passed once here rather than
+    with every call, so forked workers never need to pickle it"""
+    global _worker_payload
+    _worker_payload = payload
+    for k, v in settings.items():
+        setattr(Settings, k, v)
+    # Leave reporting to the process which started the workers
+    Settings.REPORT_PROGRESS = False
+    Settings.PRINT_DATA = False
+
+
+def _t_within(t, df):
+    """Return the chance that a Student's t distributed variable with an
+    integer number of degrees of freedom is within t of zero, from the closed
+    forms in Abramowitz and Stegun 26.7.3 and 26.7.4"""
+    theta = atan(t / sqrt(df))
+    c2 = cos(theta) ** 2
+    if df % 2:
+        total, term = 0, cos(theta)
+        for j in range(1, (df - 1) // 2 + 1):
+            total += term
+            term *= 2 * j / (2 * j + 1) * c2
+        return 2 / pi * (theta + sin(theta) * total)
+    total, term = 0, 1
+    for j in range(1, df // 2 + 1):
+        total += term
+        term *= (2 * j - 1) / (2 * j) * c2
+    return sin(theta) * total
+
+
+def t_critical_value(confidence, df):
+    """Return the value a Student's t distributed variable with an integer
+    number of degrees of freedom is within with a given chance, so the half
+    width of a confidence interval is that many standard errors. With many
+    degrees of freedom, the normal distribution is used instead"""
+    if df > 1000:
+        return NormalDist().inv_cdf((1 + confidence) / 2)
+    low, high = 0, 1
+    while _t_within(high, df) < confidence:
+        low, high = high, 2 * high
+    for _ in range(60):
+        middle = (low + high) / 2
+        if _t_within(middle, df) < confidence:
+            low = middle
+        else:
+            high = middle
+    return (low + high) / 2
+
+
+def confidence_interval(values, confidence=0.95):
+    """Return the mean of some values and the half width of the confidence
+    interval of the mean, which is infinite for fewer than two values"""
+    values = np.asarray(values, dtype=float)
+    mean = values.mean()
+    if len(values) < 2:
+        return mean, inf
+    standard_error = values.std(ddof=1) / sqrt(len(values))
+    return mean, t_critical_value(confidence, len(values) - 1) * standard_error
+
+
+def antithetic_confidence_interval(values, confidence=0.95):
+    """Return the mean of the values of antithetic pairs of replicates, one
+    after the other as from run_ensemble, the half width of its confidence
+    interval, and the variance reduction, which is how many times more
+    independent replicates would be needed for the same width of interval.
+    The two values of a pair aren't independent, so the interval is that of
+    the means of the pairs, which are"""
+    values = np.asarray(values, dtype=float)
+    pair_means = values.reshape(_get_num_pairs(len(values)), 2).mean(axis=1)
+    mean, half_width = confidence_interval(pair_means, confidence)
+    # The variance of the mean of n independent values is var / n, and of n
+    # / 2 pairs is pair_var / (n / 2)
+    pair_variance = pair_means.var(ddof=1) if len(pair_means) > 1 else nan
+    variance_reduction = values.var(ddof=1) / (2 * pair_variance) if pair_variance else inf
+    return mean, half_width, variance_reduction
+
+
+def get_random_seed(random_seed):
+    """Return a random seed, defaulting to Settings.RANDOM_SEED"""
+    if random_seed is None:
+        return Settings.RANDOM_SEED
+    return random_seed
+
+
+def spawn_seeds(n, random_seed=None):
+    """Return n independent random seeds derived from a root random seed,
+    defaulting to Settings.RANDOM_SEED, by spawning child seed sequences
+    from it. Each seed is an integer, so can seed any engine's generator"""
+    random_seed = get_random_seed(random_seed)
+    children = np.random.SeedSequence(random_seed).spawn(n)
+    return [int(child.generate_state(1, np.uint64)[0]) for child in children]
+
+
+def _call_with_payload(function, *args):
+    """Return the result of calling a function with some arguments and the
+    payload of this worker process"""
+    return function(*args, _worker_payload)
+
+
+def _run_replicate(engine, random_seed, antithetic, config):
+    """Run one replicate of the model with a given engine and random seed,
+    returning all its series"""
+    if antithetic:
+        m = engine(config, random_seed, antithetic=True)
+    else:
+        m = engine(config, random_seed)
+    return get_series(m.data_handler)
+
+
+def _run_batch(num_replicates, random_seed, common_random_numbers, antithetic, config):
+    """Run a batch of replicates of the vectorised model together with a
+    given random seed, returning all their series"""
+    return run_vectorised_batch(num_replicates, config, random_seed, common_random_numbers,
+                                antithetic)
+
+
+def _get_num_pairs(n_replicates):
+    """Return the number of antithetic pairs in a number of replicates,
+    which must be even"""
+    if n_replicates % 2:
+        raise ValueError("Antithetic replicates come in pairs, so need an even number")
+    return n_replicates // 2
+
+
+def _interleave(results, antithetic_results):
+    """Return the results of replicates and of their antithetic replicates,
+    with each replicate followed by its antithetic one"""
+    return np.stack((results, antithetic_results), axis=1).reshape(
+        (-1,) + results.shape[1:]
+    )
+
+
+def parallel_map(function, arguments, workers=None, payload=None):
+    """Return the result of calling a function on each tuple of arguments
+    followed by a payload shared by every call, such as the config of the
+    replicates, in this process if there is one worker, or otherwise across
+    a pool of worker processes, in the order of the arguments. The number of
+    workers defaults to the number of CPUs. The function must be defined at
+    the top level of a module, so the workers can find it, and the payload
+    is handed to each worker once, when it starts, rather than with every
+    call"""
+    with WorkerPool(workers, payload) as pool:
+        return pool.map(function, arguments)
+
+
+class WorkerPool:
+    """A pool of worker processes which stays open for as many calls as are
+    submitted to it, each given a payload shared by every call, as in
+    parallel_map. With one worker, calls are run in this process as they
+    are submitted"""
+
+    def __init__(self, workers=None, payload=None):
+        """Initialise the pool as having a number of workers, defaulting to
+        the number of CPUs, which are started when the pool is entered"""
+        if workers is None:
+            workers = os.cpu_count() or 1
+        self.workers = workers
+        self.payload = payload
+        self.executor = None
+
+    def __enter__(self):
+        """Start the worker processes"""
+        if self.workers > 1:
+            # Prefer forking the workers, which is faster to start up and
+            # doesn't need the payload (e.g. the death functions of a
+            # config) to be picklable
+            context = None
+            if "fork" in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context("fork")
+            self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context,
+                                                initializer=_initialise_worker,
+                                                initargs=(self.payload, _get_settings()))
+        return self
+
+    def __exit__(self, *exc_info):
+        """Stop the worker processes, cancelling the calls not yet started"""
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+
+    def submit(self, function, *args):
+        """Return a future of the result of calling a function on some
+        arguments and the payload"""
+        if self.executor is not None:
+            return self.executor.submit(_call_with_payload, function, *args)
+        future = Future()
+        future.set_result(function(*args, self.payload))
+        return future
+
+    def map(self, function, arguments):
+        """Return the result of calling a function on each tuple of
+        arguments and the payload, in the order of the arguments"""
+        if self.executor is None:
+            return [function(*args, self.payload) for args in arguments]
+        # Send the arguments in chunks to cut down on communication
+        chunksize = max(1, len(arguments) // (4 * self.workers))
+        return list(self.executor.map(partial(_call_with_payload, function), *zip(*arguments),
+                                      chunksize=chunksize))
+
+
+def run_ensemble(n_replicates, workers=None, engine=run, config=None, random_seed=None,
+                 cache=None, antithetic=False):
+    """Run a number of replicates of the model across a pool of worker
+    processes, returning an array of every series recorded by the data
+    handler, with shape (replicate, series, timestep), in the order given by
+    get_series_labels. The engine is a function which runs a model with a
+    given config and random seed and returns it, such as run or
+    run_vectorised, and the config defaults to the parameters currently in
+    Params. The number of workers defaults to the number of CPUs, and if it
+    is 1 the replicates are run in this process. Each replicate is seeded
+    from spawn_seeds with the root random seed, so the results are the same
+    whatever the number of workers. If a ResultCache is given, the results
+    are loaded from it if the same replicates have been run before. If
+    antithetic, the replicates come in pairs, each run once as usual and once
+    drawing antithetic random numbers (see Model) with the same seed, one
+    after the other in the results, for the engines which support it. The
+    pairs should be combined with antithetic_confidence_interval"""
+    if config is None:
+        config = Config.from_params()
+    if cache is not None:
+        return cache.call(run_ensemble, n_replicates, workers=workers, engine=engine,
+                          config=config, random_seed=get_random_seed(random_seed),
+                          antithetic=antithetic, ignore=("workers",))
+    if antithetic:
+        random_seeds = spawn_seeds(_get_num_pairs(n_replicates), random_seed)
+        arguments = [(engine, seed, flip) for seed in random_seeds for flip in (False, True)]
+    else:
+        random_seeds = spawn_seeds(n_replicates, random_seed)
+        arguments = [(engine, seed, False) for seed in random_seeds]
+    return np.stack(parallel_map(_run_replicate, arguments, workers, config))
+
+
+def run_batched_ensemble(n_replicates, workers=None, batch_size=100, config=None,
+                         random_seed=None, cache=None, common_random_numbers=False,
+                         antithetic=False):
+    """Run a number of replicates of the vectorised model as run_ensemble
+    does, but in batches of replicates which advance together as one set of
+    arrays (see VectorisedModel), which spreads the cost of each timestep
+    across the batch. Each batch is seeded from spawn_seeds, so the results
+    depend on the batch size but not the number of workers. With
+    common_random_numbers, ensembles of different configs with the same
+    random seed and batch size can be compared replicate by replicate (see
+    SynchronisedRandomStream). If antithetic, each batch of half the
+    replicates is run again drawing antithetic random numbers, and the
+    results are paired as in run_ensemble. Antithetic pairs stay in step for
+    longer with common random numbers, as each person's random numbers
+    don't depend on how many other people drew before them"""
+    if config is None:
+        config = Config.from_params()
+    if cache is not None:
+        return cache.call(run_batched_ensemble, n_replicates, workers=workers,
+                          batch_size=batch_size, config=config,
+                          random_seed=get_random_seed(random_seed),
+                          common_random_numbers=common_random_numbers,
+                          antithetic=antithetic, ignore=("workers",))
+    n_runs = _get_num_pairs(n_replicates) if antithetic else n_replicates
+    sizes = [batch_size] * (n_runs // batch_size)
+    if n_runs % batch_size:
+        sizes.append(n_runs % batch_size)
+    flips = (False, True) if antithetic else (False,)
+    arguments = [
+        (size, seed, common_random_numbers, flip)
+        for size, seed in zip(sizes, spawn_seeds(len(sizes), random_seed))
+        for flip in flips
+    ]
+    batches = parallel_map(_run_batch, arguments, workers, config)
+    if antithetic:
+        batches = [_interleave(*batches[i:i + 2]) for i in range(0, len(batches), 2)]
+    return np.concatenate(batches)
+
+
+def get_final_deaths(results):
+    """Return the final number of deaths of each replicate of an ensemble"""
+    return results[:, DEAD, -1]
+
+
+def get_peak_isolated(results):
+    """Return the peak number of people isolated at once in each replicate
+    of an ensemble"""
+    return results[:, ISOLATED].max(axis=1)
+
+
+def get_time_to_resistance(results, drug=None, config=None):
+    """Return the first timestep anyone is infected with resistance to a
+    drug, defaulting to the last drug, in each replicate of an ensemble, or
+    the number of timesteps if no one ever is. A drug is found by name among
+    those of the config of the ensemble, defaulting to Params"""
+    if drug is None:
+        row = DEAD - 1
+    else:
+        row = get_series_labels(config).index("Resistance to {}".format(drug))
+    resistant = results[:, row] > 0
+    return np.where(resistant.any(axis=1), resistant.argmax(axis=1), results.shape[2])
+
+
+def _run_replicates(engine, random_seed, config):
+    """Run one replicate of the model with a given engine and random seed,
+    returning its series as an ensemble of one replicate"""
+    return _run_replicate(engine, random_seed, False, config)[None]
+
+
+def run_adaptive_ensemble(target, relative=True, outcome=get_final_deaths, confidence=0.95,
+                          min_replicates=100, max_replicates=10000, workers=None,
+                          batch_size=100, config=None, random_seed=None, engine=None):
+    """Run batches of replicates of the vectorised model, as in
+    run_batched_ensemble, until the confidence interval of the mean outcome
+    (defaulting to the final number of deaths) is within a target of it, or
+    the budget of replicates runs out. The target is a fraction of the mean
+    if relative, so 0.01 is within 1%, or otherwise an absolute half width.
+    The interval isn't trusted until there are at least min_replicates, as
+    the spread of a few replicates can by chance be small. If an engine is
+    given, such as run, replicates are run with it one at a time as in
+    run_ensemble instead. One pool of workers runs every batch, with a new
+    batch started as each finishes, and the interval is checked after each
+    batch in order, so the results are those of the first batches of
+    run_batched_ensemble (or the first replicates of run_ensemble), whatever
+    the number of workers"""
+    if max_replicates < 1:
+        raise ValueError("The budget must be at least one replicate")
+    if config is None:
+        config = Config.from_params()
+    if engine is None:
+        random_seeds = spawn_seeds(ceil(max_replicates / batch_size), random_seed)
+        tasks = [
+            (_run_batch, min(batch_size, max_replicates - i * batch_size), seed, False, False)
+            for i, seed in enumerate(random_seeds)
+        ]
+    else:
+        tasks = [(_run_replicates, engine, seed)
+                 for seed in spawn_seeds(max_replicates, random_seed)]
+
+    batches = []
+    with WorkerPool(workers, config) as pool:
+        # Keep every worker busy, starting the next batch as soon as one
+        # finishes, but check the batches in the order they were started.
+        # Batches still running when the target is met are cancelled
+        tasks = iter(tasks)
+        pending = deque(pool.submit(*task) for task in islice(tasks, pool.workers))
+        while pending:
+            batches.append(pending.popleft().result())
+            task = next(tasks, None)
+            if task is not None:
+                pending.append(pool.submit(*task))
+            results = np.concatenate(batches)
+            mean, half_width = confidence_interval(outcome(results), confidence)
+            if (len(results) >= min_replicates
+                    and half_width <= (target * abs(mean) if relative else target)):
+                return AdaptiveResults(results, len(results), mean, half_width, True)
+            if Settings.REPORT_PROGRESS:
+                print("{} replicates: {:.2f} +/- {:.2f}".format(len(results), mean, half_width))
+
+    return AdaptiveResults(results, len(results), mean, half_width, False)
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""A count-based engine for the model. Since everyone mixes uniformly, and
+people only differ by their infection, treatment, timers and isolation, the
+population can be stored as the number of people in each combination of
+those states, with binomial draws for how many move between them each
+timestep. The cost of a run is then independent of the population size"""
+
+import numpy as np
+
+from .model_minimal import Settings, Config, CompiledParams, DataHandler
+
+# Axes of the array of counts of infected people. The infection axis holds
+# the infection tier plus one (as in the DataHandler indices), the treatment
+# axis holds the drug tier plus one (so 0 is untreated), the time infected
+# axis is capped at the end of the death table, the time treated axis is
+# capped at the first value past the move up lag time (as only whether it
+# has been exceeded matters), and the isolated axis is 0 or 1
+INFECTION_AXIS, TREATMENT_AXIS, TIME_INFECTED_AXIS, TIME_TREATED_AXIS, ISOLATED_AXIS = range(5)
+
+
+class CompartmentalModel:
+    def __init__(self, population_size=None, initially_infected=None, random_seed=None,
+                 config=None):
+        """Initialise the model as having a population of people, stored as
+        counts of how many people are in each state"""
+        if config is None:
+            config = Config.from_params()
+        self.config = config
+        if population_size is None:
+            population_size = config.POPULATION_SIZE
+        if initially_infected is None:
+            initially_infected = config.INITIALLY_INFECTED
+
+        self.rng = np.random.default_rng(random_seed)
+
+        # Compile the parameters into tables once for the whole run, and
+        # take the per-tier properties as arrays to broadcast over the counts
+        self.compiled = compiled = CompiledParams(config)
+        num_levels = compiled.num_resistances + 1
+        self.general_recovery_probability = np.array(compiled.general_recovery_probabilities, dtype=float)
+        self.mutation_probability = np.array(compiled.mutation_probabilities, dtype=float)
+        self.spread_probability = np.array(compiled.spread_probabilities, dtype=float)
+        self.num_spread_to = np.array(compiled.nums_spread_to, dtype=float)
+        self.death_table = np.clip(np.array(compiled.death_table, dtype=float), 0, 1)
+
+        # The chance of recovery by treatment, by infection and treatment,
+        # which is zero when untreated or when the infection is resistant
+        levels = np.arange(num_levels)
+        treatment_recovery = np.concatenate(
+            ([0], compiled.treatment_recovery_probabilities)
+        )
+        correct = levels[:, None] < levels[None, :]
+        self.recovery_probability = 1 - (
+            (1 - self.general_recovery_probability[:, None])
+            * (1 - np.where(correct, treatment_recovery[None, :], 0))
+        )
+
+        # Make a default population as having a set number of initially
+        # infected people, who are untreated and have just been infected
+        self.population_size = population_size
+        self.num_time_treated = max(compiled.timesteps_move_up_lag_time, -1) + 2
+        self.infected = np.zeros(
+            (num_levels, num_levels, compiled.num_timesteps + 1, self.num_time_treated, 2),
+            dtype=np.int64,
+        )
+        self.infected[0, 0, 0, 0, 0] = initially_infected
+        self.num_dead = 0
+        self.num_immune = 0
+        self.num_uninfected = population_size - initially_infected
+
+        # Abstract away all the data handling into another class to avoid
+        # cluttering up the model logic
+        self.data_handler = DataHandler(config)
+
+    def _record_population(self):
+        """Record the number of people in each category"""
+        self.data_handler.record_counts(
+            self.infected.sum(axis=(1, 2, 3, 4)),
+            self.num_dead, self.num_immune, self.num_uninfected,
+            self.infected[..., 1].sum(),
+        )
+
+    def _increase_treatment(self):
+        """Move a binomial number of people who have been treated for long
+        enough up a treatment tier, and start the untreated on the lowest"""
+        x = self.infected
+        last = x.shape[TREATMENT_AXIS] - 1
+        long_enough = self.num_time_treated - 1
+        moved = self.rng.binomial(
+            x[:, 1:last, :, long_enough, :], self.compiled.probability_move_up_treatment
+        )
+        x[:, 1:last, :, long_enough, :] -= moved
+        x[:, 2:, :, long_enough, :] += moved
+
+        x[:, 1, :, 0, :] += x[:, 0].sum(axis=TIME_TREATED_AXIS - 1)
+        x[:, 0] = 0
+
+    def _isolate(self):
+        """Isolate everyone in a high enough treatment class"""
+        x = self.infected
+        start = max(self.compiled.isolation_threshold + 1, 1)
+        x[:, start:, ..., 1] += x[:, start:, ..., 0]
+        x[:, start:, ..., 0] = 0
+
+    def _use_product(self):
+        """Isolate a binomial number of people with detectable infections, and
+        move them onto the treatment one above the detection level"""
+        x = self.infected
+        level = self.compiled.product_detection_level
+        detected = self.rng.binomial(x[level + 1:], self.compiled.probability_product_detect)
+        x[level + 1:] -= detected
+        detected = detected.sum(axis=ISOLATED_AXIS)
+        # Those on a treatment at or below the detection level restart on the
+        # treatment one above it, and the others keep their treatment
+        switch = level + 2
+        x[level + 1:, switch, :, 0, 1] += detected[:, :switch].sum(axis=(1, 3))
+        x[level + 1:, switch:, :, :, 1] += detected[:, switch:]
+
+    def _recover(self):
+        """Recover a binomial number of people in each state"""
+        x = self.infected
+        recovered = self.rng.binomial(x, self.recovery_probability[:, :, None, None, None])
+        x -= recovered
+        self.num_immune += int(recovered.sum())
+
+    def _mutate(self):
+        """Make a binomial number of infections in each state become resistant
+        to their treatment"""
+        x = self.infected
+        mutated = self.rng.binomial(x, self.mutation_probability[:, None, None, None, None])
+        x -= mutated
+        mutated = mutated.sum(axis=INFECTION_AXIS)
+        for treatment in range(1, x.shape[TREATMENT_AXIS]):
+            x[treatment, treatment] += mutated[treatment]
+
+    def _die(self):
+        """Kill a binomial number of people in each state"""
+        x = self.infected
+        died = self.rng.binomial(x, self.death_table[:, None, :, None, None])
+        x -= died
+        self.num_dead += int(died.sum())
+
+    def _increase_time(self):
+        """Increment the time infected and time treated of everyone, keeping
+        anyone at the end of either axis there"""
+        x = self.infected
+        for axis in (TIME_INFECTED_AXIS, TIME_TREATED_AXIS):
+            shifted = np.zeros_like(x)
+            before = [slice(None)] * axis
+            shifted[tuple(before + [slice(1, None)])] = x[tuple(before + [slice(None, -1)])]
+            shifted[tuple(before + [-1])] += x[tuple(before + [-1])]
+            x = shifted
+        self.infected = x
+
+    def _spread(self):
+        """Spread infections through the population. A binomial number of
+        non-isolated people at each tier spread to others, then each person
+        who can receive an infection is hit by the spreaders of a tier with
+        some probability, and takes the most resistant infection they are hit
+        by if it is more resistant than their own"""
+        x = self.infected
+        num_levels = x.shape[INFECTION_AXIS]
+        contactable = x[..., 0]
+        spreaders = self.rng.binomial(
+            contactable.sum(axis=(1, 2, 3)), self.spread_probability
+        )
+        # The chance any one person is in the sample of a spreader of each tier
+        hit = 1 - (1 - np.minimum(self.num_spread_to / self.population_size, 1)) ** spreaders
+        if not hit.any():
+            return
+
+        # Go from the most resistant tier down, as receivers take the most
+        # resistant infection they are hit by, so only those not hit by a
+        # more resistant tier are left to be hit by each tier
+        uninfected = self.num_uninfected
+        new = np.zeros_like(contactable)
+        for level in reversed(range(num_levels)):
+            # Uninfected people are newly infected, and untreated
+            infected = self.rng.binomial(uninfected, hit[level])
+            uninfected -= infected
+            new[level, 0, 0, 0] += infected
+            # Infected people with a less resistant infection keep the rest
+            # of their state
+            upgraded = self.rng.binomial(contactable[:level], hit[level])
+            contactable[:level] -= upgraded
+            new[level] += upgraded.sum(axis=0)
+        contactable += new
+        self.num_uninfected = uninfected
+
+    def run(self):
+        """Simulate a number of timesteps within the model"""
+
+        # Repeat the simulation for a set number of timesteps
+        for _ in range(self.compiled.num_timesteps):
+
+            # Record the data throughout the model
+            self._record_population()
+
+            # Once no one is infected, no one's state can change again, so stop
+            # simulating and store this timestep's data for the remaining ones
+            if not self.infected.any():
+                self.data_handler.fill_timesteps(self.compiled.num_timesteps)
+                break
+
+            """Handle increasing treatment"""
+            self._increase_treatment()
+
+            """Handle isolation"""
+            self._isolate()
+
+            """Handle use of the product"""
+            if self.compiled.product_in_use:
+                self._use_product()
+
+            """Handle Recovery generally or by treatment if currently infected"""
+            self._recover()
+
+            """Handle Mutation to higher resistance due to treatment"""
+            self._mutate()
+
+            """Handle deaths due to infection"""
+            self._die()
+
+            """Handle agent state about timesteps"""
+            self._increase_time()
+
+            """Handle infection spread through the population"""
+            self._spread()
+
+            # Process data recorded in this timestep, and output any according
+            # to parameters indicating output format
+            self.data_handler.process_timestep_data()
+
+    def __repr__(self):
+        """Provide a string representation for the model"""
+        return "CompartmentalModel"
+
+
+def run_compartmental(config=None, random_seed=None):
+    """Run the compartmental model with a given set of parameters, defaulting to
+    those currently in Params, and a given random seed, defaulting to
+    Settings.RANDOM_SEED"""
+    if random_seed is None:
+        random_seed = Settings.RANDOM_SEED
+
+    # Create and run the model, seeding its random number generator
+    m = CompartmentalModel(random_seed=random_seed, config=config)
+    m.run()
+    return m
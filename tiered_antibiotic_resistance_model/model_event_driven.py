@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""An event-driven engine for the model, in continuous time. Instead of
+stepping every infected person through every timestep, each person's next
+recovery, mutation, treatment increase, product detection and death are
+scheduled on a priority queue (the next-reaction method), and only the people
+involved in an event are touched when it happens. The per-timestep
+probabilities in Params are converted to rates, and the state is sampled at
+each integer time for the DataHandler. Spreading is kept to the end of each
+timestep, as in Model, with each person's next spreading timestep scheduled
+on a calendar, so only people still infected at the end of a timestep spread,
+and the people they infect start having events at the next one. This is
+still an approximation of the timestep model rather than an exact match, as
+in continuous time the other events of a person compete with each other
+instead of being handled one phase at a time. People can die or mutate before
+they would have recovered within a timestep, so there are more deaths, around
+a quarter more than in Model with the default parameters, and the difference
+shrinks as the chances of events in each timestep get smaller"""
+
+from bisect import bisect_right
+from heapq import heappush, heappop
+from math import floor, inf, log
+from random import Random
+
+from .model_minimal import Settings, Config, CompiledParams, DataHandler
+
+# Kinds of event, in the order the phases of a timestep are handled in Model,
+# which breaks ties between events scheduled for the same time
+INCREASE_TREATMENT, USE_PRODUCT, RECOVER, MUTATE, DIE = range(5)
+
+# The infection level (tier plus one) of people without an infection
+UNINFECTED = -1
+
+
+def rate(probability):
+    """Return the rate of a Poisson process which has an event within one
+    unit of time with the given probability"""
+    if probability <= 0:
+        return 0
+    if probability >= 1:
+        return inf
+    return -log(1 - probability)
+
+
+def repeating_rate(probability):
+    """Return the rate of a Poisson process which has the given probability as
+    its expected number of events in one unit of time, for events which can
+    happen once every timestep in Model rather than only once"""
+    if probability >= 1:
+        return inf
+    return max(probability, 0)
+
+
+class EventDrivenModel:
+    def __init__(self, population_size=None, initially_infected=None, random_seed=None,
+                 config=None):
+        """Initialise the model as having a population of people, stored as
+        lists with one entry per person, and schedule the events of the
+        initially infected people"""
+        if config is None:
+            config = Config.from_params()
+        self.config = config
+        if population_size is None:
+            population_size = config.POPULATION_SIZE
+        if initially_infected is None:
+            initially_infected = config.INITIALLY_INFECTED
+
+        self.rng = Random(random_seed)
+
+        # Compile the parameters into tables once for the whole run, and
+        # convert the per-tier probabilities into rates, where repeating
+        # events keep the number expected in each timestep
+        self.compiled = compiled = CompiledParams(config)
+        self.general_recovery_rate = [rate(p) for p in compiled.general_recovery_probabilities]
+        self.treatment_recovery_rate = [rate(p) for p in compiled.treatment_recovery_probabilities]
+        self.mutation_rate = [rate(p) for p in compiled.mutation_probabilities]
+        self.move_up_rate = repeating_rate(compiled.probability_move_up_treatment)
+        self.product_detect_rate = rate(compiled.probability_product_detect)
+
+        # The hazard of death in each unit of time since infection, from the
+        # death table, and its cumulative sum to invert when sampling deaths
+        self.death_hazard = [
+            [rate(min(max(p, 0), 1)) for p in table] for table in compiled.death_table
+        ]
+        self.cumulative_death_hazard = []
+        for hazards in self.death_hazard:
+            total, cumulative = 0, [0]
+            for h in hazards:
+                total += h
+                cumulative.append(total)
+            self.cumulative_death_hazard.append(cumulative)
+
+        # The state of each person, where the treatment is a tier and the
+        # times are when the infection and current treatment started
+        self.population_size = population_size
+        self.infection = [UNINFECTED] * population_size
+        self.treatment = [0] * population_size
+        self.time_infected = [0.0] * population_size
+        self.time_treated = [0.0] * population_size
+        self.isolated = [False] * population_size
+        self.immune = [False] * population_size
+        self.alive = [True] * population_size
+        # Events are dropped from the queue lazily, by checking the version
+        # of the person they were scheduled for hasn't changed since
+        self.version = [0] * population_size
+        self.events = []
+        self.num_events_scheduled = 0
+        # The people due to spread at the end of each timestep, by timestep
+        self.spreads = {}
+        self.time = 0.0
+
+        # Keep the counts of people in each category up to date as events
+        # happen, rather than counting them at each timestep
+        self.num_infected_stages = [0] * (compiled.num_resistances + 1)
+        self.num_dead = 0
+        self.num_immune = 0
+        self.num_uninfected = population_size
+        self.num_isolated = 0
+
+        # Make a default population as having a set number of initially
+        # infected people, at the end of the lists as in Model
+        for person in range(population_size - initially_infected, population_size):
+            self._infect(person, 0)
+
+        # Abstract away all the data handling into another class to avoid
+        # cluttering up the model logic
+        self.data_handler = DataHandler(config)
+
+    def _delay(self, rate, repeating=False):
+        """Return the time until the next event of a Poisson process with a
+        given rate. Certain events happen immediately, or once every unit of
+        time if they repeat, to keep one per timestep as in Model"""
+        if rate == inf:
+            return 1 if repeating else 0
+        if rate == 0:
+            return inf
+        return self.rng.expovariate(rate)
+
+    def _death_delay(self, person):
+        """Return the time until a person dies, by inverting the cumulative
+        hazard of death since they were infected. Past the end of the death
+        table, the hazard is taken to stay at its last value"""
+        level = self.infection[person]
+        hazards = self.death_hazard[level]
+        cumulative = self.cumulative_death_hazard[level]
+        age = self.time - self.time_infected[person]
+        step = min(int(floor(age)), len(hazards) - 1)
+        if hazards[step] == inf:
+            return 0
+
+        # Find where the cumulative hazard passes its current value plus an
+        # exponential amount
+        target = cumulative[step] + hazards[step] * (age - step) + self.rng.expovariate(1)
+        step = bisect_right(cumulative, target) - 1
+        if step >= len(hazards):
+            if hazards[-1] == 0:
+                return inf
+            death_age = len(hazards) + (target - cumulative[-1]) / hazards[-1]
+        elif hazards[step] == inf:
+            death_age = step
+        else:
+            death_age = step + (target - cumulative[step]) / hazards[step]
+        return max(death_age - age, 0)
+
+    def _schedule(self, person):
+        """Drop any events already scheduled for a person, and schedule their
+        next event of each kind given their current state"""
+        self.version[person] += 1
+        compiled = self.compiled
+        level = self.infection[person]
+        tier = self.treatment[person]
+        times = {}
+
+        # Increasing treatment can only happen after the lag time has passed
+        # since the treatment started, then repeats until the top tier
+        if tier < compiled.num_resistances - 1:
+            enabled = self.time_treated[person] + compiled.timesteps_move_up_lag_time + 1
+            if self.time < enabled:
+                times[INCREASE_TREATMENT] = enabled + self._delay(self.move_up_rate)
+            else:
+                times[INCREASE_TREATMENT] = self.time + self._delay(self.move_up_rate, repeating=True)
+
+        # The product can only detect infections at or above its level, and
+        # only changes anything if it would isolate or switch treatment
+        if (compiled.product_in_use and level - 1 >= compiled.product_detection_level
+                and (not self.isolated[person] or tier <= compiled.product_detection_level)):
+            times[USE_PRODUCT] = self.time + self._delay(self.product_detect_rate)
+
+        # The treatment is correct if the infection isn't resistant to it
+        recovery_rate = self.general_recovery_rate[level]
+        if level - 1 < tier:
+            recovery_rate += self.treatment_recovery_rate[tier]
+        times[RECOVER] = self.time + self._delay(recovery_rate)
+
+        # Mutation makes the infection resistant to the current treatment
+        if level != tier + 1:
+            times[MUTATE] = self.time + self._delay(self.mutation_rate[level])
+
+        times[DIE] = self.time + self._death_delay(person)
+
+        for kind, time in times.items():
+            self._push(time, kind, person)
+
+        # Isolated people can't contact anyone to spread to
+        if not self.isolated[person]:
+            self._schedule_spread(person, int(floor(self.time)))
+
+    def _schedule_spread(self, person, timestep):
+        """Schedule the next timestep, from a given one, at the end of which a
+        person spreads their infection, with the chance of spreading at the
+        end of each timestep as in Model"""
+        probability = self.compiled.spread_probabilities[self.infection[person]]
+        if probability <= 0:
+            return
+        if probability < 1:
+            # The number of timesteps without spreading is geometric
+            timestep += int(floor(log(1 - self.rng.random()) / log(1 - probability)))
+        self.spreads.setdefault(timestep, []).append((person, self.version[person]))
+
+    def _push(self, time, kind, person):
+        """Add an event for a person to the queue, if it ever happens"""
+        if time < inf:
+            self.num_events_scheduled += 1
+            heappush(self.events, (time, kind, self.num_events_scheduled, person, self.version[person]))
+
+    def _set_treatment(self, person, tier):
+        """Set the treatment of a person, isolating them if it is a high
+        enough treatment class"""
+        self.treatment[person] = tier
+        if tier >= self.compiled.isolation_threshold:
+            self._isolate(person)
+
+    def _isolate(self, person):
+        """Isolate a person"""
+        if not self.isolated[person]:
+            self.isolated[person] = True
+            self.num_isolated += 1
+
+    def _infect(self, person, level):
+        """Give a person an infection at a level, starting an uninfected
+        person on the lowest treatment, and schedule their events"""
+        if self.infection[person] == UNINFECTED:
+            self.num_uninfected -= 1
+            self.time_infected[person] = self.time
+            self.time_treated[person] = self.time
+            self._set_treatment(person, 0)
+        else:
+            self.num_infected_stages[self.infection[person]] -= 1
+        self.infection[person] = level
+        self.num_infected_stages[level] += 1
+        self._schedule(person)
+
+    def _reset(self, person, immune, alive):
+        """Return a person to their default state, with the given immunity and
+        living status, as in Person.recover_from_infection and Person.die"""
+        self.num_infected_stages[self.infection[person]] -= 1
+        if self.isolated[person]:
+            self.num_isolated -= 1
+        self.infection[person] = UNINFECTED
+        self.treatment[person] = 0
+        self.isolated[person] = False
+        self.immune[person] = immune
+        self.alive[person] = alive
+        # Drop all the events scheduled for the person
+        self.version[person] += 1
+
+    def _handle(self, kind, person):
+        """Update the state of a person for an event happening to them"""
+        compiled = self.compiled
+
+        if kind == INCREASE_TREATMENT:
+            # The time treated isn't reset, as in Person.increase_treatment
+            self._set_treatment(person, self.treatment[person] + 1)
+
+        elif kind == USE_PRODUCT:
+            self._isolate(person)
+            if self.treatment[person] <= compiled.product_detection_level:
+                self.time_treated[person] = self.time
+                self._set_treatment(person, compiled.product_detection_level + 1)
+
+        elif kind == RECOVER:
+            self._reset(person, immune=True, alive=True)
+            self.num_immune += 1
+            return
+
+        elif kind == MUTATE:
+            self.num_infected_stages[self.infection[person]] -= 1
+            self.infection[person] = self.treatment[person] + 1
+            self.num_infected_stages[self.infection[person]] += 1
+
+        elif kind == DIE:
+            self._reset(person, immune=False, alive=False)
+            self.num_dead += 1
+            return
+
+        self._schedule(person)
+
+    def _spread(self, person, timestep):
+        """Give a person's infection to each person in a sample of the
+        population who can receive it (susceptible), isn't isolated
+        (contactable), and doesn't already have a more resistant infection
+        (directional), at the end of a timestep"""
+        level = self.infection[person]
+        k = self.compiled.nums_spread_to[level]
+        for receiver in self.rng.sample(range(self.population_size), k):
+            if (self.alive[receiver] and not self.immune[receiver]
+                    and not self.isolated[receiver]
+                    and self.infection[receiver] < level):
+                self._infect(receiver, level)
+        # The spreader's state hasn't changed, so only their next spread
+        # needs scheduling
+        self._schedule_spread(person, timestep + 1)
+
+    def _record_population(self):
+        """Record the number of people in each category"""
+        self.data_handler.record_counts(
+            self.num_infected_stages, self.num_dead, self.num_immune,
+            self.num_uninfected, self.num_isolated,
+        )
+
+    def run(self):
+        """Simulate a number of timesteps within the model"""
+
+        # Repeat the simulation for a set number of timesteps
+        for timestep in range(self.compiled.num_timesteps):
+
+            # Record the data at the start of the timestep
+            self._record_population()
+
+            # Once no one is infected, no one's state can change again, so stop
+            # simulating and store this timestep's data for the remaining ones
+            if not any(self.num_infected_stages):
+                self.data_handler.fill_timesteps(self.compiled.num_timesteps)
+                break
+
+            # Handle every event scheduled before the next timestep, dropping
+            # any for people whose state has changed since they were scheduled
+            while self.events and self.events[0][0] < timestep + 1:
+                time, kind, _, person, version = heappop(self.events)
+                if version != self.version[person]:
+                    continue
+                self.time = time
+                self._handle(kind, person)
+            self.time = timestep + 1
+
+            # Spread the infections of the people due to spread at the end of
+            # the timestep, who are still infected and not isolated if their
+            # state hasn't changed since they were scheduled. People infected
+            # now start having events at the next timestep
+            for person, version in self.spreads.pop(timestep, ()):
+                if version == self.version[person]:
+                    self._spread(person, timestep)
+
+            # Process data recorded in this timestep, and output any according
+            # to parameters indicating output format
+            self.data_handler.process_timestep_data()
+
+    def __repr__(self):
+        """Provide a string representation for the model"""
+        return "EventDrivenModel"
+
+
+def run_event_driven(config=None, random_seed=None):
+    """Run the event-driven model with a given set of parameters, defaulting to
+    those currently in Params, and a given random seed, defaulting to
+    Settings.RANDOM_SEED"""
+    if random_seed is None:
+        random_seed = Settings.RANDOM_SEED
+
+    # Create and run the model, seeding its random number generator
+    m = EventDrivenModel(random_seed=random_seed, config=config)
+    m.run()
+    return m
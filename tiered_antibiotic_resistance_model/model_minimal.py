@@ -1,7 +1,24 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-from random import seed, random, sample
+from array import array
+from collections import namedtuple
+from functools import lru_cache
+from random import Random, random
+from types import MappingProxyType
+import copy
+import os
+import pickle
+import tempfile
+import warnings
+import zlib
+import numpy as np
+
+def default_death_function(p, t):
+    """Return the chance of death of an infection with a base chance of death
+    p, which has been had for t timesteps"""
+    return round(min(0.001*t + p, 1), 4)
+
 
 ###############################
 ### Change these parameters ###
@@ -34,16 +51,16 @@ class Params:
     PROBABILITY_MUTATION = 0.25
     PROBABILITY_DEATH = 0.015
     # Add time infected into consideration for death chance
-    DEATH_FUNCTION = lambda p, t: round(min(0.001*t + p, 1), 4)
+    DEATH_FUNCTION = default_death_function
     PROBABILITY_SPREAD = 0.25
     NUM_SPREAD_TO = 1
 
     @staticmethod
-    def reset_granular_parameters():
+    def get_granular_parameters(params):
         """The model behaviour is based on the variables within this method,
         so changing the parameters for setting all drugs to be the same won't
-        affect anything, so this function can be called to propogate the changes
-        through the Params class"""
+        affect anything by itself. This function returns the granular
+        parameters set from those in `params` (Params or a Config), by name"""
 
         #######################################################################
         # Set these explicitly for more granular control, or use the above to #
@@ -51,44 +68,143 @@ class Params:
         #######################################################################
 
         # Lookup table of drug properties by their names
-        Params.DRUG_PROPERTIES = {}
-        Params.DRUG_PROPERTIES["Amoxicillin+"] = (
-            Params.PROBABILITY_TREATMENT_RECOVERY,
+        drug_properties = {}
+        drug_properties["Amoxicillin+"] = (
+            params.PROBABILITY_TREATMENT_RECOVERY,
         )
-        Params.DRUG_PROPERTIES["Meropenem"] = (
-            Params.PROBABILITY_TREATMENT_RECOVERY,
+        drug_properties["Meropenem"] = (
+            params.PROBABILITY_TREATMENT_RECOVERY,
         )
-        Params.DRUG_PROPERTIES["Colistin"] = (
-            Params.PROBABILITY_TREATMENT_RECOVERY,
+        drug_properties["Colistin"] = (
+            params.PROBABILITY_TREATMENT_RECOVERY,
         )
 
         # Lookup table of resistance properties by their names
-        Params.NUM_RESISTANCES = len(Params.DRUG_NAMES)
-        Params.RESISTANCE_PROPERTIES = {}
-        Params.RESISTANCE_PROPERTIES["None"] = (
-            Params.PROBABILITY_GENERAL_RECOVERY, Params.PROBABILITY_MUTATION,
-            Params.PROBABILITY_SPREAD, Params.NUM_SPREAD_TO,
-            Params.PROBABILITY_DEATH, Params.DEATH_FUNCTION,
+        resistance_properties = {}
+        resistance_properties["None"] = (
+            params.PROBABILITY_GENERAL_RECOVERY, params.PROBABILITY_MUTATION,
+            params.PROBABILITY_SPREAD, params.NUM_SPREAD_TO,
+            params.PROBABILITY_DEATH, params.DEATH_FUNCTION,
         )
-        Params.RESISTANCE_PROPERTIES["Amoxicillin+"] = (
-            Params.PROBABILITY_GENERAL_RECOVERY, Params.PROBABILITY_MUTATION,
-            Params.PROBABILITY_SPREAD, Params.NUM_SPREAD_TO,
-            Params.PROBABILITY_DEATH, Params.DEATH_FUNCTION,
+        resistance_properties["Amoxicillin+"] = (
+            params.PROBABILITY_GENERAL_RECOVERY, params.PROBABILITY_MUTATION,
+            params.PROBABILITY_SPREAD, params.NUM_SPREAD_TO,
+            params.PROBABILITY_DEATH, params.DEATH_FUNCTION,
         )
-        Params.RESISTANCE_PROPERTIES["Meropenem"] = (
-            Params.PROBABILITY_GENERAL_RECOVERY, Params.PROBABILITY_MUTATION,
-            Params.PROBABILITY_SPREAD, Params.NUM_SPREAD_TO,
-            Params.PROBABILITY_DEATH, Params.DEATH_FUNCTION,
+        resistance_properties["Meropenem"] = (
+            params.PROBABILITY_GENERAL_RECOVERY, params.PROBABILITY_MUTATION,
+            params.PROBABILITY_SPREAD, params.NUM_SPREAD_TO,
+            params.PROBABILITY_DEATH, params.DEATH_FUNCTION,
         )
-        Params.RESISTANCE_PROPERTIES["Colistin"] = (
-            Params.PROBABILITY_GENERAL_RECOVERY, Params.PROBABILITY_MUTATION,
-            Params.PROBABILITY_SPREAD, Params.NUM_SPREAD_TO,
-            Params.PROBABILITY_DEATH, Params.DEATH_FUNCTION,
+        resistance_properties["Colistin"] = (
+            params.PROBABILITY_GENERAL_RECOVERY, params.PROBABILITY_MUTATION,
+            params.PROBABILITY_SPREAD, params.NUM_SPREAD_TO,
+            params.PROBABILITY_DEATH, params.DEATH_FUNCTION,
         )
 
+        return {
+            "DRUG_PROPERTIES": drug_properties,
+            "NUM_RESISTANCES": len(params.DRUG_NAMES),
+            "RESISTANCE_PROPERTIES": resistance_properties,
+        }
+
+    @staticmethod
+    def reset_granular_parameters():
+        """Propagate changes to the parameters for setting all drugs to be the
+        same through the Params class, see get_granular_parameters"""
+        for name, value in Params.get_granular_parameters(Params).items():
+            setattr(Params, name, value)
+
 # Set the granular parameters from the generic ones
 Params.reset_granular_parameters()
 
+# The parameters which set those of all drugs at once, so need the granular
+# parameters resetting when they are changed
+ALL_DRUGS_PARAMETERS = (
+    "DRUG_NAMES", "PROBABILITY_GENERAL_RECOVERY", "PROBABILITY_TREATMENT_RECOVERY",
+    "PROBABILITY_MUTATION", "PROBABILITY_DEATH", "DEATH_FUNCTION",
+    "PROBABILITY_SPREAD", "NUM_SPREAD_TO",
+)
+
+# The parameters which are lookup tables by name, which configs keep as
+# read-only views
+PROPERTIES_PARAMETERS = ("DRUG_PROPERTIES", "RESISTANCE_PROPERTIES")
+
+
+class Config(namedtuple("Config", [
+    "NUM_TIMESTEPS", "POPULATION_SIZE", "INITIALLY_INFECTED", "DRUG_NAMES",
+    "PROBABILITY_MOVE_UP_TREATMENT", "TIMESTEPS_MOVE_UP_LAG_TIME",
+    "ISOLATION_THRESHOLD", "PRODUCT_IN_USE", "PROBABILIY_PRODUCT_DETECT",
+    "PRODUCT_DETECTION_LEVEL", "PROBABILITY_GENERAL_RECOVERY",
+    "PROBABILITY_TREATMENT_RECOVERY", "PROBABILITY_MUTATION",
+    "PROBABILITY_DEATH", "DEATH_FUNCTION", "PROBABILITY_SPREAD",
+    "NUM_SPREAD_TO", "DRUG_PROPERTIES", "NUM_RESISTANCES",
+    "RESISTANCE_PROPERTIES",
+])):
+    """A frozen copy of the parameters for a single model, with the same names
+    as in Params, so that models running at the same time don't share any
+    parameters. The lookup tables of drug and resistance properties are
+    copied into read-only views, so can't be changed in place. Change a
+    config with replace, which resets the granular parameters after changes
+    to the parameters for all drugs, as reset_granular_parameters does. The
+    _replace of any namedtuple also works, but leaves the granular parameters
+    as they are"""
+    __slots__ = ()
+
+    def __new__(cls, *args, **kwargs):
+        """Return a config of the given parameters, copying the lookup tables
+        of properties into read-only views"""
+        values = dict(zip(cls._fields, args), **kwargs)
+        for name in PROPERTIES_PARAMETERS:
+            if name in values:
+                values[name] = MappingProxyType(dict(values[name]))
+        return super().__new__(cls, **values)
+
+    @classmethod
+    def _make(cls, iterable):
+        """Return a config of an iterable of parameters, as __new__ does, so
+        _replace copies the lookup tables too"""
+        return cls(*iterable)
+
+    def __hash__(self):
+        """Return a hash of the parameters, which is the same for equal
+        configs, so configs can key dictionaries"""
+        return hash(tuple(
+            frozenset(value.items()) if isinstance(value, MappingProxyType) else value
+            for value in self
+        ))
+
+    def __getnewargs__(self):
+        """Return the parameters to pickle the config with, where read-only
+        views, which can't be pickled, are replaced by their dictionaries"""
+        return tuple(
+            dict(value) if isinstance(value, MappingProxyType) else value for value in self
+        )
+
+    @classmethod
+    def from_params(cls, params=None):
+        """Return a copy of the parameters currently set in Params"""
+        if params is None:
+            params = Params
+        values = {field: getattr(params, field) for field in cls._fields}
+        values["DRUG_NAMES"] = tuple(values["DRUG_NAMES"])
+        return cls(**values)
+
+    def reset_granular_parameters(self):
+        """Return a copy of the config with the granular parameters set from
+        the parameters for all drugs"""
+        return self._replace(**Params.get_granular_parameters(self))
+
+    def replace(self, **changes):
+        """Return a copy of the config with some parameters changed, resetting
+        the granular parameters if any of the changes are to the parameters
+        for all drugs, unless the granular parameters are changed too"""
+        config = self._replace(**changes)
+        granular = any(name in changes for name in PROPERTIES_PARAMETERS)
+        if not granular and any(name in ALL_DRUGS_PARAMETERS for name in changes):
+            config = config.reset_granular_parameters()
+        return config
+
 
 #########################
 ### Internal settings ###
@@ -113,33 +229,193 @@ class Settings:
 ### Objects and logic for the model ###
 #######################################
 
-class Infection:
-    def __init__(self, resistance=None, time_treated=0):
-        """Initialise an infection within the model"""
+# The start of every checkpoint file, which changes with the format of the
+# state stored in them
+CHECKPOINT_HEADER = b"tiered_antibiotic_resistance_model checkpoint 1\n"
+
+def _get_state_shape(config):
+    """Return the parameters of a config which set the shape of a model's
+    state, so can't be changed partway through a run"""
+    return config.NUM_TIMESTEPS, config.POPULATION_SIZE, tuple(config.DRUG_NAMES)
+
+
+def replace_config(state, config):
+    """Replace the config of the state of a model, to continue its run with
+    different parameters, checking the new config fits the state"""
+    if state["config"] is not None and _get_state_shape(config) != _get_state_shape(state["config"]):
+        raise ValueError(
+            "The number of timesteps, population size and drugs can't be changed partway through a run"
+        )
+    state["config"] = config
+
+
+def save_state(filename, state):
+    """Save the state of a model to a compressed binary file. Configs which
+    can't be pickled (e.g. with lambda death functions) are left out, so need
+    giving again when loading the state. The file is written in full before
+    replacing any old one, so an interrupted save never leaves a partial
+    checkpoint"""
+    try:
+        data = pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+    except (pickle.PicklingError, AttributeError, TypeError):
+        data = pickle.dumps(dict(state, config=None), protocol=pickle.HIGHEST_PROTOCOL)
+    handle, temporary = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)))
+    with os.fdopen(handle, "wb") as f:
+        f.write(CHECKPOINT_HEADER + zlib.compress(data))
+    os.replace(temporary, filename)
+
+
+def load_state(filename, config=None):
+    """Load the state of a model from a file saved by save_state, with the
+    config it was saved with, or a given one (e.g. to change the parameters
+    for the rest of the run)"""
+    with open(filename, "rb") as f:
+        data = f.read()
+    if not data.startswith(CHECKPOINT_HEADER):
+        raise ValueError("{} isn't a checkpoint in the current format".format(filename))
+    state = pickle.loads(zlib.decompress(data[len(CHECKPOINT_HEADER):]))
+    if config is not None:
+        replace_config(state, config)
+    elif state["config"] is None:
+        raise ValueError("The config of {} couldn't be saved, so must be given".format(filename))
+    return state
+
+
+class CompiledParams:
+    def __init__(self, params=None):
+        """Compile the parameters into tables indexed by integer tiers once per
+        run, so nothing needs to search a list or hash a string while the model
+        is running. Resistance properties are indexed by tier + 1, so that no
+        resistance (tier -1) comes first, and drug properties by tier"""
+        if params is None:
+            params = Params
+
+        self.drug_names = tuple(params.DRUG_NAMES)
+        self.num_resistances = len(self.drug_names)
+        self.resistance_names = ("None",) + self.drug_names
+        self.tiers = {name: i - 1 for i, name in enumerate(self.resistance_names)}
+
+        # Lookup tables of resistance and drug properties by their tiers
+        (
+            self.general_recovery_probabilities, self.mutation_probabilities,
+            self.spread_probabilities, self.nums_spread_to,
+            self.death_probabilities, self.death_functions,
+        ) = map(tuple, zip(*[
+            params.RESISTANCE_PROPERTIES[name] for name in self.resistance_names
+        ]))
+        self.treatment_recovery_probabilities = tuple(
+            params.DRUG_PROPERTIES[name][0] for name in self.drug_names
+        )
+
+        # The other parameters used throughout the run
+        self.num_timesteps = params.NUM_TIMESTEPS
+        self.probability_move_up_treatment = params.PROBABILITY_MOVE_UP_TREATMENT
+        self.timesteps_move_up_lag_time = params.TIMESTEPS_MOVE_UP_LAG_TIME
+        self.isolation_threshold = params.ISOLATION_THRESHOLD
+        self.product_in_use = params.PRODUCT_IN_USE
+        self.probability_product_detect = params.PROBABILIY_PRODUCT_DETECT
+        self.product_detection_level = params.PRODUCT_DETECTION_LEVEL
+
+        # Lookup table of the chance of death by tier and the number of
+        # timesteps infected, so the death functions are only called here
+        self.death_table = tuple(
+            tuple(function(probability, t) for t in range(self.num_timesteps + 1))
+            for probability, function in zip(self.death_probabilities, self.death_functions)
+        )
+
+        # The infection and treatment shared by everyone with each resistance
+        # and on each drug, indexed by tier + 1 and by tier respectively
+        self.infections = tuple(
+            Infection(tier, compiled=self) for tier in range(-1, self.num_resistances)
+        )
+        self.treatments = tuple(
+            Treatment(tier, compiled=self) for tier in range(self.num_resistances)
+        )
+
+    def get_tier(self, resistance):
+        """Return the integer tier of a resistance or drug given by its name,
+        or pass it through if it is already given as a tier"""
         if resistance is None:
-            resistance = "None"
+            return -1
+        elif isinstance(resistance, str):
+            return self.tiers[resistance]
+        return resistance
+
+
+def get_compiled_params(config=None):
+    """Return the compiled parameters of a config, defaulting to the
+    parameters currently set in Params, for infections and treatments made
+    without any. They are only compiled the first time, and shared between
+    equal configs after that, as they are never changed"""
+    if config is None:
+        config = Config.from_params()
+    return _compile_params(config)
+
+
+@lru_cache(maxsize=16)
+def _compile_params(config):
+    """Return the compiled parameters of a config, caching those of the
+    most recent configs"""
+    return CompiledParams(config)
+
+
+def _warn_time_treated(time_treated):
+    """Warn that the time treated given to an infection or treatment is
+    ignored, if it is given"""
+    if time_treated is not None:
+        warnings.warn(
+            "Infections and treatments no longer keep the time treated, which is "
+            "Person.time_treated since version 5, so it is ignored",
+            DeprecationWarning, stacklevel=3,
+        )
 
-        self.resistance = resistance
-        self.general_recovery_probability = Params.RESISTANCE_PROPERTIES[resistance][0]
-        self.mutation_probability = Params.RESISTANCE_PROPERTIES[resistance][1]
-        self.spread_probability = Params.RESISTANCE_PROPERTIES[resistance][2]
-        self.num_spread_to = Params.RESISTANCE_PROPERTIES[resistance][3]
-        self.death_probability = Params.RESISTANCE_PROPERTIES[resistance][4]
-        self.death_function = Params.RESISTANCE_PROPERTIES[resistance][5]
 
-        self.time_treated = time_treated
+class Infection:
+    __slots__ = (
+        "tier", "compiled", "general_recovery_probability", "mutation_probability",
+        "spread_probability", "num_spread_to", "death_probability", "death_function",
+    )
+
+    def __init__(self, resistance=None, time_treated=None, compiled=None):
+        """Initialise an infection within the model, with a resistance given
+        either by name or by its tier. The model shares one infection between
+        everyone with the same resistance (see CompiledParams.infections), so
+        infections are never changed once made. Without compiled parameters,
+        those of Params are used (see get_compiled_params). The time treated is kept by
+        people since version 5, so is only accepted for compatibility, with a
+        warning, and ignored"""
+        _warn_time_treated(time_treated)
+        if compiled is None:
+            compiled = get_compiled_params()
+        self.compiled = compiled
+        self.tier = compiled.get_tier(resistance)
+
+        i = self.tier + 1
+        self.general_recovery_probability = compiled.general_recovery_probabilities[i]
+        self.mutation_probability = compiled.mutation_probabilities[i]
+        self.spread_probability = compiled.spread_probabilities[i]
+        self.num_spread_to = compiled.nums_spread_to[i]
+        self.death_probability = compiled.death_probabilities[i]
+        self.death_function = compiled.death_functions[i]
+
+    @property
+    def resistance(self):
+        """The name of the drug the infection is resistant up to"""
+        return self.compiled.resistance_names[self.tier + 1]
 
     def make_resistant(self, resistance):
-        """Give the infection a specified resistance"""
-        self.__init__(resistance, self.time_treated)
+        """Return the infection with a specified resistance, by name or by
+        tier. Before version 5 this changed the infection itself, but now
+        infections are shared, so the result must be used instead"""
+        return self.compiled.infections[self.compiled.get_tier(resistance) + 1]
 
     def is_resistant(self, resistance):
         """Return whether the infection has a specified resistance"""
-        return self.get_tier() >= Infection.get_tier_from_resistance(resistance)
+        return self.tier >= self.compiled.get_tier(resistance)
 
     def get_tier(self):
         """Return how resistant the infection is - higher is more resistant"""
-        return Infection.get_tier_from_resistance(self.resistance)
+        return self.tier
 
     @staticmethod
     def get_tier_from_resistance(resistance):
@@ -150,51 +426,68 @@ class Infection:
             return Params.DRUG_NAMES.index(resistance)
 
     def duplicate(self):
-        """Return a duplicate object of the current infection"""
-        return Infection(self.resistance, self.time_treated)
+        """Return a duplicate of the current infection, which is the same
+        object as infections are never changed"""
+        return self
 
     def __repr__(self):
         """Provide a string representation for the infection"""
-        if self.resistance == "None":
+        if self.tier == -1:
             return "infected"
         else:
             return "infected with resistance up to: {}".format(self.resistance)
 
 
 class Treatment:
-    def __init__(self, drug=Params.DRUG_NAMES[0], time_treated=None):
-        """Initialise a treatment within the model"""
-        self.drug = drug
-        self.treatment_recovery_probability = Params.DRUG_PROPERTIES[drug][0]
-
-        if time_treated is not None:
-            self.time_treated = time_treated
-        else:
-            self.time_treated = 0
+    __slots__ = ("tier", "compiled", "treatment_recovery_probability")
+
+    def __init__(self, drug=None, time_treated=None, compiled=None):
+        """Initialise a treatment within the model, with a drug given either
+        by name or by its tier, defaulting to the lowest tier. As with
+        infections, the model shares one treatment between everyone on the
+        same drug (see CompiledParams.treatments), and the time treated is
+        only accepted for compatibility, as it is kept by people"""
+        _warn_time_treated(time_treated)
+        if compiled is None:
+            compiled = get_compiled_params()
+        self.compiled = compiled
+        self.tier = compiled.get_tier(0 if drug is None else drug)
+        self.treatment_recovery_probability = compiled.treatment_recovery_probabilities[self.tier]
+
+    @property
+    def drug(self):
+        """The name of the drug used in the treatment"""
+        return self.compiled.drug_names[self.tier]
 
     def next_treatment(self):
-        """Move up the treatment to the next strongest drug, and reset the
-        amount of time that it has been used to zero"""
-        drug_index = Params.DRUG_NAMES.index(self.drug)
-        if drug_index < Params.NUM_RESISTANCES - 1:
-            self.__init__(Params.DRUG_NAMES[drug_index + 1], self.time_treated)
+        """Return the treatment with the next strongest drug, or the same
+        treatment if it is already the strongest. Before version 5 this
+        changed the treatment itself and reset its time treated, but now
+        treatments are shared, so the result must be used instead, and
+        people reset their own time treated when they need to"""
+        if self.tier < self.compiled.num_resistances - 1:
+            return self.compiled.treatments[self.tier + 1]
+        return self
 
     def treats_infection(self, infection):
         """Return whether the treatment works on the infection given any
         resistances the infection may have"""
-        return not infection.is_resistant(self.drug)
+        return infection.tier < self.tier
 
     def duplicate(self):
-        """Return a duplicate object of the current treatment"""
-        return Treatment(self.drug, self.time_treated)
+        """Return a duplicate of the current treatment, which is the same
+        object as treatments are never changed"""
+        return self
 
     def __repr__(self):
         """Provide a string representation for the treatment"""
-        return "treated with drug {} for {} timesteps".format(self.drug, self.time_treated)
+        return "treated with drug {}".format(self.drug)
 
 
 class Person:
-    def __init__(self, infection=None, treatment=None, isolated=False, immune=False, time_infected=0, alive=True):
+    __slots__ = ("infection", "treatment", "isolated", "immune", "time_infected", "alive", "time_treated")
+
+    def __init__(self, infection=None, treatment=None, isolated=False, immune=False, time_infected=0, alive=True, time_treated=0):
         """Initialise a person as having various properties within the model"""
         self.infection = infection
         self.treatment = treatment
@@ -203,6 +496,7 @@ class Person:
         self.immune = immune
         self.time_infected = time_infected
         self.alive = alive
+        self.time_treated = time_treated
 
     def recover_from_infection(self):
         """Recover the person, returning them to their default state; totally
@@ -214,12 +508,13 @@ class Person:
         """Make the infection become resistant to the treatment with a given
         probability of occurring"""
         if self.infection is not None and self.treatment is not None:
-            self.infection.make_resistant(self.treatment.drug)
+            self.infection = self.infection.make_resistant(self.treatment.tier)
 
     def increase_treatment(self):
-        """Move up the treatment by one"""
+        """Move up the treatment by one, without resetting the amount of time
+        the person has been treated"""
         if self.treatment is not None:
-            self.treatment.next_treatment()
+            self.treatment = self.treatment.next_treatment()
 
     def correct_treatment(self):
         """Return whether the current treatment is sufficient to overcome
@@ -228,18 +523,24 @@ class Person:
             return self.treatment.treats_infection(self.infection)
         return False
 
-    def try_spread_infection(self, population):
-        """Give the current infection to another person, as long as they can
-        receive it (susceptible), don't already have a more resistant infection
-        (directional), and neither are isolated (contactable)"""
-        if self.infection is not None and decision(self.infection.spread_probability):
-            for receiver in sample(population, self.infection.num_spread_to):
-                directional = (receiver.infection is None
-                    or self.infection.get_tier() > receiver.infection.get_tier())
+    def try_spread_infection(self, receivers, pending):
+        """Give the current infection to each of the people it has been spread
+        to, as long as they can receive it (susceptible), don't already have a
+        more resistant infection (directional), and neither are isolated
+        (contactable). The infection is written into `pending`, a dictionary of
+        receivers to the infection they will get at the end of the timestep,
+        rather than to the receiver"""
+        if self.infection is not None:
+            for receiver in receivers:
+                # Compare against anything already spread to them this timestep
+                infection = pending.get(receiver, receiver.infection)
+                directional = (infection is None
+                    or self.infection.tier > infection.tier)
                 susceptible = not receiver.immune and receiver.alive
                 contactable = not self.isolated and not receiver.isolated
                 if directional and susceptible and contactable:
-                    receiver.infection = Infection(self.infection.resistance)
+                    # Infections are shared, so the receiver gets the same one
+                    pending[receiver] = self.infection
 
     def isolate(self):
         """Put the person in isolation"""
@@ -250,15 +551,16 @@ class Person:
         self.__init__(alive=False)
 
     def duplicate(self):
-        """Return a duplicate object of the current person, including
-        duplicates of their infections and treatments"""
+        """Return a duplicate object of the current person, sharing their
+        infection and treatment as they are never changed"""
         return Person(
-            None if self.infection is None else self.infection.duplicate(),
-            None if self.treatment is None else self.treatment.duplicate(),
+            self.infection,
+            self.treatment,
             self.isolated,
             self.immune,
             self.time_infected,
             self.alive,
+            self.time_treated,
         )
 
     def __repr__(self):
@@ -269,134 +571,346 @@ class Person:
             return "Immune person"
         elif self.infection is not None:
             if self.treatment is not None:
-                return "Person {} and {}".format(self.infection, self.treatment)
+                return "Person {} and {} for {} timesteps".format(
+                    self.infection, self.treatment, self.time_treated
+                )
             else:
                 return "Person {} and untreated".format(self.infection)
         return "Uninfected person"
 
 
 class Model:
-    def __init__(self, population=None):
-        """Initialise the model as having a population of people"""
+    def __init__(self, population=None, config=None, random_seed=None, antithetic=False):
+        """Initialise the model as having a population of people, with its own
+        copy of the parameters, defaulting to those currently in Params, and
+        its own random number generator, seeded with a given seed. An
+        antithetic model draws 1 - u for every uniform u the model with the
+        same seed draws, so the pair of runs is negatively correlated"""
+        if config is None:
+            config = Config.from_params()
+        self.config = config
+
+        # Compile the parameters into tables once for the whole run
+        self.compiled = CompiledParams(config)
+
         if population is None:
             # Make a default population as having a set number of initially
             # infected people
-            num_intially_uninfected = Params.POPULATION_SIZE - Params.INITIALLY_INFECTED
+            num_intially_uninfected = config.POPULATION_SIZE - config.INITIALLY_INFECTED
             population = [Person() for _ in range(num_intially_uninfected)]
-            for _ in range(Params.INITIALLY_INFECTED):
-                population.append(Person(infection=Infection()))
+            for _ in range(config.INITIALLY_INFECTED):
+                population.append(Person(infection=self.compiled.infections[0]))
         self.population = population
 
-        # Abstract away all the data handling into another class to avoid
-        # cluttering up the model logic
-        self.data_handler = DataHandler()
+        # Keep track of who is infected, as only they change state, and keep
+        # the number of people in each category up to date as people move
+        # between them, so they never need counting person by person
+        self.infected = []
+        self.num_infected_stages = [0] * (self.compiled.num_resistances + 1)
+        self.num_dead = 0
+        self.num_immune = 0
+        self.num_uninfected = 0
+        self.num_isolated = 0
+        for person in self.population:
+            if person.immune:
+                self.num_immune += 1
+            elif not person.alive:
+                self.num_dead += 1
+            elif person.infection is None:
+                self.num_uninfected += 1
+            else:
+                self._share_compiled(person)
+                self.infected.append(person)
+                self.num_infected_stages[person.infection.tier + 1] += 1
+            if person.isolated:
+                self.num_isolated += 1
 
-    def run(self):
-        """Simulate a number of timesteps within the model"""
+        # Draw all the random numbers the model uses through a single stream
+        self.random_stream = RandomStream(random_seed, antithetic)
 
-        # Repeat the simulation for a set number of timesteps
-        for _ in range(Params.NUM_TIMESTEPS):
+        # Abstract away all the data handling into another class to avoid
+        # cluttering up the model logic
+        self.data_handler = DataHandler(config)
+
+        # The next timestep to simulate, so a run can be resumed partway
+        self.timestep = 0
+
+    def _share_compiled(self, person):
+        """Give an infected person of a given population the shared infection
+        and treatment of the same tiers under the model's config, as theirs
+        may have been made with other parameters (e.g. those in Params)"""
+        if person.infection.tier >= self.compiled.num_resistances or (
+            person.treatment is not None and person.treatment.tier >= self.compiled.num_resistances
+        ):
+            raise ValueError("The population has people with drugs the config doesn't have")
+        person.infection = self.compiled.infections[person.infection.tier + 1]
+        if person.treatment is not None:
+            person.treatment = self.compiled.treatments[person.treatment.tier]
+
+    def get_state(self):
+        """Return the complete state of the model between timesteps. People
+        are stored as columns of integers, with an infection tier of -2 and a
+        treatment tier of -1 for none, rather than as objects referring to
+        their infections' death functions"""
+        people = self.population
+        index = {id(person): i for i, person in enumerate(people)}
+        return {
+            "config": self.config,
+            "timestep": self.timestep,
+            "infection": array("b", [-2 if p.infection is None else p.infection.tier for p in people]),
+            "treatment": array("b", [-1 if p.treatment is None else p.treatment.tier for p in people]),
+            "time_infected": array("l", [p.time_infected for p in people]),
+            "time_treated": array("l", [p.time_treated for p in people]),
+            "flags": bytes(p.isolated | p.immune << 1 | p.alive << 2 for p in people),
+            "infected": array("l", [index[id(p)] for p in self.infected]),
+            "random_stream": copy.deepcopy(self.random_stream),
+            "data_handler": self.data_handler.get_state(),
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        """Return a model in the state given by get_state"""
+        compiled = CompiledParams(state["config"])
+        population = [
+            Person(
+                infection=None if infection == -2 else compiled.infections[infection + 1],
+                treatment=None if treatment == -1 else compiled.treatments[treatment],
+                isolated=bool(flags & 1), immune=bool(flags & 2),
+                time_infected=time_infected, alive=bool(flags & 4), time_treated=time_treated,
+            )
+            for infection, treatment, time_infected, time_treated, flags in zip(
+                state["infection"], state["treatment"], state["time_infected"],
+                state["time_treated"], state["flags"],
+            )
+        ]
+        m = cls(population=population, config=state["config"])
+        # Keep the order people were infected in, which the random numbers
+        # are drawn in
+        m.infected = [population[i] for i in state["infected"]]
+        m.random_stream = state["random_stream"]
+        m.data_handler.set_state(state["data_handler"])
+        m.timestep = state["timestep"]
+        return m
+
+    def fork(self, config=None, random_seed=None):
+        """Return a copy of the model between timesteps, sharing nothing with
+        it, to continue its run with a different config (see replace_config)
+        or random seed, defaulting to the same as this model's"""
+        state = self.get_state()
+        if config is not None:
+            replace_config(state, config)
+        if random_seed is not None:
+            state["random_stream"] = type(self.random_stream)(
+                random_seed, self.random_stream.antithetic
+            )
+        return self.from_state(state)
+
+    def save_checkpoint(self, filename):
+        """Save the complete state of the model between timesteps to a file"""
+        save_state(filename, self.get_state())
+
+    @classmethod
+    def load_checkpoint(cls, filename, config=None):
+        """Return the model saved to a file by save_checkpoint, to resume its
+        run, with its own config or a given one"""
+        return cls.from_state(load_state(filename, config))
+
+    def get_infected_counts(self):
+        """Return the number of people currently infected at each level of
+        resistance, indexed by tier + 1"""
+        return list(self.num_infected_stages)
+
+    def _uncount_infected(self, person):
+        """Remove an infected person from the counts of infected and isolated
+        people, before they recover or die"""
+        self.num_infected_stages[person.infection.tier + 1] -= 1
+        if person.isolated:
+            self.num_isolated -= 1
 
-            # For each person in the population
-            for person in self.population:
+    def _recover(self, person):
+        """Make an infected person recover and become immune, updating the
+        counts"""
+        self._uncount_infected(person)
+        person.recover_from_infection()
+        self.num_immune += 1
 
-                # Record the data throughout the model
-                self.data_handler.record_person(person)
+    def run(self, until=None, checkpoint_filename=None, checkpoint_every=1):
+        """Simulate a number of timesteps within the model, from the current
+        timestep until a given one, defaulting to the end of the run. With a
+        checkpoint filename, the model is saved to it every checkpoint_every
+        timesteps, so the run can be resumed with load_checkpoint"""
 
-                # If the person is dead, they will not change state
-                if not person.alive:
-                    continue
+        compiled = self.compiled
+        if until is None:
+            until = compiled.num_timesteps
 
-                # If the person is infected, apply appropriate state changes
-                if person.infection is not None:
-
-                    """Handle increasing treatment"""
-                    if person.treatment is None:
-                        # If the person is infected but are not being treated
-                        # with **anything**, start them on the lowest tier
-                        # treatment (we can know that the person is infected,
-                        # but not which tier they are on, without diagnostic
-                        # tools, as we can see they are sick)
-                        person.treatment = Treatment()
-                    else:
-                        # If the person has been treated for a number of
-                        # consecutive days with the, a certain probability is
-                        # exceeded, move them up a treatment tier
-                        time_cond = person.treatment.time_treated > Params.TIMESTEPS_MOVE_UP_LAG_TIME
-                        rand_cond = decision(Params.PROBABILITY_MOVE_UP_TREATMENT)
-                        if time_cond and rand_cond:
-                            person.increase_treatment()
-
-                    """Handle isolation"""
-                    # Isolate if in high enough treatment class (which
-                    # is not the same as infection class - this will
-                    # likely lag behind)
-                    treatment_tier = Infection.get_tier_from_resistance(person.treatment.drug)
-                    if treatment_tier >= Params.ISOLATION_THRESHOLD:
-                        person.isolate()
-
-                    """Handle use of the product"""
-                    if person.infection.get_tier() >= Params.PRODUCT_DETECTION_LEVEL:
-                        if Params.PRODUCT_IN_USE and decision(Params.PROBABILIY_PRODUCT_DETECT):
-                            # Put people into isolation if our product detects
-                            # them as being infected
+        # Repeat the simulation for a set number of timesteps
+        for timestep in range(self.timestep, until):
+
+            # Record the data throughout the model from the counts
+            infected = self.infected
+            self.data_handler.record_counts(
+                self.num_infected_stages, self.num_dead, self.num_immune,
+                self.num_uninfected, self.num_isolated,
+            )
+
+            # Once no one is infected, no one's state can change again, so stop
+            # simulating and store this timestep's data for the remaining ones
+            if not infected:
+                self.data_handler.fill_timesteps(compiled.num_timesteps)
+                self.timestep = compiled.num_timesteps
+                break
+
+            # Apply appropriate state changes to the infected people one phase
+            # at a time. The random numbers for a phase are drawn in a block,
+            # with one number for each person who could change state in it.
+            # People only change their own states in these phases, so this is
+            # the same as taking each person through every phase in turn
+            uniforms = self.random_stream.uniforms
+
+            """Handle increasing treatment"""
+            movers = []
+            for person in infected:
+                if person.treatment is None:
+                    # If the person is infected but are not being treated
+                    # with **anything**, start them on the lowest tier
+                    # treatment (we can know that the person is infected,
+                    # but not which tier they are on, without diagnostic
+                    # tools, as we can see they are sick)
+                    person.treatment = compiled.treatments[0]
+                    person.time_treated = 0
+                elif person.time_treated > compiled.timesteps_move_up_lag_time:
+                    movers.append(person)
+            # If the person has been treated for a number of consecutive days
+            # with the, a certain probability is exceeded, move them up a
+            # treatment tier
+            for person, u in zip(movers, uniforms(len(movers))):
+                if u < compiled.probability_move_up_treatment:
+                    person.increase_treatment()
+
+            """Handle isolation"""
+            # Isolate if in high enough treatment class (which is not the same
+            # as infection class - this will likely lag behind)
+            for person in infected:
+                if person.treatment.tier >= compiled.isolation_threshold and not person.isolated:
+                    person.isolate()
+                    self.num_isolated += 1
+
+            """Handle use of the product"""
+            if compiled.product_in_use:
+                detectable = [
+                    person for person in infected
+                    if person.infection.tier >= compiled.product_detection_level
+                ]
+                for person, u in zip(detectable, uniforms(len(detectable))):
+                    if u < compiled.probability_product_detect:
+                        # Put people into isolation if our product detects
+                        # them as being infected
+                        if not person.isolated:
                             person.isolate()
-
-                            # If a person has the detected infection, put them on
-                            # a treatment course for it, (i.e. only ever change
-                            # it up to one above)
-                            if Params.DRUG_NAMES.index(person.treatment.drug) <= Params.PRODUCT_DETECTION_LEVEL:
-                                person.treatment = Treatment(Params.DRUG_NAMES[Params.PRODUCT_DETECTION_LEVEL+1])
-
-                    """Handle Recovery generally or by treatment if currently infected"""
-                    general_recovery = decision(person.infection.general_recovery_probability)
-                    treatment_recovery = (person.correct_treatment() and
-                                          decision(person.treatment.treatment_recovery_probability))
-                    if general_recovery or treatment_recovery:
-                        person.recover_from_infection()
-                        # Don't do anything else, as infection/treatment will
-                        # now be set to None
-                        continue
-
-                    """Handle Mutation to higher resistance due to treatment"""
-                    if decision(person.infection.mutation_probability):
-                        person.mutate_infection()
-
-                    """Handle deaths due to infection"""
+                            self.num_isolated += 1
+
+                        # If a person has the detected infection, put them on
+                        # a treatment course for it, (i.e. only ever change
+                        # it up to one above)
+                        if person.treatment.tier <= compiled.product_detection_level:
+                            person.treatment = compiled.treatments[
+                                compiled.product_detection_level + 1
+                            ]
+                            person.time_treated = 0
+
+            """Handle Recovery generally or by treatment if currently infected"""
+            # Only people on the correct treatment can recover by it, and
+            # people who recover don't do anything else, as infection/treatment
+            # will now be set to None
+            remaining = []
+            treated = []
+            for person, u in zip(infected, uniforms(len(infected))):
+                if u < person.infection.general_recovery_probability:
+                    self._recover(person)
+                elif person.correct_treatment():
+                    treated.append(person)
+                else:
+                    remaining.append(person)
+            for person, u in zip(treated, uniforms(len(treated))):
+                if u < person.treatment.treatment_recovery_probability:
+                    self._recover(person)
+                else:
+                    remaining.append(person)
+
+            """Handle Mutation to higher resistance due to treatment"""
+            for person, u in zip(remaining, uniforms(len(remaining))):
+                if u < person.infection.mutation_probability:
+                    self.num_infected_stages[person.infection.tier + 1] -= 1
+                    person.mutate_infection()
+                    self.num_infected_stages[person.infection.tier + 1] += 1
+
+            """Handle deaths due to infection"""
+            for person, u in zip(remaining, uniforms(len(remaining))):
+                # Look up the chance of death in the table, only calling the
+                # death function for times beyond the end of it
+                death_probabilities = compiled.death_table[person.infection.tier + 1]
+                if person.time_infected < len(death_probabilities):
+                    death_probability = death_probabilities[person.time_infected]
+                else:
                     death_probability = person.infection.death_function(
                         person.infection.death_probability,
                         person.time_infected
                     )
-                    if decision(death_probability):
-                        person.die()
-                        # Don't do anything else, as infection/treatment will
-                        # now be set to None
-                        continue
-
-                    """Handle agent state about timesteps"""
-                    # Increment the of timesteps a person has had the infection
-                    person.time_infected += 1
-                    # Increment the number of timesteps a person has been
-                    # treated with the drug (treatment will always not be
-                    # None by this point)
-                    person.treatment.time_treated += 1
+                if u < death_probability:
+                    self._uncount_infected(person)
+                    person.die()
+                    self.num_dead += 1
+                    # Don't do anything else, as infection/treatment will
+                    # now be set to None
+                    continue
+
+                """Handle agent state about timesteps"""
+                # Increment the of timesteps a person has had the infection
+                person.time_infected += 1
+                # Increment the number of timesteps a person has been
+                # treated with the drug (treatment will always not be
+                # None by this point)
+                person.time_treated += 1
 
             """Handle infection spread through the population"""
-            # We need a deepcopy operation, to prevent someone who has just
-            # been spread to in this timestep spreading the thing they've
-            # just received, so technically don't have yet
-            updated_population = [p.duplicate() for p in self.population]
-            for person in self.population:
-                # `updated_population` is passed by reference, since it is
-                # a list, so we can mutate it's state in different functions
-                # and don't need to pass it back
-                person.try_spread_infection(updated_population)
-            self.population = updated_population[:]
-
-            # updated_population data recorded in this timestep, and output any according
+            # Buffer the new infections until everyone has tried to spread,
+            # to prevent someone who has just been spread to in this timestep
+            # spreading the thing they've just received, so technically don't
+            # have yet. Only the receivers are written to, rather than
+            # duplicating the whole population
+            pending = {}
+            # Only people still infected after this timestep can spread, and
+            # they stay in the set of infected people for the next timestep
+            spreaders = [p for p in infected if p.infection is not None]
+            spread_draws = self.random_stream.uniforms(len(spreaders))
+            for person, u_spread in zip(spreaders, spread_draws):
+                if u_spread < person.infection.spread_probability:
+                    receivers = self.random_stream.sample(
+                        self.population, person.infection.num_spread_to
+                    )
+                    # `pending` is passed by reference, since it is a
+                    # dictionary, so we can mutate it's state in different
+                    # functions and don't need to pass it back
+                    person.try_spread_infection(receivers, pending)
+            self.infected = spreaders[:]
+            for receiver, infection in pending.items():
+                if receiver.infection is None:
+                    self.infected.append(receiver)
+                    self.num_uninfected -= 1
+                else:
+                    self.num_infected_stages[receiver.infection.tier + 1] -= 1
+                receiver.infection = infection
+                self.num_infected_stages[infection.tier + 1] += 1
+
+            # Process data recorded in this timestep, and output any according
             # to parameters indicating output format
             self.data_handler.process_timestep_data()
 
+            self.timestep = timestep + 1
+            if checkpoint_filename is not None and self.timestep % checkpoint_every == 0:
+                self.save_checkpoint(checkpoint_filename)
+
     def __repr__(self):
         """Provide a string representation for the model"""
         return "Model"
@@ -407,20 +921,53 @@ def decision(probability):
     return random() < probability
 
 
+class RandomStream:
+    """The source of random numbers for a model run. Uniforms are drawn a
+    block at a time, one block per phase of a timestep sized to the number of
+    people in that phase, rather than one call to `decision` per check. Each
+    stream has its own generator, so models don't share random numbers. An
+    antithetic stream gives 1 - u for each uniform u of the stream with the
+    same seed, but the same samples"""
+
+    def __init__(self, random_seed=None, antithetic=False):
+        """Initialise the stream's generator with a given seed. Samples are
+        drawn by a standard library generator seeded from it, which is
+        quicker for a few people from a large population"""
+        self.generator = np.random.default_rng(random_seed)
+        self.sampler = Random(int(self.generator.integers(2 ** 63)))
+        self.antithetic = antithetic
+
+    def uniforms(self, n):
+        """Return a block of n uniform random numbers in [0, 1), or (0, 1]
+        if antithetic, drawn in one call. The block is a list, as comparing
+        floats is quicker than comparing numpy scalars"""
+        if self.antithetic:
+            return (1 - self.generator.random(n)).tolist()
+        return self.generator.random(n).tolist()
+
+    def sample(self, population, k):
+        """Return a sample of k distinct people from the population"""
+        return self.sampler.sample(population, k)
+
+
 ###############################################
 ### Data handler and renderer for the model ###
 ###############################################
 
 class DataHandler:
-    def __init__(self):
+    def __init__(self, config=None):
         """Initialise the data handler for the model as storing data
         in an appropriate structure"""
+        if config is None:
+            config = Config.from_params()
+        self.config = config
+
         self.time = []
         # [infected, resistance #1,.. , resistance #2, dead, immune, uninfected]
-        self.ys_data = [[] for _ in range(4 + Params.NUM_RESISTANCES)]
+        self.ys_data = [[] for _ in range(4 + config.NUM_RESISTANCES)]
         self.labels = (
             ["Infected"]
-            + list(map(lambda x: "Resistance to " + x, Params.DRUG_NAMES))
+            + list(map(lambda x: "Resistance to " + x, config.DRUG_NAMES))
             + ["Dead", "Immune", "Uninfected"]
         )
 
@@ -431,10 +978,24 @@ class DataHandler:
         self.timestep = -1
         self._new_timestep_vars()
 
+    def get_state(self):
+        """Return a copy of the data recorded so far"""
+        return copy.deepcopy({
+            "time": self.time, "ys_data": self.ys_data,
+            "non_disjoint": self.non_disjoint, "timestep": self.timestep,
+        })
+
+    def set_state(self, state):
+        """Replace the data recorded so far with that given by get_state"""
+        self.time = state["time"]
+        self.ys_data = state["ys_data"]
+        self.non_disjoint = state["non_disjoint"]
+        self.timestep = state["timestep"]
+
     def get_infected_data(self):
         """Return the data about infections across all timesteps. Indices give
         0=no resistance, 1=resistance level 1, etc."""
-        return self.ys_data[0:Params.NUM_RESISTANCES+1]
+        return self.ys_data[0:self.config.NUM_RESISTANCES+1]
 
     def get_death_data(self):
         """Return the data about deaths across all timesteps"""
@@ -454,7 +1015,7 @@ class DataHandler:
 
     def _new_timestep_vars(self):
         """Make some helper variables"""
-        self.num_infected_stages = [0] * (Params.NUM_RESISTANCES + 1)
+        self.num_infected_stages = [0] * (self.config.NUM_RESISTANCES + 1)
         self.num_dead = 0
         self.num_immune = 0
         self.num_uninfected = 0
@@ -472,12 +1033,23 @@ class DataHandler:
         elif person.infection is None:
             self.num_uninfected += 1
         else:
-            self.num_infected_stages[person.infection.get_tier() + 1] += 1
+            self.num_infected_stages[person.infection.tier + 1] += 1
 
         # Non-disjoint categories
         if person.isolated:
             self.num_isolated += 1
 
+    def record_counts(self, num_infected_stages, num_dead, num_immune, num_uninfected, num_isolated):
+        """Record data about a whole group of people at once in the helper
+        variables, for engines which already know the size of each category
+        so don't need to run record_person on every person"""
+        for i, v in enumerate(num_infected_stages):
+            self.num_infected_stages[i] += int(v)
+        self.num_dead += int(num_dead)
+        self.num_immune += int(num_immune)
+        self.num_uninfected += int(num_uninfected)
+        self.num_isolated += int(num_isolated)
+
     def process_timestep_data(self):
         """Store the current timestep's data into the appropriate data
         structures"""
@@ -495,6 +1067,17 @@ class DataHandler:
         # Reset the helper variables
         self._new_timestep_vars()
 
+    def fill_timesteps(self, num_timesteps):
+        """Store the current timestep's data for it and every timestep after
+        it up to a number of timesteps, for when the model can no longer
+        change state"""
+        num_remaining = num_timesteps - len(self.time) - 1
+        self.process_timestep_data()
+        for series in self.ys_data + self.non_disjoint:
+            series.extend([series[-1]] * num_remaining)
+        self.time.extend(range(self.timestep, self.timestep + num_remaining))
+        self.timestep += num_remaining
+
     def _preprocess_disjoint_labels(self):
         """Preprocess the data and the labelling for some graph types"""
         # When as a line graph, we can draw lines for categories which
@@ -506,7 +1089,7 @@ class DataHandler:
         # disjoint can also be included
         if Settings.GRAPH_TYPE == "line":
             datas = []
-            for i in range(Params.NUM_RESISTANCES + 1):
+            for i in range(self.config.NUM_RESISTANCES + 1):
                 datas.append(
                     [sum(x) for x in zip(*self.ys_data[i:-3])]
                 )
@@ -531,7 +1114,7 @@ class DataHandler:
 
     def _print_current_progress(self, end="\n", ljust=None):
         """Output the current progress of the model"""
-        out = "{}% complete".format(str(int(self.timestep / int(Params.NUM_TIMESTEPS / 10) * 10)))
+        out = "{}% complete".format(str(int(self.timestep / int(self.config.NUM_TIMESTEPS / 10) * 10)))
         if ljust is not None:
             out = out.ljust(ljust)
         print(out, end=end)
@@ -551,14 +1134,21 @@ class DataHandler:
                 self._print_current_data()
 
 
-def run():
-    """Run the model with a given set of parameters"""
-    # Seed the random number generator
-    if Settings.RANDOM_SEED is not None:
-        seed(Settings.RANDOM_SEED)
-
-    # Create and run the model
-    m = Model()
+def run(config=None, random_seed=None, cache=None, antithetic=False):
+    """Run the model with a given set of parameters, defaulting to those
+    currently in Params, and a given random seed, defaulting to
+    Settings.RANDOM_SEED, drawing antithetic random numbers if asked (see
+    Model). If a ResultCache is given, a model run with the same parameters
+    and random seed before is loaded from it instead"""
+    if random_seed is None:
+        random_seed = Settings.RANDOM_SEED
+    if cache is not None:
+        if config is None:
+            config = Config.from_params()
+        return cache.call(run, config, random_seed=random_seed, antithetic=antithetic)
+
+    # Create and run the model, seeding its random number generator
+    m = Model(config=config, random_seed=random_seed, antithetic=antithetic)
     m.run()
     return m
 
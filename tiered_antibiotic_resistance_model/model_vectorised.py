@@ -0,0 +1,553 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""A vectorised engine for the model, holding the population as parallel
+numpy arrays rather than a list of Person objects, so every phase of a
+timestep is a masked array operation over all the infected people at once"""
+
+import copy
+
+import numpy as np
+
+from .model_minimal import (
+    Settings, Config, CompiledParams, DataHandler, RandomStream, save_state, load_state,
+    replace_config,
+)
+
+# Values of the state arrays for people without an infection or a treatment.
+# Otherwise, the infection array holds the infection tier plus one (so 0 is
+# an infection with no resistances, matching the DataHandler indices), and
+# the treatment array holds the tier of the drug
+UNINFECTED = -1
+UNTREATED = -1
+
+# The phases of a timestep which draw random numbers, which key the streams of
+# a SynchronisedRandomStream. Samples of receivers use the phases from SAMPLE
+# onwards, one per person sampled
+(INCREASE_TREATMENT, USE_PRODUCT, GENERAL_RECOVERY, TREATMENT_RECOVERY, MUTATE, DIE,
+ SPREAD, SAMPLE) = range(8)
+
+# The constants of the splitmix64 hash
+GOLDEN_GAMMA = np.uint64(0x9E3779B97F4A7C15)
+MIX_MULTIPLIERS = (np.uint64(0xBF58476D1CE4E5B9), np.uint64(0x94D049BB133111EB))
+MIX_SHIFTS = (np.uint64(30), np.uint64(27), np.uint64(31))
+
+
+class ArrayRandomStream(RandomStream):
+    """A random stream which draws its blocks of uniforms as numpy arrays from
+    its own generator, so whole phases of a timestep are drawn in one call"""
+
+    def __init__(self, random_seed=None, antithetic=False):
+        """Initialise the stream's generator with a given seed"""
+        self.generator = np.random.default_rng(random_seed)
+        self.antithetic = antithetic
+
+    def uniforms(self, n):
+        """Return a block of n uniform random numbers in [0, 1), or (0, 1]
+        if antithetic"""
+        if self.antithetic:
+            return 1 - self.generator.random(n)
+        return self.generator.random(n)
+
+    def sample(self, population, k):
+        """Return a sample of k distinct people from the population"""
+        return [population[i] for i in self.sample_rows(1, k, len(population))[0]]
+
+    def sample_rows(self, num_rows, k, population_size):
+        """Return a (num_rows, k) array, where each row is a sample of k
+        distinct indices into the population, as `sample` gives for each
+        spreader"""
+        if not 0 <= k <= population_size:
+            raise ValueError("Sample larger than population or is negative")
+        rows = self.generator.integers(population_size, size=(num_rows, k))
+        # Redraw any rows which picked the same person twice, which is rare
+        # when the sample is small compared to the population
+        while True:
+            sorted_rows = np.sort(rows, axis=1)
+            repeated = np.flatnonzero((sorted_rows[:, 1:] == sorted_rows[:, :-1]).any(axis=1))
+            if len(repeated) == 0:
+                return rows
+            rows[repeated] = self.generator.integers(population_size, size=(len(repeated), k))
+
+    def person_uniforms(self, people, timestep, phase):
+        """Return a uniform random number for each of the given people in a
+        phase of a timestep. This stream just draws the next block"""
+        return self.uniforms(len(people))
+
+    def person_samples(self, people, timestep, k, population_size):
+        """Return a sample of k distinct indices into the population for each
+        of the given people in a timestep. This stream just draws the next
+        rows"""
+        return self.sample_rows(len(people), k, population_size)
+
+
+def mix(x):
+    """Return the splitmix64 hash of each value of an array of unsigned 64
+    bit integers, which maps consecutive integers to unrelated ones"""
+    x = (x ^ (x >> MIX_SHIFTS[0])) * MIX_MULTIPLIERS[0]
+    x = (x ^ (x >> MIX_SHIFTS[1])) * MIX_MULTIPLIERS[1]
+    return x ^ (x >> MIX_SHIFTS[2])
+
+
+class SynchronisedRandomStream(ArrayRandomStream):
+    """A random stream where the random number a person is given in a phase of
+    a timestep is a hash of the seed, the timestep, the phase and the person,
+    so doesn't depend on which other people drew random numbers before them.
+    Runs with the same seed but different parameters then give each person
+    the same random numbers for as long as their states are in step (common
+    random numbers), so the differences between their results are due to the
+    parameters rather than to noise"""
+
+    def __init__(self, random_seed=None, antithetic=False):
+        """Initialise the stream's key from a given seed"""
+        super().__init__(random_seed, antithetic)
+        self.key = np.random.SeedSequence(random_seed).generate_state(1, np.uint64)
+
+    def _hash_uniforms(self, counters, timestep, phase):
+        """Return a uniform random number for each counter in a phase of a
+        timestep, from the top 53 bits of their hash"""
+        stream = mix(self.key ^ mix(np.array([timestep << 32 | phase], dtype=np.uint64)))
+        bits = mix(stream + np.asarray(counters, dtype=np.uint64) * GOLDEN_GAMMA)
+        return (bits >> np.uint64(11)) * 2.0**-53
+
+    def person_uniforms(self, people, timestep, phase):
+        """Return a uniform random number for each of the given people in a
+        phase of a timestep"""
+        if self.antithetic:
+            return 1 - self._hash_uniforms(people, timestep, phase)
+        return self._hash_uniforms(people, timestep, phase)
+
+    def person_samples(self, people, timestep, k, population_size):
+        """Return a sample of k distinct indices into the population for each
+        of the given people in a timestep, redrawing a person's whole sample
+        in the next phases along if it picks the same index twice"""
+        if not 0 <= k <= population_size:
+            raise ValueError("Sample larger than population or is negative")
+        people = np.asarray(people)
+        rows = np.empty((len(people), k), dtype=np.int64)
+        redraw = np.arange(len(people))
+        attempt = 0
+        while len(redraw):
+            for j in range(k):
+                u = self._hash_uniforms(people[redraw], timestep, SAMPLE + attempt * k + j)
+                rows[redraw, j] = (u * population_size).astype(np.int64)
+            sorted_rows = np.sort(rows[redraw], axis=1)
+            redraw = redraw[(sorted_rows[:, 1:] == sorted_rows[:, :-1]).any(axis=1)]
+            attempt += 1
+        return rows
+
+
+class VectorisedModel:
+    def __init__(self, population_size=None, initially_infected=None, random_seed=None,
+                 vectorised_death_function=False, config=None, num_replicates=1,
+                 common_random_numbers=False, antithetic=False):
+        """Initialise the model as having a population of people, stored as
+        a structure of arrays with one entry per person. If the death
+        functions accept arrays of times (e.g. using np.minimum rather than
+        min), vectorised_death_function calls them directly rather than using
+        the death table. With more than one replicate, the arrays hold the
+        people of every replicate one after the other, so all the replicates
+        advance together in each timestep, and only `series` is recorded. With
+        common_random_numbers, random numbers are drawn from a
+        SynchronisedRandomStream, so models with the same seed and number of
+        replicates can be compared person by person. An antithetic model
+        draws 1 - u for every uniform u in the phases of a timestep of the
+        model with the same seed, but the same samples of people to spread to,
+        so the pair of runs is negatively correlated"""
+        if config is None:
+            config = Config.from_params()
+        self.config = config
+        if population_size is None:
+            population_size = config.POPULATION_SIZE
+        if initially_infected is None:
+            initially_infected = config.INITIALLY_INFECTED
+
+        # Make a default population as having a set number of initially
+        # infected people, at the end of the arrays as in Model, in each
+        # replicate
+        self.population_size = population_size
+        self.num_replicates = num_replicates
+        size = num_replicates * population_size
+        self.infection = np.full(size, UNINFECTED, dtype=np.int8)
+        self.infection.reshape(num_replicates, population_size)[:, population_size - initially_infected:] = 0
+        self.treatment = np.full(size, UNTREATED, dtype=np.int8)
+        self.time_infected = np.zeros(size, dtype=np.int32)
+        self.time_treated = np.zeros(size, dtype=np.int32)
+        self.isolated = np.zeros(size, dtype=bool)
+        self.immune = np.zeros(size, dtype=bool)
+        self.alive = np.ones(size, dtype=bool)
+
+        # Draw all the random numbers the model uses through a single stream
+        if common_random_numbers:
+            self.random_stream = SynchronisedRandomStream(random_seed, antithetic)
+        else:
+            self.random_stream = ArrayRandomStream(random_seed, antithetic)
+        self.timestep = 0
+
+        # Compile the parameters into tables once for the whole run, and
+        # take the per-tier properties as arrays to index by the state arrays
+        self.compiled = CompiledParams(config)
+        self.general_recovery_probability = np.array(self.compiled.general_recovery_probabilities, dtype=float)
+        self.mutation_probability = np.array(self.compiled.mutation_probabilities, dtype=float)
+        self.spread_probability = np.array(self.compiled.spread_probabilities, dtype=float)
+        self.num_spread_to = np.array(self.compiled.nums_spread_to, dtype=np.int64)
+        self.treatment_recovery_probability = np.array(self.compiled.treatment_recovery_probabilities, dtype=float)
+        self.death_table = np.array(self.compiled.death_table, dtype=float)
+        self.vectorised_death_function = vectorised_death_function
+
+        # Keep the number of people in each category of each replicate up to
+        # date as people move between them, with the columns in the order of
+        # get_series_labels, and record them into a (replicate, series,
+        # timestep) array
+        num_levels = self.compiled.num_resistances + 1
+        self.dead, self.immune_column, self.uninfected, self.isolated_column = range(
+            num_levels, num_levels + 4
+        )
+        self.counts = np.zeros((num_replicates, num_levels + 4), dtype=np.int64)
+        self.counts[:, 0] = initially_infected
+        self.counts[:, self.uninfected] = population_size - initially_infected
+        self.series = np.zeros(
+            (num_replicates, num_levels + 4, self.compiled.num_timesteps), dtype=np.int64
+        )
+
+        # Abstract away all the data handling into another class to avoid
+        # cluttering up the model logic, when there is a single replicate
+        self.data_handler = DataHandler(config) if num_replicates == 1 else None
+
+    # The arrays which hold the whole state of the people of each replicate
+    STATE_ARRAYS = (
+        "infection", "treatment", "time_infected", "time_treated", "isolated", "immune",
+        "alive", "counts", "series",
+    )
+
+    def get_state(self):
+        """Return a copy of the complete state of the model between
+        timesteps"""
+        state = {name: getattr(self, name).copy() for name in self.STATE_ARRAYS}
+        state.update({
+            "config": self.config,
+            "timestep": self.timestep,
+            "population_size": self.population_size,
+            "num_replicates": self.num_replicates,
+            "vectorised_death_function": self.vectorised_death_function,
+            "random_stream": copy.deepcopy(self.random_stream),
+            "data_handler": None if self.data_handler is None else self.data_handler.get_state(),
+        })
+        return state
+
+    @classmethod
+    def from_state(cls, state):
+        """Return a model in the state given by get_state"""
+        m = cls(state["population_size"], 0, config=state["config"],
+                num_replicates=state["num_replicates"],
+                vectorised_death_function=state["vectorised_death_function"])
+        for name in cls.STATE_ARRAYS:
+            setattr(m, name, state[name])
+        m.random_stream = state["random_stream"]
+        if m.data_handler is not None:
+            m.data_handler.set_state(state["data_handler"])
+        m.timestep = state["timestep"]
+        return m
+
+    def fork(self, config=None, random_seed=None):
+        """Return a copy of the model between timesteps, sharing nothing with
+        it, to continue its run with a different config (see replace_config)
+        or random seed, defaulting to the same as this model's"""
+        state = self.get_state()
+        if config is not None:
+            replace_config(state, config)
+        if random_seed is not None:
+            state["random_stream"] = type(self.random_stream)(
+                random_seed, self.random_stream.antithetic
+            )
+        return self.from_state(state)
+
+    def save_checkpoint(self, filename):
+        """Save the complete state of the model between timesteps to a file"""
+        save_state(filename, self.get_state())
+
+    @classmethod
+    def load_checkpoint(cls, filename, config=None):
+        """Return the model saved to a file by save_checkpoint, to resume its
+        run, with its own config or a given one"""
+        return cls.from_state(load_state(filename, config))
+
+    def get_infected_counts(self):
+        """Return the number of people currently infected at each level of
+        resistance, indexed by tier + 1, over all the replicates"""
+        return self.counts[:, :self.dead].sum(axis=0).tolist()
+
+    def _count(self, people, columns, change):
+        """Add a change to the count in the given column (or columns, one per
+        person) of the replicate of each of the people"""
+        num_replicates, num_columns = self.counts.shape
+        cells = (people // self.population_size) * num_columns + columns
+        self.counts += change * np.bincount(
+            cells, minlength=num_replicates * num_columns
+        ).reshape(num_replicates, num_columns)
+
+    def _isolate(self, people):
+        """Isolate the given people, counting those not already isolated"""
+        people = people[~self.isolated[people]]
+        self.isolated[people] = True
+        self._count(people, self.isolated_column, 1)
+
+    def _record_population(self, timestep):
+        """Record the number of people in each category in the series, and in
+        the data handler if there is one"""
+        counts = self.counts
+        self.series[:, :, timestep] = counts
+        if self.data_handler is not None:
+            self.data_handler.record_counts(
+                counts[0, :self.dead], counts[0, self.dead], counts[0, self.immune_column],
+                counts[0, self.uninfected], counts[0, self.isolated_column],
+            )
+
+    def _death_probabilities(self, infection, time_infected):
+        """Return the death probability of infected people with the given
+        infections and times infected, looked up in the death table"""
+        if self.vectorised_death_function:
+            # Call each resistance's death function once on all its times
+            probabilities = np.empty(len(infection), dtype=float)
+            for level in np.unique(infection):
+                in_level = infection == level
+                probabilities[in_level] = self.compiled.death_functions[level](
+                    self.compiled.death_probabilities[level], time_infected[in_level]
+                )
+            return probabilities
+
+        last = self.death_table.shape[1] - 1
+        probabilities = self.death_table[infection, np.minimum(time_infected, last)]
+        # Only call the death function for times beyond the end of the table
+        for i in np.flatnonzero(time_infected > last):
+            level = infection[i]
+            probabilities[i] = self.compiled.death_functions[level](
+                self.compiled.death_probabilities[level], int(time_infected[i])
+            )
+        return probabilities
+
+    def _reset(self, people, infection, isolated, immune, alive):
+        """Return people with the given infections and isolation to their
+        default state, with the given immunity and living status, as in
+        Person.recover_from_infection and Person.die, moving them out of their
+        counts of infected and isolated people"""
+        self._count(people, infection, -1)
+        self._count(people[isolated], self.isolated_column, -1)
+        self._count(people, self.immune_column if immune else self.dead, 1)
+        self.infection[people] = UNINFECTED
+        self.treatment[people] = UNTREATED
+        self.time_infected[people] = 0
+        self.time_treated[people] = 0
+        self.isolated[people] = False
+        self.immune[people] = immune
+        self.alive[people] = alive
+
+    def _uniforms(self, people, phase):
+        """Return a uniform random number for each of the given people in a
+        phase of the current timestep"""
+        return self.random_stream.person_uniforms(people, self.timestep, phase)
+
+    def _spread(self, spreaders):
+        """Spread infections from the given infected people to a sample of the
+        people in their replicate, and buffer the most resistant infection
+        each receiver is given, so that people who have just been spread to in
+        this timestep don't spread it on"""
+        levels = self.infection[spreaders]
+        spreading = self._uniforms(spreaders, SPREAD) < self.spread_probability[levels]
+        spreaders = spreaders[spreading]
+        # Isolated people still roll to spread, but can't contact anyone
+        spreaders = spreaders[~self.isolated[spreaders]]
+        if len(spreaders) == 0:
+            return
+
+        levels = self.infection[spreaders]
+        num_spread_to = self.num_spread_to[levels]
+        receivers, received = [], []
+        for k in np.unique(num_spread_to):
+            if k == 0:
+                continue
+            group = spreaders[num_spread_to == k]
+            # Sample people within each spreader's own replicate
+            offsets = (group // self.population_size) * self.population_size
+            rows = self.random_stream.person_samples(group, self.timestep, int(k), self.population_size)
+            receivers.append((rows + offsets[:, None]).ravel())
+            received.append(np.repeat(self.infection[group], k))
+        if not receivers:
+            return
+
+        # Keep only the most resistant infection given to each receiver, by
+        # sorting by receiver then infection and taking the last of each
+        num_levels = len(self.spread_probability)
+        keys = np.sort(np.concatenate(receivers) * num_levels + np.concatenate(received))
+        receivers, received = np.divmod(keys, num_levels)
+        last = np.append(receivers[1:] != receivers[:-1], True)
+        receivers, received = receivers[last], received[last].astype(np.int8)
+
+        # Only give an infection to people who can receive it (susceptible),
+        # aren't isolated (contactable), and don't already have a more
+        # resistant infection (directional)
+        infection = self.infection[receivers]
+        can_receive = ((received > infection) & self.alive[receivers]
+                       & ~self.immune[receivers] & ~self.isolated[receivers])
+        receivers, received, infection = receivers[can_receive], received[can_receive], infection[can_receive]
+        newly_infected = infection == UNINFECTED
+        self._count(receivers[newly_infected], self.uninfected, -1)
+        self._count(receivers[~newly_infected], infection[~newly_infected], -1)
+        self._count(receivers, received, 1)
+        self.infection[receivers] = received
+
+    def run(self, until=None, checkpoint_filename=None, checkpoint_every=1):
+        """Simulate a number of timesteps within the model, from the current
+        timestep until a given one, defaulting to the end of the run. With a
+        checkpoint filename, the model is saved to it every checkpoint_every
+        timesteps, so the run can be resumed with load_checkpoint"""
+
+        compiled = self.compiled
+        if until is None:
+            until = compiled.num_timesteps
+
+        # Repeat the simulation for a set number of timesteps
+        for timestep in range(self.timestep, until):
+            self.timestep = timestep
+
+            # Record the data throughout the model
+            self._record_population(timestep)
+
+            # Only infected people change state, so work on them by index
+            people = np.flatnonzero(self.infection != UNINFECTED)
+
+            # Once no one is infected, no one's state can change again, so stop
+            # simulating and store this timestep's data for the remaining ones
+            if len(people) == 0:
+                self.series[:, :, timestep:] = self.counts[:, :, None]
+                if self.data_handler is not None:
+                    self.data_handler.fill_timesteps(compiled.num_timesteps)
+                self.timestep = compiled.num_timesteps
+                break
+
+            # Gather the state of the infected people to work on, and scatter
+            # it back once at the end of the timestep
+            infection = self.infection[people]
+            treatment = self.treatment[people]
+            time_infected = self.time_infected[people]
+            time_treated = self.time_treated[people]
+            isolated = self.isolated[people]
+
+            """Handle increasing treatment"""
+            # If the person is infected but are not being treated with
+            # **anything**, start them on the lowest tier treatment
+            untreated = treatment == UNTREATED
+            treated = np.flatnonzero(~untreated)
+            treatment[untreated] = 0
+            time_treated[untreated] = 0
+            # If the person has been treated for a number of consecutive days
+            # with the, a certain probability is exceeded, move them up a
+            # treatment tier
+            time_cond = time_treated[treated] > compiled.timesteps_move_up_lag_time
+            rand_cond = (self._uniforms(people[treated], INCREASE_TREATMENT)
+                         < compiled.probability_move_up_treatment)
+            top_cond = treatment[treated] < compiled.num_resistances - 1
+            treatment[treated[time_cond & rand_cond & top_cond]] += 1
+
+            """Handle isolation"""
+            isolate = (treatment >= compiled.isolation_threshold) & ~isolated
+
+            """Handle use of the product"""
+            if compiled.product_in_use:
+                detectable = np.flatnonzero(infection - 1 >= compiled.product_detection_level)
+                detected = detectable[
+                    self._uniforms(people[detectable], USE_PRODUCT) < compiled.probability_product_detect
+                ]
+                isolate[detected] |= ~isolated[detected]
+                switch = detected[treatment[detected] <= compiled.product_detection_level]
+                treatment[switch] = compiled.product_detection_level + 1
+                time_treated[switch] = 0
+            isolated |= isolate
+            self._count(people[isolate], self.isolated_column, 1)
+
+            """Handle Recovery generally or by treatment if currently infected"""
+            general_recovery = (self._uniforms(people, GENERAL_RECOVERY)
+                                < self.general_recovery_probability[infection])
+            # The treatment is correct if the infection isn't resistant to it
+            treatment_recovery = (infection <= treatment) & (
+                self._uniforms(people, TREATMENT_RECOVERY)
+                < self.treatment_recovery_probability[treatment]
+            )
+            recovered = general_recovery | treatment_recovery
+            self._reset(people[recovered], infection[recovered], isolated[recovered],
+                        immune=True, alive=True)
+            remaining = ~recovered
+            people, infection, treatment = people[remaining], infection[remaining], treatment[remaining]
+            time_infected, time_treated = time_infected[remaining], time_treated[remaining]
+            isolated = isolated[remaining]
+
+            """Handle Mutation to higher resistance due to treatment"""
+            mutate = np.flatnonzero(self._uniforms(people, MUTATE)
+                                    < self.mutation_probability[infection])
+            self._count(people[mutate], infection[mutate], -1)
+            infection[mutate] = treatment[mutate] + 1
+            self._count(people[mutate], infection[mutate], 1)
+
+            """Handle deaths due to infection"""
+            died = (self._uniforms(people, DIE)
+                    < self._death_probabilities(infection, time_infected))
+            self._reset(people[died], infection[died], isolated[died], immune=False, alive=False)
+            remaining = ~died
+            people, infection, treatment = people[remaining], infection[remaining], treatment[remaining]
+            time_infected, time_treated = time_infected[remaining], time_treated[remaining]
+            isolated = isolated[remaining]
+
+            """Handle agent state about timesteps"""
+            time_infected += 1
+            time_treated += 1
+
+            self.infection[people] = infection
+            self.treatment[people] = treatment
+            self.time_infected[people] = time_infected
+            self.time_treated[people] = time_treated
+            self.isolated[people] = isolated
+
+            """Handle infection spread through the population"""
+            self._spread(people)
+
+            # Process data recorded in this timestep, and output any according
+            # to parameters indicating output format
+            if self.data_handler is not None:
+                self.data_handler.process_timestep_data()
+
+            self.timestep = timestep + 1
+            if checkpoint_filename is not None and self.timestep % checkpoint_every == 0:
+                self.save_checkpoint(checkpoint_filename)
+
+    def __repr__(self):
+        """Provide a string representation for the model"""
+        return "VectorisedModel"
+
+
+def run_vectorised(config=None, random_seed=None, antithetic=False):
+    """Run the vectorised model with a given set of parameters, defaulting to
+    those currently in Params, and a given random seed, defaulting to
+    Settings.RANDOM_SEED, drawing antithetic random numbers if asked (see
+    VectorisedModel)"""
+    if random_seed is None:
+        random_seed = Settings.RANDOM_SEED
+
+    # Create and run the model, seeding its random number generator
+    m = VectorisedModel(random_seed=random_seed, config=config, antithetic=antithetic)
+    m.run()
+    return m
+
+
+def run_vectorised_batch(num_replicates, config=None, random_seed=None,
+                         common_random_numbers=False, antithetic=False):
+    """Run a number of replicates of the vectorised model together, returning
+    an array of every series with shape (replicate, series, timestep), as
+    run_ensemble does"""
+    if random_seed is None:
+        random_seed = Settings.RANDOM_SEED
+
+    # Create and run the model, seeding its random number generator
+    m = VectorisedModel(random_seed=random_seed, config=config, num_replicates=num_replicates,
+                        common_random_numbers=common_random_numbers, antithetic=antithetic)
+    m.run()
+    return m.series
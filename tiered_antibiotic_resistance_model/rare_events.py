@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Estimate the chance of rare outcomes, such as large outbreaks of infections
+resistant to every drug, by multilevel splitting. Rather than running many
+replicates and waiting for a few to reach the outcome, the chance is split
+into a product of the chances of reaching each of a sequence of increasing
+levels of a score from the previous one. At each level, the trajectories
+which reached it are cloned (by forking the model with a new random seed) to
+replace those which didn't, so the effort is spent on the trajectories which
+are getting closer to the outcome"""
+
+from collections import namedtuple
+from math import sqrt
+
+import numpy as np
+
+from .model_minimal import Config, Model
+from .ensemble import spawn_seeds
+
+# The estimated chance of a score reaching the final level at some point in a
+# run, its estimated relative error, the chance of reaching each level from
+# the one before it, and the models of the runs which reached the final level
+SplittingResults = namedtuple("SplittingResults", [
+    "probability", "relative_error", "level_probabilities", "trajectories",
+])
+
+
+def resistant_infections(tier=None):
+    """Return a score of a model, which is the number of people currently
+    infected with resistance to at least a given drug tier, defaulting to the
+    top tier"""
+    def score(model):
+        counts = model.get_infected_counts()
+        return sum(counts[(len(counts) - 2 if tier is None else tier) + 1:])
+    return score
+
+
+def _run_until(model, score, level):
+    """Run a model a timestep at a time until its score reaches a level,
+    returning whether it did in any of the timesteps of the run"""
+    num_timesteps = model.compiled.num_timesteps
+    while model.timestep < num_timesteps:
+        if score(model) >= level:
+            return True
+        model.run(until=model.timestep + 1)
+    return False
+
+
+def run_splitting(levels, score=None, n_trajectories=100, model=Model, config=None,
+                  random_seed=None):
+    """Estimate the chance that a score of a model (defaulting to the number
+    of people infected with resistance to the top drug, see
+    resistant_infections) reaches the last of a list of increasing levels at
+    some point in a run, by fixed effort multilevel splitting. A number of
+    trajectories are run from the start until they reach the first level or
+    the run ends. Then the same number of trajectories are started from
+    clones of those which reached each level, chosen at random, each with its
+    own random seed spawned from the root seed, and run until they reach the
+    next level. The model is a class which can be forked, such as Model or
+    VectorisedModel, with the config defaulting to the parameters currently
+    in Params. The trajectories which reach the final level are run to the
+    end and returned, as representatives of the outcome"""
+    if config is None:
+        config = Config.from_params()
+    if score is None:
+        score = resistant_infections()
+    random_seeds = spawn_seeds(n_trajectories * len(levels) + 1, random_seed)
+    rng = np.random.default_rng(random_seeds.pop())
+
+    # Start the trajectories from the beginning of a run
+    models = [model(config=config, random_seed=seed) for seed in random_seeds[:n_trajectories]]
+    level_probabilities = []
+    for i, level in enumerate(levels):
+        if i > 0:
+            # Clone randomly chosen trajectories which reached the last level,
+            # giving each clone its own random stream so they diverge
+            seeds = random_seeds[i * n_trajectories:(i + 1) * n_trajectories]
+            chosen = rng.integers(len(models), size=n_trajectories)
+            models = [models[c].fork(random_seed=seed) for c, seed in zip(chosen, seeds)]
+        models = [m for m in models if _run_until(m, score, level)]
+        level_probabilities.append(len(models) / n_trajectories)
+        if not models:
+            break
+
+    probability = float(np.prod(level_probabilities))
+    # The relative error of a product of independent estimates of chances,
+    # which ignores the correlation between clones of the same trajectory
+    relative_error = sqrt(sum(
+        (1 - p) / (n_trajectories * p) if p else float("inf") for p in level_probabilities
+    ))
+    for m in models:
+        m.run()
+    return SplittingResults(probability, relative_error, level_probabilities, models)
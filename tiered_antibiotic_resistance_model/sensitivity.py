@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Find which parameters drive the outcomes of the model by global
+sensitivity analysis over ranges of their values. Sobol indices split the
+variance of an outcome into the parts due to each parameter alone (first
+order) and to each parameter including its interactions with the others
+(total), from a Saltelli design. Morris screening ranks the parameters by
+their elementary effects, from far fewer runs, so is the cheaper first pass
+over many parameters. Every point of a design runs its replicates together
+as one batch of the vectorised model, and the points are spread across a
+pool of worker processes"""
+
+import numpy as np
+import pandas as pd
+
+from .model_minimal import Config
+from .ensemble import (
+    get_final_deaths, get_peak_isolated, get_time_to_resistance, get_random_seed, parallel_map,
+)
+from .design import get_config, latin_hypercube_samples, scale_samples
+from .model_vectorised import run_vectorised_batch
+
+# The outcomes of an ensemble the analyses find the sensitivity of by
+# default, as functions of its (replicate, series, timestep) array
+OUTCOMES = {
+    "Deaths": get_final_deaths,
+    "Peak isolated": get_peak_isolated,
+    "Time to last drug resistance": get_time_to_resistance,
+}
+
+
+def saltelli_design(ranges, n, random_seed=None):
+    """Return the Saltelli design of n base points for the ranges of some
+    parameters, given as a dictionary of (low, high) tuples by parameter name
+    as for a sweep. The design is n points from each of two independent
+    samples A and B, then n points for each parameter, which are those of A
+    with that parameter's value taken from B, so n * (parameters + 2) points
+    in all. A and B are the two halves of one Latin hypercube"""
+    num_parameters = len(ranges)
+    samples = latin_hypercube_samples(n, 2 * num_parameters, random_seed)
+    a, b = samples[:, :num_parameters], samples[:, num_parameters:]
+    blocks = [a, b]
+    for i in range(num_parameters):
+        ab = a.copy()
+        ab[:, i] = b[:, i]
+        blocks.append(ab)
+    return scale_samples(np.concatenate(blocks), ranges)
+
+
+def morris_design(ranges, n_trajectories, num_levels=4, random_seed=None):
+    """Return the Morris design of a number of trajectories through a grid of
+    levels of each parameter's range. Each trajectory starts at a random
+    point of the grid and changes one parameter at a time, in a random
+    order, by a step of num_levels / (2 * (num_levels - 1)) of its range, up
+    if it can and down otherwise, so has parameters + 1 points. Also return
+    the (trajectory, parameter) arrays of which parameter each step changes
+    and the signed size of the step, as fractions of the ranges"""
+    rng = np.random.default_rng(random_seed)
+    num_parameters = len(ranges)
+    delta = num_levels / (2 * (num_levels - 1))
+    samples = []
+    changed = np.empty((n_trajectories, num_parameters), dtype=int)
+    steps = np.empty((n_trajectories, num_parameters))
+    for trajectory in range(n_trajectories):
+        point = rng.integers(num_levels, size=num_parameters) / (num_levels - 1)
+        samples.append(point.copy())
+        for step, i in enumerate(rng.permutation(num_parameters)):
+            change = delta if point[i] + delta <= 1 else -delta
+            point[i] += change
+            samples.append(point.copy())
+            changed[trajectory, step] = i
+            steps[trajectory, step] = change
+    return scale_samples(np.array(samples), ranges), changed, steps
+
+
+def _run_point(index, n_replicates, random_seed, common_random_numbers, payload):
+    """Run the replicates of a point of a design together as one batch,
+    returning the mean of each outcome. The payload is the config of every
+    point, which the index picks from, and the outcomes by name"""
+    configs, outcomes = payload
+    results = run_vectorised_batch(n_replicates, configs[index], random_seed,
+                                   common_random_numbers)
+    return np.array([outcome(results).mean() for outcome in outcomes.values()])
+
+
+def run_design(design, n_replicates=10, outcomes=None, workers=None, config=None,
+               random_seed=None, common_random_numbers=True):
+    """Run a number of replicates of the vectorised model at each point of a
+    design, across a pool of worker processes as in run_ensemble, returning
+    an array of the mean of each outcome, defaulting to OUTCOMES, with shape
+    (point, outcome). The config the design changes defaults to the
+    parameters currently in Params. Every point is run with the same random
+    seed, and by default with common random numbers, so the differences
+    between points are due to the parameters rather than to noise"""
+    if config is None:
+        config = Config.from_params()
+    if outcomes is None:
+        outcomes = OUTCOMES
+    random_seed = get_random_seed(random_seed)
+    configs = [get_config(config, point) for point in design]
+    arguments = [
+        (index, n_replicates, random_seed, common_random_numbers)
+        for index in range(len(design))
+    ]
+    # The worker processes are given the configs and outcomes once
+    return np.array(parallel_map(_run_point, arguments, workers, (configs, outcomes)))
+
+
+def sobol_indices(ranges, n=256, n_replicates=10, outcomes=None, workers=None, config=None,
+                  random_seed=None):
+    """Estimate the first order and total Sobol indices of each parameter
+    over its range, given as for saltelli_design with n base points, for
+    each outcome, defaulting to OUTCOMES, of the mean of a number of
+    replicates (see run_design). Return a table with a row for each outcome
+    and parameter. The indices are estimated with Jansen's estimators,
+    which are non-negative for the total index and more accurate than
+    Sobol's original ones for small first order indices. Indices of
+    parameters which don't change an outcome at all in the design are NaN"""
+    if outcomes is None:
+        outcomes = OUTCOMES
+    design = saltelli_design(ranges, n, random_seed)
+    values = run_design(design, n_replicates, outcomes, workers, config, random_seed)
+    values = values.reshape(len(ranges) + 2, n, len(outcomes))
+    f_a, f_b, f_ab = values[0], values[1], values[2:]
+
+    variance = np.concatenate((f_a, f_b)).var(axis=0, ddof=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        first_order = 1 - ((f_b - f_ab) ** 2).mean(axis=1) / (2 * variance)
+        total = ((f_a - f_ab) ** 2).mean(axis=1) / (2 * variance)
+
+    rows = []
+    for j, outcome in enumerate(outcomes):
+        for i, name in enumerate(ranges):
+            rows.append({
+                "Outcome": outcome,
+                "Parameter": name,
+                "First order": first_order[i, j],
+                "Total": total[i, j],
+            })
+    return pd.DataFrame(rows).set_index(["Outcome", "Parameter"])
+
+
+def morris_screening(ranges, n_trajectories=20, num_levels=4, n_replicates=10, outcomes=None,
+                     workers=None, config=None, random_seed=None):
+    """Screen the parameters over their ranges by the elementary effects of
+    the trajectories of a Morris design (see morris_design) on each outcome,
+    defaulting to OUTCOMES, of the mean of a number of replicates (see
+    run_design). An elementary effect is the change in an outcome over the
+    step in a parameter, as a fraction of its range. Return a table with a
+    row for each outcome and parameter, giving the mean of the absolute
+    elementary effects (mu*), which ranks the parameters by influence, their
+    mean (mu), and their standard deviation (sigma), which is large for
+    parameters with non-linear effects or interactions"""
+    if outcomes is None:
+        outcomes = OUTCOMES
+    design, changed, steps = morris_design(ranges, n_trajectories, num_levels, random_seed)
+    values = run_design(design, n_replicates, outcomes, workers, config, random_seed)
+    values = values.reshape(n_trajectories, len(ranges) + 1, len(outcomes))
+
+    effects = np.empty((n_trajectories, len(ranges), len(outcomes)))
+    trajectories = np.arange(n_trajectories)[:, None]
+    effects[trajectories, changed] = np.diff(values, axis=1) / steps[:, :, None]
+
+    rows = []
+    for j, outcome in enumerate(outcomes):
+        for i, name in enumerate(ranges):
+            rows.append({
+                "Outcome": outcome,
+                "Parameter": name,
+                "Mu star": np.abs(effects[:, i, j]).mean(),
+                "Mu": effects[:, i, j].mean(),
+                "Sigma": effects[:, i, j].std(ddof=1) if n_trajectories > 1 else np.nan,
+            })
+    return pd.DataFrame(rows).set_index(["Outcome", "Parameter"])
@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Answer "what if" questions about the model instantly, if approximately,
+with an emulator trained on runs of the simulator across ranges of some
+parameters. The emulator is a Gaussian process for each outcome, which
+gives the uncertainty of each of its answers as well as the answer itself,
+and can be saved to and loaded from disk. Queries outside the ranges the
+emulator was trained on are flagged, and can be answered by running the
+simulator instead"""
+
+from collections import namedtuple
+from functools import partial
+from math import sqrt
+
+import numpy as np
+
+from .model_minimal import Config
+from .cache import get_config_key
+from .ensemble import DEAD, get_final_deaths, get_peak_isolated, get_series_labels
+from .sensitivity import run_design
+from .design import get_config, latin_hypercube_design
+from .model_vectorised import run_vectorised_batch
+
+# The answer to a query of each outcome by name, with its standard
+# deviation, and whether it came from the emulator or from the simulator
+Prediction = namedtuple("Prediction", ["mean", "std", "emulated"])
+
+# The changes in the log of a hyperparameter tried in each pass of fitting
+_FIT_STEPS = (1.0, 0.5, 0.25)
+
+
+def get_peak(results, row):
+    """Return the peak value of a series by its row in each replicate of an
+    ensemble"""
+    return results[:, row].max(axis=1)
+
+
+def get_outcomes(config=None):
+    """Return the outcomes emulators are trained on by default for a config,
+    defaulting to the parameters currently in Params, as functions of the
+    (replicate, series, timestep) array of an ensemble by name: the final
+    number of deaths, the peak number of people infected at each tier of the
+    config's drugs, and the peak number of people isolated"""
+    labels = get_series_labels(config)
+    outcomes = {
+        "Deaths": get_final_deaths,
+        "Peak infected with no resistance": partial(get_peak, row=0),
+    }
+    for row, label in enumerate(labels[1:DEAD], 1):
+        outcomes["Peak " + label[0].lower() + label[1:]] = partial(get_peak, row=row)
+    outcomes["Peak isolated"] = get_peak_isolated
+    return outcomes
+
+
+def _is_default_outcome(name, function, config=None):
+    """Return whether the function of an outcome is the default one of that
+    name from get_outcomes for a config"""
+    default = get_outcomes(config).get(name)
+    if isinstance(default, partial) and isinstance(function, partial):
+        return (default.func, default.args, default.keywords) == (
+            function.func, function.args, function.keywords
+        )
+    return default is function
+
+
+def _scale_inputs(inputs):
+    """Return the lowest and highest value of each parameter of a (point,
+    parameter) array, and the points scaled to the unit hypercube between
+    them"""
+    low, high = inputs.min(axis=0), inputs.max(axis=0)
+    return low, high, (inputs - low) / np.where(high > low, high - low, 1)
+
+
+def _standardise(values):
+    """Return the mean and standard deviation of each outcome of a (point,
+    outcome) array, and the values scaled to zero mean and unit variance"""
+    means, scales = values.mean(axis=0), values.std(axis=0)
+    scales[scales == 0] = 1
+    return means, scales, (values - means) / scales
+
+
+def _squared_distances(x, y, length_scales):
+    """Return the (outcome, x, y) array of the squared distances between
+    every pair of points of x and y, scaled by the length scales of each
+    outcome"""
+    differences = (x[:, None, :] - y[None, :, :]) ** 2
+    return np.einsum("xyd,od->oxy", differences, 1 / length_scales ** 2)
+
+
+def _negative_log_likelihood(distances, y, signal, noise):
+    """Return the negative log marginal likelihood of some values under a
+    Gaussian process with a squared exponential kernel, given the squared
+    scaled distances between their points"""
+    covariance = signal * np.exp(-0.5 * distances) + noise * np.eye(len(y))
+    try:
+        cholesky = np.linalg.cholesky(covariance)
+    except np.linalg.LinAlgError:
+        return np.inf
+    alpha = np.linalg.solve(cholesky, y)
+    return 0.5 * alpha @ alpha + np.log(np.diag(cholesky)).sum()
+
+
+class Emulator:
+    """A Gaussian process emulator of the mean outcomes of the model over the
+    ranges of some parameters, with one process per outcome, each with a
+    squared exponential kernel with its own length scale for each parameter.
+    The parameters are scaled to the unit hypercube of their training ranges
+    and the outcomes to zero mean and unit variance before fitting"""
+
+    def __init__(self, parameters, outcomes, inputs, values, length_scales, signals, noises,
+                 ranges=None, n_replicates=None, config=None, outcome_functions=None,
+                 config_key=None, custom_outcomes=None):
+        """Initialise the emulator from the (point, parameter) array of the
+        parameter values of its training points, the (point, outcome) array
+        of the mean outcomes there, and the fitted hyperparameters of each
+        outcome, precomputing what each query needs. The ranges of the
+        parameters it was trained over, as a dictionary of (low, high)
+        tuples by name, are its domain, and default to the smallest ranges
+        holding the training points. The number of replicates, config and
+        outcome functions are those used to train it, to run the simulator
+        the same way for queries outside the domain. A loaded emulator only
+        knows the key of its config (see get_config_key), and which of its
+        outcomes had custom functions rather than those of get_outcomes"""
+        self.parameters = list(parameters)
+        self.outcomes = list(outcomes)
+        self.inputs = np.asarray(inputs, dtype=float)
+        self.values = np.asarray(values, dtype=float)
+        self.low, self.high, self._scaled_inputs = _scale_inputs(self.inputs)
+        if ranges is None:
+            ranges = dict(zip(self.parameters, zip(self.low.tolist(), self.high.tolist())))
+        self.ranges = {name: tuple(ranges[name]) for name in self.parameters}
+        self.outcome_means, self.outcome_scales, targets = _standardise(self.values)
+        self.length_scales = np.asarray(length_scales, dtype=float)
+        self.signals = np.asarray(signals, dtype=float)
+        self.noises = np.asarray(noises, dtype=float)
+        self.n_replicates = n_replicates
+        self.config = config
+        if config is not None:
+            config_key = get_config_key(config)
+        self.config_key = config_key
+        self.outcome_functions = outcome_functions
+        if outcome_functions is not None:
+            custom_outcomes = [
+                name for name in self.outcomes
+                if not _is_default_outcome(name, outcome_functions[name], config)
+            ]
+        self.custom_outcomes = list(custom_outcomes or [])
+
+        # Invert the covariance of the training points once, so each query
+        # is only a few products with them
+        distances = _squared_distances(self._scaled_inputs, self._scaled_inputs,
+                                       self.length_scales)
+        covariances = self.signals[:, None, None] * np.exp(-0.5 * distances)
+        covariances += self.noises[:, None, None] * np.eye(len(self.inputs))
+        self._inverses = np.linalg.inv(covariances)
+        self._alphas = np.einsum("oxy,yo->ox", self._inverses, targets)
+
+    @classmethod
+    def fit(cls, inputs, values, parameters, outcomes, ranges=None, n_replicates=None,
+            config=None, outcome_functions=None):
+        """Return an emulator fitted to the (point, parameter) array of the
+        parameter values of some training points and the (point, outcome)
+        array of the mean outcomes there, with the rest of the arguments as
+        for the emulator itself. The hyperparameters of each
+        outcome are chosen to maximise the marginal likelihood, by searching
+        along each in turn in smaller and smaller steps"""
+        inputs = np.asarray(inputs, dtype=float)
+        values = np.asarray(values, dtype=float)
+        scaled = _scale_inputs(inputs)[2]
+        targets = _standardise(values)[2]
+
+        differences = (scaled[:, None, :] - scaled[None, :, :]) ** 2
+        num_parameters = inputs.shape[1]
+        hyperparameters = []
+        for y in targets.T:
+            # The log of each length scale, then of the signal and noise
+            # variances
+            theta = np.concatenate((np.full(num_parameters, np.log(0.5)), [0, np.log(0.01)]))
+
+            def objective(theta):
+                distances = differences @ np.exp(-2 * theta[:num_parameters])
+                return _negative_log_likelihood(distances, y, *np.exp(theta[num_parameters:]))
+
+            best = objective(theta)
+            for step in _FIT_STEPS:
+                for k in range(len(theta)):
+                    for change in (-2 * step, -step, step, 2 * step):
+                        trial = theta.copy()
+                        trial[k] += change
+                        value = objective(trial)
+                        if value < best:
+                            best, theta = value, trial
+            hyperparameters.append(np.exp(theta))
+        hyperparameters = np.array(hyperparameters)
+        return cls(parameters, outcomes, inputs, values, hyperparameters[:, :num_parameters],
+                   hyperparameters[:, -2], hyperparameters[:, -1], ranges, n_replicates, config,
+                   outcome_functions)
+
+    @classmethod
+    def from_sweep(cls, table, parameters, outcomes):
+        """Return an emulator fitted to a table of runs with a row per run,
+        such as from run_sweep, averaging the outcomes of the replicates of
+        each point"""
+        means = table.groupby(list(parameters), as_index=False)[list(outcomes)].mean()
+        return cls.fit(means[list(parameters)].to_numpy(), means[list(outcomes)].to_numpy(),
+                       parameters, outcomes)
+
+    def in_domain(self, point):
+        """Return whether a point, given as a dictionary of parameter values
+        by name, changes only the parameters the emulator was trained on,
+        within the ranges it was trained over, including their bounds"""
+        if set(point) != set(self.parameters):
+            return False
+        return all(low <= point[name] <= high for name, (low, high) in self.ranges.items())
+
+    def predict(self, point):
+        """Return the emulator's prediction of the mean of each outcome the
+        simulator would give at a point, with its standard deviation, which
+        includes the noise of the simulator's mean as well as the
+        emulator's uncertainty, whether or not it is within the training
+        ranges"""
+        x = np.array([point[name] for name in self.parameters], dtype=float)
+        x = (x - self.low) / np.where(self.high > self.low, self.high - self.low, 1)
+        distances = ((self._scaled_inputs - x) ** 2) @ (1 / self.length_scales.T ** 2)
+        k = (self.signals * np.exp(-0.5 * distances)).T
+        mean = (k * self._alphas).sum(axis=1)
+        projected = np.matmul(self._inverses, k[:, :, None])[:, :, 0]
+        variance = self.signals + self.noises - (projected * k).sum(axis=1)
+        std = np.sqrt(np.maximum(variance, 0)) * self.outcome_scales
+        mean = mean * self.outcome_scales + self.outcome_means
+        return Prediction(dict(zip(self.outcomes, mean.tolist())),
+                          dict(zip(self.outcomes, std.tolist())), True)
+
+    def query(self, point, config=None, random_seed=None):
+        """Return the emulator's prediction at a point if it is within the
+        training domain, or otherwise run the simulator there with the same
+        number of replicates as each training point, giving the mean outcomes
+        and their standard errors. The config the point changes defaults to
+        the one the emulator was trained with, and any other config must run
+        the model the same way, so both kinds of answer are of the same
+        scenario"""
+        if self.in_domain(point):
+            return self.predict(point)
+        if self.n_replicates is None:
+            raise ValueError(
+                "The emulator wasn't trained on simulator runs, so can't fall back on them"
+            )
+        if config is None:
+            config = self.config
+        if config is None:
+            raise ValueError("The config the emulator was trained with isn't known, so give it")
+        if self.config_key is not None and get_config_key(config) != self.config_key:
+            raise ValueError("The config isn't the one the emulator was trained with")
+        outcome_functions = self.outcome_functions
+        if outcome_functions is None:
+            if self.custom_outcomes:
+                raise ValueError(
+                    "The outcomes {} have custom functions, which aren't saved, so give them to "
+                    "Emulator.load".format(self.custom_outcomes)
+                )
+            outcome_functions = get_outcomes(config)
+        missing = [name for name in self.outcomes if name not in outcome_functions]
+        if missing:
+            raise ValueError("The functions of the outcomes {} aren't known".format(missing))
+
+        results = run_vectorised_batch(self.n_replicates, get_config(config, point), random_seed,
+                                       common_random_numbers=True)
+        mean, std = {}, {}
+        for name in self.outcomes:
+            values = outcome_functions[name](results).astype(float)
+            mean[name] = float(values.mean())
+            std[name] = float(values.std(ddof=1) / sqrt(len(values))) if len(values) > 1 else np.inf
+        return Prediction(mean, std, False)
+
+    def save(self, filename):
+        """Save the emulator to a file with np.savez, from which load makes
+        the same emulator. Functions can't be saved this way, so only the key
+        of the training config is saved, and the names of the outcomes with
+        custom functions, which must be given again to load"""
+        np.savez(
+            filename,
+            parameters=np.array(self.parameters), outcomes=np.array(self.outcomes),
+            inputs=self.inputs, values=self.values, length_scales=self.length_scales,
+            signals=self.signals, noises=self.noises,
+            ranges=np.array([self.ranges[name] for name in self.parameters], dtype=float),
+            n_replicates=np.array(-1 if self.n_replicates is None else self.n_replicates),
+            config_key=np.array("" if self.config_key is None else self.config_key),
+            custom_outcomes=np.array(self.custom_outcomes, dtype=str),
+        )
+
+    @classmethod
+    def load(cls, filename, config=None, outcome_functions=None):
+        """Load an emulator saved with save, with the config it was trained
+        with, which is checked against the saved key, and the functions of
+        its custom outcomes, if any, for it to fall back on the simulator"""
+        with np.load(filename, allow_pickle=False) as data:
+            parameters = data["parameters"].tolist()
+            n_replicates = int(data["n_replicates"])
+            config_key = str(data["config_key"]) or None
+            custom_outcomes = data["custom_outcomes"].tolist()
+            emulator = cls(parameters, data["outcomes"].tolist(), data["inputs"], data["values"],
+                           data["length_scales"], data["signals"], data["noises"],
+                           dict(zip(parameters, data["ranges"].tolist())),
+                           None if n_replicates < 0 else n_replicates,
+                           config_key=config_key, custom_outcomes=custom_outcomes)
+        if config is not None:
+            if config_key is not None and get_config_key(config) != config_key:
+                raise ValueError("The config isn't the one the emulator was trained with")
+            emulator.config = config
+        if outcome_functions is not None:
+            functions = get_outcomes(config)
+            functions.update(outcome_functions)
+            emulator.outcome_functions = functions
+        return emulator
+
+
+def train_emulator(ranges, n_points=100, n_replicates=10, outcomes=None, workers=None,
+                   config=None, random_seed=None):
+    """Return an emulator trained on a Latin hypercube design of a number of
+    points within the range of each parameter, given as a dictionary of
+    (low, high) tuples by parameter name as for a sweep, for each outcome,
+    defaulting to get_outcomes, of the mean of a number of replicates at
+    each point (see run_design). The config the design changes defaults to
+    the parameters currently in Params. The emulator's domain is the ranges,
+    and it keeps the config to fall back on the simulator with"""
+    if config is None:
+        config = Config.from_params()
+    if outcomes is None:
+        outcomes = get_outcomes(config)
+    design = latin_hypercube_design(ranges, n_points, random_seed)
+    values = run_design(design, n_replicates, outcomes, workers, config, random_seed)
+    inputs = [[point[name] for name in ranges] for point in design]
+    return Emulator.fit(inputs, values, list(ranges), list(outcomes), ranges, n_replicates,
+                        config, outcomes)
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Sweep the model over a design of parameter values, running every point of
+the design for a number of replicates across a pool of worker processes, and
+collect a summary of every run into one table with a row per run. Designs are
+lists of dictionaries of parameter values by their names in Params, made by
+the functions in design. The sweep can also be run from the command line, for
+example:
+
+    python -m tiered_antibiotic_resistance_model.sweep --design lhs --points 20
+        --replicates 10 --range PROBABILITY_MUTATION 0.1 0.4
+        --range PRODUCT_DETECTION_LEVEL 0 1 --output sweep.csv"""
+
+import argparse
+import ast
+import sys
+
+import numpy as np
+import pandas as pd
+
+from .model_minimal import Settings, Config, run
+from .model_vectorised import run_vectorised
+from .model_compartmental import run_compartmental
+from .model_event_driven import run_event_driven
+from .ensemble import DEAD, get_series, get_series_labels, spawn_seeds, parallel_map
+from .design import grid_design, latin_hypercube_design, sobol_design, get_config
+
+# The engines which can be chosen from the command line by name
+ENGINES = {
+    "model": run,
+    "vectorised": run_vectorised,
+    "compartmental": run_compartmental,
+    "event_driven": run_event_driven,
+}
+
+
+def get_summary_labels(config=None):
+    """Return the label of each value in the summaries from summarise of runs
+    of a config, defaulting to the parameters currently in Params"""
+    return ["Peak infected"] + get_series_labels(config)
+
+
+def summarise(series):
+    """Return the peak number of people infected, then the final value of each
+    series, of the (series, timestep) array of a run"""
+    infected = series[:DEAD].sum(axis=0)
+    return np.concatenate(([infected.max()], series[:, -1]))
+
+
+def _run_point(engine, index, random_seed, configs):
+    """Run one replicate of the model at a point of a design, given by the
+    index of its config in the configs of every point, returning the
+    summary of the run"""
+    m = engine(configs[index], random_seed)
+    return summarise(get_series(m.data_handler))
+
+
+def run_sweep(design, n_replicates=1, workers=None, engine=run, config=None, random_seed=None):
+    """Run a number of replicates of the model at each point of a design,
+    across a pool of worker processes as in run_ensemble, returning a table
+    with a row per run, with the parameter values of its point, its replicate
+    number and random seed, then its summary (see get_summary_labels). The
+    config the design changes defaults to the parameters currently in Params.
+    The same replicate of each point uses the same random seed, spawned from
+    the root seed, so the differences between points aren't swamped by the
+    differences between their random streams"""
+    if config is None:
+        config = Config.from_params()
+    configs = [get_config(config, point) for point in design]
+    random_seeds = spawn_seeds(n_replicates, random_seed)
+    runs = [
+        (index, replicate, seed)
+        for index in range(len(design))
+        for replicate, seed in enumerate(random_seeds)
+    ]
+    arguments = [(engine, index, seed) for index, _, seed in runs]
+    # The worker processes are given the config of every point once
+    summaries = parallel_map(_run_point, arguments, workers, configs)
+
+    rows = []
+    for (index, replicate, seed), summary in zip(runs, summaries):
+        row = dict(design[index])
+        row["replicate"] = replicate
+        row["random_seed"] = seed
+        row.update(zip(get_summary_labels(configs[index]), summary.tolist()))
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def _parse_value(value):
+    """Parse a parameter value from the command line as a Python literal,
+    falling back on the string itself"""
+    try:
+        return ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        return value
+
+
+def main(args=None):
+    """Run a sweep from the command line, writing the table of results as CSV
+    to a file or the standard output"""
+    parser = argparse.ArgumentParser(description=(
+        "Sweep the model over a design of parameter values, running every "
+        "point for a number of replicates in parallel"
+    ))
+    parser.add_argument("--design", choices=("grid", "lhs", "sobol"), default="grid",
+                        help="how to choose the points from the parameter ranges")
+    parser.add_argument("--range", nargs=3, action="append", default=[],
+                        metavar=("NAME", "LOW", "HIGH"),
+                        help="the range of a parameter, with integer bounds for integer parameters")
+    parser.add_argument("--values", nargs="+", action="append", default=[],
+                        metavar=("NAME", "VALUE"),
+                        help="the values of a parameter to try (grid designs only)")
+    parser.add_argument("--points", type=int, default=5,
+                        help="the number of points sampled, or per range for grids")
+    parser.add_argument("--replicates", type=int, default=1,
+                        help="the number of replicates of each point")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="the number of worker processes, defaulting to the number of CPUs")
+    parser.add_argument("--engine", choices=ENGINES, default="model",
+                        help="the engine to run the model with")
+    parser.add_argument("--seed", type=int, default=Settings.RANDOM_SEED,
+                        help="the root random seed of the design and replicates")
+    parser.add_argument("--output", default=None,
+                        help="the CSV file to write the results to, defaulting to the standard output")
+    args = parser.parse_args(args)
+
+    ranges = {name: (_parse_value(low), _parse_value(high)) for name, low, high in args.range}
+    values = {}
+    for name, *parameter_values in args.values:
+        if not parameter_values:
+            parser.error("--values {} needs at least one value".format(name))
+        values[name] = [_parse_value(value) for value in parameter_values]
+    for name in list(ranges) + list(values):
+        if name not in Config._fields:
+            parser.error("{} isn't a parameter".format(name))
+    if not ranges and not values:
+        parser.error("give at least one --range or --values to sweep over")
+
+    if args.design == "grid":
+        # Try evenly spaced values across each range
+        for name, (low, high) in ranges.items():
+            points = np.linspace(low, high, args.points)
+            if isinstance(low, int) and isinstance(high, int):
+                points = np.unique(np.round(points).astype(int))
+            values[name] = points.tolist()
+        design = grid_design(values)
+    else:
+        if values:
+            parser.error("--values can only be used with grid designs")
+        if args.design == "lhs":
+            design = latin_hypercube_design(ranges, args.points, args.seed)
+        else:
+            design = sobol_design(ranges, args.points, args.seed)
+
+    # Leave reporting to the table of results
+    Settings.REPORT_PROGRESS = False
+    Settings.PRINT_DATA = False
+    results = run_sweep(design, args.replicates, args.workers, ENGINES[args.engine],
+                        random_seed=args.seed)
+    results.to_csv(args.output if args.output is not None else sys.stdout, index=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -19,27 +19,19 @@ if __name__ == "__main__":
     Settings.RANDOM_SEED = None
     Settings.DRAW_GRAPH = False
 
-    deaths_with = []
-    deaths_without = []
-    peak_isolation_timestep_with = []
-    peak_isolation_timestep_without = []
-
-    for _ in range(1):
-        Params.PRODUCT_IN_USE = True
-        m = run()
-        deaths_with.append(m.data_handler.get_death_data()[-1])
-        iso_data = m.data_handler.get_isolated_data()
-        peak_isolation_timestep_with.append(
-            iso_data.index(max(iso_data))
-        )
-
-        Params.PRODUCT_IN_USE = False
-        m = run()
-        deaths_without.append(m.data_handler.get_death_data()[-1])
-        iso_data = m.data_handler.get_isolated_data()
-        peak_isolation_timestep_without.append(
-            iso_data.index(max(iso_data))
-        )
+    dead = get_series_labels().index("Dead")
+    isolated = get_series_labels().index("Isolated")
+
+    # Run the replicates of each scenario across all the CPUs
+    Params.PRODUCT_IN_USE = True
+    results_with = run_ensemble(50)
+    Params.PRODUCT_IN_USE = False
+    results_without = run_ensemble(50)
+
+    deaths_with = results_with[:, dead, -1].tolist()
+    deaths_without = results_without[:, dead, -1].tolist()
+    peak_isolation_timestep_with = results_with[:, isolated].argmax(axis=1).tolist()
+    peak_isolation_timestep_without = results_without[:, isolated].argmax(axis=1).tolist()
 
     print("Deaths with:", deaths_with)
     print("Deaths without:", deaths_without)